@@ -8,14 +8,20 @@
 from arpeggio import SemanticAction
 from metamodel import *
 
-def check_constraints(node, model, debug, action_name):
+def check_constraints(node, model, debug, action_name, scope = None):
+    """
+    Binds constraint specs of node to their definitions and checks that they
+    apply to node. Names are resolved from scope, node by default.
+    """
+    if scope is None:
+        scope = node
     if node.constraints and len(node.constraints) > 0:
         for constr_spec in node.constraints:
             if debug:
                 msg = "DEBUG2: Entered %s, constr found" % action_name
                 print(msg, constr_spec)
 
-            qid = model.get_qid(constr_spec.ident)
+            qid = model.get_ref_qid(constr_spec, scope)
             if debug:
                 msg = "DEBUG2: Entered %s, qid found" % action_name
                 print(msg, qid)
@@ -24,13 +30,13 @@ def check_constraints(node, model, debug, action_name):
             if debug:
                 msg = "DEBUG2: Entered %s, found constr" % action_name
                 print(msg, constr_def)
-            constr_def.check_applies(node, node.name)
-            constr_def.check_params(constr_spec)
+            checker = constr_def.checker
+            if checker is not None:
+                checker.check_applies(node, node.name)
+            model.bind_constraint(constr_spec, scope)
             if debug:
                 msg = "DEBUG2: Constr_Spec (%s), found constr" % action_name
                 print(msg, constr_spec)
-            constr_spec._replace_qids(model)
-            constr_spec._bound = constr_def
 
 class ModelAction(SemanticAction):
     """
@@ -52,7 +58,12 @@ class ModelAction(SemanticAction):
             elif type(val) is Package:
                 model.add_package(val)
 
-        if parser.debugDomm:
+        # Model is complete after first pass, so all references are resolved
+        # at once, second passes only check and use them
+        if not parser.skip_crossref:
+            model.resolve_refs()
+
+        if parser.debug_actions:
             print("DEBUG ModelAction returns: ", model)
 
         return model
@@ -70,7 +81,7 @@ class NamedElementAction(SemanticAction):
         # omitted by the parser
         filter_children = (x for x in children if x != '"' )
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("Debug NamedElementAction (children)", children)
 
         for ind, val in enumerate(filter_children):
@@ -83,7 +94,7 @@ class NamedElementAction(SemanticAction):
                 else:
                     retVal.long_desc = val
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("Debug NamedElementAction returns ", retVal)
 
         return retVal
@@ -93,7 +104,7 @@ class StringAction(SemanticAction):
     Represents the basic string identified in programm
     """
     def first_pass(self, parser, node, children):
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("Debug StringAction (children)", children)
 
         return children[0]
@@ -150,7 +161,7 @@ class CommonTagAction(SemanticAction):
     def first_pass(self, parser, node, children):
         tag = CommonTag()
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG CommonTagAction children: ", children)
 
         for value in children:
@@ -164,7 +175,7 @@ class CommonTagAction(SemanticAction):
                tag.set_descs(value)
 
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG CommonTagAction returns: ", tag)
         return tag
 
@@ -172,7 +183,7 @@ class ApplyDefAction(SemanticAction):
     def first_pass(self, parser, node, children):
         app_def = ApplyDef()
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG ApplyDefAction children: ", children)
 
         filter_children = (x for x in children if x != "appliesTo")
@@ -180,7 +191,7 @@ class ApplyDefAction(SemanticAction):
         for val in children:
             app_def.add_apply(val)
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG ApplyDefAction returns: ", app_def)
         return app_def
 
@@ -188,7 +199,7 @@ class ConstrDefAction(SemanticAction):
     def first_pass(self, parser, node, children):
         constr_def = ConstrDef()
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG ConstrDefAction children: ", children)
 
         # Filter all irrelevant strings from query
@@ -227,18 +238,18 @@ class DataTypeAction(SemanticAction):
     def first_pass(self, parser, node, children):
         data_type = DataType(built_in = self.built_in)
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG DataTypeAction entered (children): ", children)
 
         for val in children:
             if type(val) is NamedElement:
-                if parser.debugDomm:
+                if parser.debug_actions:
                     print("DEBUG DataTypeAction entered (val): ", val)
                 data_type.set_descs(val)
             elif type(val) is Id:
                 data_type.name = val._id
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG DataTypeAction returns: ", data_type)
 
 
@@ -246,7 +257,7 @@ class DataTypeAction(SemanticAction):
 
 class ElipsisAction(SemanticAction):
     def first_pass(self, parser, node, children):
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG ElipsisAction called")
         return "..."
 
@@ -264,7 +275,7 @@ class ConstraintAction(SemanticAction):
     def first_pass(self, parser, node, children):
         constraint = Constraint(built_in = self.built_in, \
                                 constr_type = self.constr_type)
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG ConstraintAction entered children: ", children)
 
         for i in children:
@@ -273,7 +284,7 @@ class ConstraintAction(SemanticAction):
             elif type(i) is Id:
                 constraint.name = i._id
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG ConstraintAction returns: ", constraint)
 
         return constraint
@@ -284,7 +295,7 @@ class PackageAction(SemanticAction):
 
         filter_children = (x for x in children if type(x) is not str)
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG PackageAction (children)", children)
 
         for val in filter_children:
@@ -303,19 +314,19 @@ class TypeDefAction(SemanticAction):
     def first_pass(self, parser, node, children):
         type_def = TypeDef()
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG TypeDefAction(children) enter: ", children)
 
         for ind, val in enumerate(children):
             if type(val) is Qid:
-                type_def.set_type(val._id)
+                type_def.set_type(val._canon)
             elif type(val) is Id:
                 type_def.name = val._id
             elif type(val) is MultiObj:
                 type_def.container = val.container
                 type_def.set_multi(val.multi)
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG TypeDefAction returns: ", type_def)
 
         return type_def
@@ -334,14 +345,14 @@ class MultiObj(object):
 class MultiAction(SemanticAction):
     def first_pass(self, parser, node, children):
         retval = MultiObj()
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG MultiAction(children) enter: ", children)
 
         for val in children:
             if type(val) is int:
                 retval.multi = val
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG MultiAction returns: ", retval)
 
         return retval
@@ -354,7 +365,7 @@ class ConstraintSpecAction(SemanticAction):
         filter_children = (x for x in children\
                             if x != "," and x != "(" and x != ")")
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG ConstraintSpecAction enter (children): ", children)
 
         for ind, val in enumerate(filter_children):
@@ -369,7 +380,7 @@ class ConstraintSpecAction(SemanticAction):
             elif type(val) is int:
                 temp_spec.add_param(val)
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG ConstraintSpecAction returns: ", temp_spec)
 
         return temp_spec
@@ -392,7 +403,7 @@ class ConstraintSpecListAction(SemanticAction):
         filter_children = (x for x in children \
                             if type(x) is ConstraintSpec or type(x) is Id)
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG ConstraintSpecListAction enter (children): ",\
                     children)
 
@@ -411,7 +422,7 @@ class ConstraintSpecListAction(SemanticAction):
 
             list_specs.specs.add(to_add)
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG ConstraintSpecListAction returns (list_specs): ",\
                     list_specs)
 
@@ -434,7 +445,7 @@ class RefAction(SemanticAction):
             if type(val) is Qid:
                 retVal = RefObj(val)
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG RefAction returns: ", retVal)
 
         return retVal
@@ -443,7 +454,7 @@ class PropertyAction(SemanticAction):
     def first_pass(self, parser, node, children):
         prop = Property()
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG PropertyAction entered (children): {}\n"\
                     .format(children))
 
@@ -464,7 +475,7 @@ class PropertyAction(SemanticAction):
                 prop.type_def = val
 
             elif val == "+":
-                if parser.debugDomm:
+                if parser.debug_actions:
                     print("DEBUG PropertyAction  containment on enter: {}\n"\
                             .format(prop.relationship))
 
@@ -473,11 +484,11 @@ class PropertyAction(SemanticAction):
 
                 prop.relationship.containment = True
 
-                if parser.debugDomm:
+                if parser.debug_actions:
                     print("DEBUG PropertyAction  containment (prop): {}\n"\
                             .format(prop.relationship))
             elif type(val) is RefObj:
-                if parser.debugDomm:
+                if parser.debug_actions:
                     print("DEBUG PropertyAction  RefObj on enter: {}\n"\
                             .format(prop.relationship))
 
@@ -486,7 +497,7 @@ class PropertyAction(SemanticAction):
 
                 prop.relationship.opposite_end = val.ident
 
-                if parser.debugDomm:
+                if parser.debug_actions:
                     print("DEBUG PropertyAction  RefObj (prop): {}\n"\
                             .format(prop.relationship))
             elif type(val) is SpecsObj:
@@ -507,7 +518,7 @@ class PropertyAction(SemanticAction):
                 txt += " unique"
             raise InvalidCollectionProperty(prop.name, txt)
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG PropertyAction returns: ", prop)
             print("DEBUG PropertyAction returns prop.relationship", \
                     prop.relationship)
@@ -517,7 +528,7 @@ class PropertyAction(SemanticAction):
     def second_pass(self, parser, node):
         if not parser.skip_crossref:
             model = node._parent_model
-            qual_str = model.get_qid(node.type_def.type)
+            qual_str = model.get_ref_qid(node.type_def, node)
 
             if qual_str in model.qual_elems:
                 bound_elem = model.qual_elems[qual_str]
@@ -530,7 +541,7 @@ class PropertyAction(SemanticAction):
             else:
                 raise TypeNotFoundError(qual_str)
 
-            check_constraints(node, model, parser.debugDomm, "PropertyAction")
+            check_constraints(node, model, parser.debug_actions, "PropertyAction")
 
             rela_type = RelType.Reference
             # If node is a reference and it isn't filled
@@ -572,7 +583,8 @@ class PropertyAction(SemanticAction):
                 elif node.relationship.opposite_end is not None:
                     parent = node._parent
                     # Find element that defines the opposite end
-                    opp_str = model.get_qid(node.relationship.opposite_end)
+                    opp_str = model.get_member_qid(node.type_def._bound,\
+                        node.relationship.opposite_end)
                     opp_side = None
 
                     # Extract the opposite side
@@ -583,7 +595,7 @@ class PropertyAction(SemanticAction):
                         raise TypeNotFoundError(not_found)
 
                     opp_type = model.qual_elems[\
-                                        model.get_qid(opp_side.type_def.type)]
+                                model.get_ref_qid(opp_side.type_def, opp_side)]
                     node_type = node.type_def._bound
 
 
@@ -599,7 +611,8 @@ class PropertyAction(SemanticAction):
 
                         if opp_side.relationship.opposite_end:
                             opp_side_end = opp_side.relationship.opposite_end
-                            this_end = model.get_qid(opp_side_end)
+                            this_end = model.get_member_qid(opp_type,\
+                                opp_side_end)
                             this_side = None
                             if this_end in model.qual_elems:
                                 this_side = model.qual_elems[this_end]
@@ -645,7 +658,7 @@ class PropertyAction(SemanticAction):
 
 class ExceptionAction(SemanticAction):
     def first_pass(self, parser, node, children):
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG Entered ExceptionAction")
 
         exception = ExceptionType()
@@ -662,7 +675,7 @@ class ExceptionAction(SemanticAction):
             elif type(val) is Property:
                 exception.add_prop(val)
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG  ExceptionAction returns ", exception)
 
         return exception
@@ -678,7 +691,7 @@ class ExtObj(object):
 
 class ExtDefAction(SemanticAction):
     def first_pass(self, parser, node, children):
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG ExtDefAction enter (children) ", children)
         # there are only two elements keyword and identifer
         for val in children:
@@ -687,7 +700,7 @@ class ExtDefAction(SemanticAction):
                                         ref = val,
                                         ref_type = Ref.Entity))
 
-                if parser.debugDomm:
+                if parser.debug_actions:
                     print("DEBUG ExtDefAction returned ", retVal)
 
                 return retVal
@@ -710,7 +723,7 @@ class DepDefAction(SemanticAction):
     def first_pass(self, parser, node, children):
         list_qid = []
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG Entered DepDefAction (children)", children)
 
         for val in children:
@@ -721,14 +734,14 @@ class DepDefAction(SemanticAction):
 
         retVal = DepObj(rels = [CrossRef(ref = x) for x in list_qid])
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG Entered DepDefAction returns ", retVal)
 
         return retVal
 
 class OpParamAction(SemanticAction):
     def first_pass(self, parser, node, children):
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG Entered OpParamAction (children)", children)
 
         param = OpParam()
@@ -748,7 +761,7 @@ class OpParamAction(SemanticAction):
             elif val == "unique":
                 param.unique = True
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG Entered OpParamAction returns ", param)
 
         return param
@@ -758,12 +771,12 @@ class OperationAction(SemanticAction):
         filter_children = (x for x in children \
                             if x != "(" and x != ")" and x != "{" and x != "}")
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG Entered OperationAction (children)", children)
 
         oper = Operation()
         for val in filter_children:
-            if parser.debugDomm:
+            if parser.debug_actions:
                 print("DEBUG OperationAction loop val: ", val)
             if type(val) is TypeDef:
                 oper.type_def = val
@@ -785,33 +798,34 @@ class OperationAction(SemanticAction):
                                ref_type = Ref.ExceptType)
                 oper.add_throws_exception(exc)
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG OperationAction returns", oper)
         return oper
 
     def second_pass(self, parser, node):
         if not parser.skip_crossref:
-            if parser.debugDomm:
+            if parser.debug_actions:
                 print("DEBUG2: Entered OperationAction, node ", node)
             model = node._parent_model
-            if parser.debugDomm:
+            if parser.debug_actions:
                 print("DEBUG2: Entered OperationAction, model ", model.name)
             for exception in node.throws:
-                if parser.debugDomm:
+                if parser.debug_actions:
                     print("DEBUG2: Entered OperationAction, exception ",\
                             exception)
-                model.get_elem_by_crosref(exception)
+                model.get_elem_by_crosref(exception, node)
 
             # Check constraints
-            check_constraints(node, model, parser.debugDomm, "OperationAction")
+            check_constraints(node, model, parser.debug_actions, "OperationAction")
 
             # Check constraints in params
             if node.params and len(node.params) > 0:
                 for param in node.params:
-                    check_constraints(param, model, parser.debugDomm, "OperParam")
+                    check_constraints(param, model, parser.debug_actions,\
+                        "OperParam", node)
 
             # Verify types of return type
-            qual_str = model.get_qid(node.type_def.type)
+            qual_str = model.get_ref_qid(node.type_def, node)
 
             if qual_str in model.qual_elems:
                 bound_elem = model.qual_elems[qual_str]
@@ -821,7 +835,7 @@ class OperationAction(SemanticAction):
 
             # Verify types of return params
             for param in node.params:
-                qual_str = model.get_qid(param.type_def.type)
+                qual_str = model.get_ref_qid(param.type_def, node)
                 if qual_str in model.qual_elems:
                     bound_elem = model.qual_elems[qual_str]
                     param.type_def._bound = bound_elem
@@ -838,7 +852,7 @@ class CompartmentAction(SemanticAction):
 
         filter_children = (x for x in children if type(x) is not str)
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG Entered CompartmentAction (children)", children)
 
         for val in filter_children:
@@ -851,7 +865,7 @@ class CompartmentAction(SemanticAction):
             elif type(val) is Property and not self.is_op:
                 comp.add_elem(val)
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG CompartmentAction returns", comp)
         return comp
 
@@ -862,7 +876,7 @@ class ServiceAction(SemanticAction):
         # and keywords strings from children
         filter_children =  (x for x in children if type(x) is not str)
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG Entered ServiceAction (children)", children)
 
         service = Service()
@@ -873,7 +887,7 @@ class ServiceAction(SemanticAction):
             elif type(val) is NamedElement:
                 service.set_descs(val)
             elif type(val) is ExtObj:
-                if parser.debugDomm:
+                if parser.debug_actions:
                     print("DEBUG Entered ServiceAction extends ", service)
                 service.set_extends(val.ref)
             elif type(val) is DepObj:
@@ -886,40 +900,40 @@ class ServiceAction(SemanticAction):
             elif type(val) is Compartment:
                 service.add_op_compartment(val)
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG Entered ServiceAction returns ", service)
 
         return service
 
     def second_pass(self, parser, node):
         if not parser.skip_crossref:
-            if parser.debugDomm:
+            if parser.debug_actions:
                 print("DEBUG2: Entered ServiceAction, node ", node)
             model = node._parent_model
-            if parser.debugDomm:
+            if parser.debug_actions:
                 print("DEBUG2: Entered ServiceAction, parent model ", \
                             model.name)
             # Bind extending CrossRef if they exist
             if node.extends:
-                model.get_elem_by_crosref(node.extends)
+                model.get_elem_by_crosref(node.extends, node)
                 rel = RelObj(RelType.Extends, node, node.extends._bound)
                 model._add_rel(rel)
             # Bind dependencies if they exist
             if node.dependencies and len(node.dependencies) > 0:
                 for dep in node.dependencies:
-                    model.get_elem_by_crosref(dep)
+                    model.get_elem_by_crosref(dep, node)
                     rel = RelObj(RelType.Depends, node, dep._bound)
                     model._add_rel(rel)
-                    if parser.debugDomm:
+                    if parser.debug_actions:
                         print("DEBUG2: Entered ServiceAction, dep found ", \
                             dep)
 
             # Check constraints
-            check_constraints(node, model, parser.debugDomm, "ServiceAction")
+            check_constraints(node, model, parser.debug_actions, "ServiceAction")
 
 class ValueObjectAction(SemanticAction):
     def first_pass(self, parser, node, children):
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG Entered ValueObject (children)", children)
 
         filter_children = (x for x in children if type(x) is not str)
@@ -941,40 +955,40 @@ class ValueObjectAction(SemanticAction):
             elif type(val) is Property:
                 val_obj.add_prop(val)
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG ValueObject returns ", val_obj)
 
         return val_obj
 
     def second_pass(self, parser, node):
         if not parser.skip_crossref:
-            if parser.debugDomm:
+            if parser.debug_actions:
                 print("DEBUG2: Entered ValueObjectAction, node ", node)
             model = node._parent_model
-            if parser.debugDomm:
+            if parser.debug_actions:
                 print("DEBUG2: Entered ValueObjectAction, parent model ",\
                         model.name)
              # Bind extending CrossRef if they exist
             if node.extends:
-                model.get_elem_by_crosref(node.extends)
+                model.get_elem_by_crosref(node.extends, node)
                 rel = RelObj(RelType.Extends, node, node.extends._bound)
                 model._add_rel(rel)
             # Bind dependencies if they exist
             if node.dependencies and len(node.dependencies) > 0:
                 for dep in node.dependencies:
-                    model.get_elem_by_crosref(dep)
+                    model.get_elem_by_crosref(dep, node)
                     rel = RelObj(RelType.Depends, node, dep._bound)
                     model._add_rel(rel)
-                    if parser.debugDomm:
+                    if parser.debug_actions:
                         print("DEBUG2: Entered ValueObjectAction, dep found ",\
                             dep)
 
             # Check constraints
-            check_constraints(node, model, parser.debugDomm, "ValueObjectAction")
+            check_constraints(node, model, parser.debug_actions, "ValueObjectAction")
 
 class KeyAction(SemanticAction):
     def first_pass(self, parser, node, children):
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG KeyAction children  ", children)
 
         key = Key()
@@ -984,7 +998,7 @@ class KeyAction(SemanticAction):
         for x in filter_children:
             key.add_prop(x)
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG KeyAction returns ", key)
 
         return key
@@ -1000,19 +1014,19 @@ class RelIdAction(SemanticAction):
 
 class PropRefAction(SemanticAction):
     def first_pass(self, parser, node, children):
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG PropRefAction children  ", children)
         retVal = CrossRef(ref = Id(node.value),\
             ref_type = Ref.Property)
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG PropRefAction returns  ", retVal)
 
         return retVal
 
 class ReprAction(SemanticAction):
     def first_pass(self, parser, node, children):
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG ReprAction children ", children)
 
         rep = Repr()
@@ -1022,14 +1036,14 @@ class ReprAction(SemanticAction):
         for val in filter_children:
             rep.add_elem(val)
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG ReprAction returns ", rep)
 
         return rep
 
 class EntityAction(SemanticAction):
     def first_pass(self, parser, node, children):
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG Entered EntityAction (children)", children)
 
         ent = Entity()
@@ -1055,33 +1069,33 @@ class EntityAction(SemanticAction):
             elif type(val) is Operation or type(val) is Property:
                 ent.add_feature(val)
 
-        if parser.debugDomm:
+        if parser.debug_actions:
             print("DEBUG Entered EntityAction returns", ent)
 
         return ent
 
     def second_pass(self, parser, node):
         if not parser.skip_crossref:
-            if parser.debugDomm:
+            if parser.debug_actions:
                 print("DEBUG2: Entered EntityAction, node ", node)
             model = node._parent_model
-            if parser.debugDomm:
+            if parser.debug_actions:
                 print("DEBUG2: Entered EntityAction, parent model ",\
                         model.name)
             # Bind extending CrossRef if they exist
             if node.extends:
-                model.get_elem_by_crosref(node.extends)
+                model.get_elem_by_crosref(node.extends, node)
                 rel = RelObj(RelType.Extends, node, node.extends._bound)
                 model._add_rel(rel)
             # Bind dependencies if they exist
             if node.dependencies and len(node.dependencies) > 0:
                 for dep in node.dependencies:
-                    model.get_elem_by_crosref(dep)
+                    model.get_elem_by_crosref(dep, node)
                     rel = RelObj(RelType.Depends, node, dep._bound)
                     model._add_rel(rel)
-                    if parser.debugDomm:
+                    if parser.debug_actions:
                         print("DEBUG2: Entered EntityAction, dep found ", \
                             dep)
 
             # Check constraints
-            check_constraints(node, model, parser.debugDomm, "EntityAction")
+            check_constraints(node, model, parser.debug_actions, "EntityAction")
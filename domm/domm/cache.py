@@ -0,0 +1,266 @@
+##############################################################################
+# Name: cache.py
+# Purpose: On-disk caches used by DOMMLite parser
+# Author: Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# Copyright: (c) 2014 Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# License: MIT License
+##############################################################################
+import os
+import time
+import hashlib
+import argparse
+import tempfile
+import cPickle as pickle
+
+# Environment variable that overrides the default cache folder
+CACHE_DIR_ENV = "DOMM_CACHE_DIR"
+
+def default_cache_dir():
+    """
+    Returns the folder where DOMM caches are kept. It can be overriden
+    with the DOMM_CACHE_DIR environment variable.
+    """
+    folder = os.environ.get(CACHE_DIR_ENV)
+    if not folder:
+        folder = os.path.join(os.path.expanduser("~"), ".cache", "domm")
+    return folder
+
+def source_signature(file_name):
+    """
+    Returns a cheap signature (size and modification time) of a source file,
+    used to detect changes in installed libraries like Arpeggio.
+    """
+    if file_name.endswith(".pyc") or file_name.endswith(".pyo"):
+        file_name = file_name[:-1]
+    try:
+        stat = os.stat(file_name)
+        return "%s:%s:%s" % (file_name, stat.st_size, stat.st_mtime)
+    except OSError:
+        return file_name
+
+def digest(*parts):
+    """
+    Returns a hex SHA1 digest of given string parts.
+    """
+    sha = hashlib.sha1()
+    for part in parts:
+        if type(part) is unicode:
+            part = part.encode("utf-8")
+        sha.update(str(part))
+        sha.update("\0")
+    return sha.hexdigest()
+
+def atomic_write(file_name, data):
+    """
+    Writes data into file_name so that concurrent readers never observe
+    a partially written file.
+    """
+    folder = os.path.dirname(file_name)
+    fd, tmp_name = tempfile.mkstemp(dir = folder, suffix = ".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+        os.rename(tmp_name, file_name)
+    except:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+
+class FileCache(object):
+    """
+    Base class for caches keeping one file per key in a cache folder.
+
+    Args:
+        folder(str): folder in which entries are stored. When None
+            a subfolder of the default DOMM cache folder is used.
+    """
+    # Name of the subfolder of default cache folder
+    subfolder = None
+
+    def __init__(self, folder = None):
+        super(FileCache, self).__init__()
+        self._folder = folder
+
+    @property
+    def folder(self):
+        if self._folder is None:
+            self._folder = os.path.join(default_cache_dir(), self.subfolder)
+        return self._folder
+
+    def _path(self, key):
+        return os.path.join(self.folder, "%s.pickle" % key)
+
+    def load(self, key):
+        """
+        Returns data stored under key or None if there is no cache entry.
+        """
+        try:
+            with open(self._path(key), "rb") as cache_file:
+                return cache_file.read()
+        except IOError:
+            return None
+
+    def store(self, key, data):
+        """
+        Stores data under key. Failures to write are ignored, since the
+        cache is only an optimization.
+        """
+        try:
+            if not os.path.isdir(self.folder):
+                os.makedirs(self.folder)
+            atomic_write(self._path(key), data)
+        except (IOError, OSError):
+            pass
+
+    def remove(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def entries(self):
+        """
+        Returns list of (key, size, last_used) tuples for all entries, least
+        recently used first.
+        """
+        retval = []
+        if os.path.isdir(self.folder):
+            for name in os.listdir(self.folder):
+                if name.endswith(".pickle"):
+                    try:
+                        stat = os.stat(os.path.join(self.folder, name))
+                    except OSError:
+                        # Removed by another process in the meantime
+                        continue
+                    retval.append((name[:-len(".pickle")], stat.st_size,\
+                        stat.st_mtime))
+        retval.sort(key = lambda x: x[2])
+        return retval
+
+    def size(self):
+        return sum(x[1] for x in self.entries())
+
+    def clear(self):
+        """
+        Removes all cache entries.
+        """
+        for key, size, last_used in self.entries():
+            self.remove(key)
+
+class ModelCache(FileCache):
+    """
+    Content addressed cache of parsed and validated DOMMLite models.
+
+    Models are stored pickled under a digest of the parsed content, the
+    version of the grammar and semantic actions that produced them and the
+    cross referencing mode. The cache is bounded in size, when it grows over
+    max_size least recently used models are evicted. Size of the cache is
+    listed once and then counted as models are stored, so models stored by
+    other processes are only noticed by the next prune.
+
+    Args:
+        folder(str): folder in which models are stored
+        max_size(int): maximal size of the cache in bytes
+    """
+    subfolder = "models"
+
+    def __init__(self, folder = None, max_size = 512 * 1024 * 1024):
+        super(ModelCache, self).__init__(folder)
+        self.max_size = max_size
+        self._size = None
+
+    def key(self, content, version, skip_crossref):
+        return digest(content, version, skip_crossref)
+
+    def get(self, key):
+        """
+        Returns model stored under key or None on cache miss.
+        """
+        data = self.load(key)
+        if data is None:
+            return None
+        try:
+            model = pickle.loads(data)
+        except Exception:
+            # Corrupted entry or one written by incompatible code
+            self.remove(key)
+            return None
+
+        # Modification time of the entry tracks when it was last used
+        try:
+            os.utime(self._path(key), None)
+        except OSError:
+            pass
+        return model
+
+    def put(self, key, model):
+        """
+        Stores model under key and evicts least recently used models if
+        the cache got too big.
+        """
+        data = pickle.dumps(model, pickle.HIGHEST_PROTOCOL)
+        if self._size is None:
+            self._size = self.size()
+        self.store(key, data)
+        self._size += len(data)
+        if self._size > self.max_size:
+            self.prune()
+
+    def prune(self, max_size = None, max_age = None):
+        """
+        Evicts least recently used models until cache size is under
+        max_size bytes and removes models unused for more than max_age
+        seconds. Returns the number of removed models.
+        """
+        if max_size is None:
+            max_size = self.max_size
+        entries = self.entries()
+        total = sum(x[1] for x in entries)
+        now = time.time()
+        removed = 0
+        for key, size, last_used in entries:
+            too_old = max_age is not None and now - last_used > max_age
+            if total > max_size or too_old:
+                self.remove(key)
+                total -= size
+                removed += 1
+        self._size = total
+        return removed
+
+def main(argv = None):
+    """
+    Command line interface for inspecting and pruning DOMM caches.
+    """
+    arg_parser = argparse.ArgumentParser(description = "DOMM cache utility")
+    arg_parser.add_argument("command", choices = ["info", "prune", "clear"])
+    arg_parser.add_argument("--folder", default = None,\
+        help = "models cache folder (default: %s)" %\
+        os.path.join(default_cache_dir(), ModelCache.subfolder))
+    arg_parser.add_argument("--max-size", type = float, default = None,\
+        help = "prune models until cache is under given size in MB")
+    arg_parser.add_argument("--max-age", type = float, default = None,\
+        help = "prune models not used in given number of days")
+    args = arg_parser.parse_args(argv)
+
+    cache = ModelCache(args.folder)
+    if args.command == "info":
+        entries = cache.entries()
+        for key, size, last_used in entries:
+            print("%s %10d %s" % (key, size, time.ctime(last_used)))
+        print("%s models, %.2f MB in %s" % (len(entries),\
+            sum(x[1] for x in entries) / (1024.0 * 1024.0), cache.folder))
+    elif args.command == "prune":
+        max_size = None
+        if args.max_size is not None:
+            max_size = int(args.max_size * 1024 * 1024)
+        max_age = None
+        if args.max_age is not None:
+            max_age = args.max_age * 24 * 60 * 60
+        removed = cache.prune(max_size, max_age)
+        print("Removed %s models" % removed)
+    elif args.command == "clear":
+        cache.clear()
+        print("Cache cleared")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+##############################################################################
+# Name: client.py
+# Purpose: Client of the DOMMLite validation daemon
+# Author: Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# Copyright: (c) 2014 Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# License: MIT License
+#
+# The client only depends on the standard library, so it starts quickly
+# and leaves parsing to the daemon, see server.py.
+#
+#   python client.py check model.domm
+#   python client.py export model.domm model.dot [--focus QID --depth N]
+#   python client.py stats
+##############################################################################
+from __future__ import print_function
+
+import os
+import sys
+import json
+import socket
+import argparse
+
+from cache import default_cache_dir
+
+# Environment variable that overrides the default socket path
+SOCKET_ENV = "DOMM_SOCKET"
+
+# JSON-RPC error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+MODEL_ERROR = -32000
+
+def default_socket():
+    """
+    Returns path of the daemon socket. It can be overriden with the
+    DOMM_SOCKET environment variable.
+    """
+    return os.environ.get(SOCKET_ENV) or os.path.join(default_cache_dir(),\
+        "domm.sock")
+
+class RpcError(Exception):
+    """
+    Error returned to the client as a JSON-RPC error object.
+    """
+    def __init__(self, code, message):
+        super(RpcError, self).__init__(message)
+        self.code = code
+        self.message = message
+
+class Client(object):
+    """
+    Client of the validation daemon, requests are sent over one connection.
+
+    Args:
+        socket_name(str): path of the daemon socket
+    """
+    def __init__(self, socket_name = None):
+        super(Client, self).__init__()
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(socket_name or default_socket())
+        self._file = self._socket.makefile("rb")
+        self._next_id = 0
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def call(self, method, **params):
+        """
+        Calls method of the daemon and returns its result. Errors are raised
+        as RpcError.
+        """
+        self._next_id += 1
+        request = {"jsonrpc": "2.0", "id": self._next_id, "method": method,\
+            "params": params}
+        self._socket.sendall(json.dumps(request) + "\n")
+        response = json.loads(self._file.readline())
+        if "error" in response:
+            raise RpcError(response["error"]["code"],\
+                response["error"]["message"])
+        return response["result"]
+
+def main(argv = None):
+    """
+    Command line client of the daemon, it replaces parsing files with
+    parser.py in scripts.
+    """
+    arg_parser = argparse.ArgumentParser(description = "DOMM daemon client")
+    arg_parser.add_argument("command",\
+        choices = ["parse", "check", "export", "stats"])
+    arg_parser.add_argument("files", nargs = "*",\
+        help = "model file, and output file for export")
+    arg_parser.add_argument("--socket", default = None,\
+        help = "daemon socket (default: %s)" % default_socket())
+    arg_parser.add_argument("--focus", default = None,\
+        help = "export only neighbourhood of given element")
+    arg_parser.add_argument("--depth", type = int, default = 1,\
+        help = "number of relationship hops exported around focus")
+    args = arg_parser.parse_args(argv)
+
+    with Client(args.socket) as client:
+        if args.command == "stats":
+            print(json.dumps(client.call("stats"), indent = 2,\
+                sort_keys = True))
+            return 0
+        if not args.files:
+            arg_parser.error("model file is required")
+        with open(args.files[0], "r") as domm_file:
+            content = domm_file.read()
+        if args.command == "parse":
+            result = client.call("parse", content = content)
+            print("%s: %s elements" % (result["model"],\
+                len(result["elements"])))
+        elif args.command == "check":
+            result = client.call("check", content = content)
+            if not result["ok"]:
+                print("%s: %s" % (args.files[0], result["error"]))
+                return 1
+            print("%s: OK" % args.files[0])
+        elif args.command == "export":
+            output = os.path.abspath(args.files[1] if len(args.files) > 1\
+                else "domm_model.dot")
+            client.call("export", content = content, output = output,\
+                focus = args.focus, depth = args.depth)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+##############################################################################
+# Name: compare.py
+# Purpose: Structural diff between two versions of a DOMMLite model
+# Author: Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# Copyright: (c) 2014 Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# License: MIT License
+#
+# Both models are walked together from their top level elements down
+# through packages. Elements that are the same object or have the same
+# content fingerprint are skipped without visiting their children, so the
+# work done depends on the size of the change, not of the model.
+##############################################################################
+from metamodel import *
+
+# Attributes, other than members, compared for elements of each type
+_ATTRS = {
+    Entity: ("short_desc", "long_desc", "extends", "dependencies",\
+        "constraints", "key", "repr", "compartments"),
+    Service: ("short_desc", "long_desc", "extends", "dependencies",\
+        "constraints", "op_compartments"),
+    ValueObject: ("short_desc", "long_desc", "extends", "dependencies",\
+        "constraints"),
+    ExceptionType: ("short_desc", "long_desc"),
+    Enumeration: ("short_desc", "long_desc"),
+    Package: ("short_desc", "long_desc"),
+}
+
+class ElementDiff(object):
+    """
+    Changes of a single element present in both models.
+
+    Attributes:
+        qid(str): qualified id of the element
+        old(object): element in the old model
+        new(object): element in the new model
+        added(dict): members (features, properties or literals) only found
+            in new element, by their name
+        removed(dict): members only found in old element, by their name
+        modified(dict): (old, new) pairs of changed members, by their name
+        changed(list): names of other attributes that changed, e.g.
+            "extends". Elements without members or compared attributes, like
+            data types, have their changes reported as ["content"].
+    """
+    def __init__(self, qid, old, new):
+        super(ElementDiff, self).__init__()
+        self.qid = qid
+        self.old = old
+        self.new = new
+        self.added = dict()
+        self.removed = dict()
+        self.modified = dict()
+        self.changed = []
+
+    def __nonzero__(self):
+        return bool(self.added or self.removed or self.modified\
+            or self.changed)
+
+    def __repr__(self):
+        return "ElementDiff %s (+%s -%s ~%s %s)" % (self.qid,\
+            sorted(self.added), sorted(self.removed), sorted(self.modified),\
+            self.changed)
+
+class ModelDiff(object):
+    """
+    Changes between two versions of a model. Elements are given by their
+    qualified id, an added or removed package is reported alone, without
+    the elements it contains.
+
+    Attributes:
+        added(dict): elements only found in new model
+        removed(dict): elements only found in old model
+        modified(dict): ElementDiff of elements found in both models
+        changed(list): names of changed attributes of the model itself
+    """
+    def __init__(self):
+        super(ModelDiff, self).__init__()
+        self.added = dict()
+        self.removed = dict()
+        self.modified = dict()
+        self.changed = []
+
+    def __nonzero__(self):
+        return bool(self.added or self.removed or self.modified\
+            or self.changed)
+
+    def __repr__(self):
+        return "ModelDiff (+%s -%s ~%s %s)" % (sorted(self.added),\
+            sorted(self.removed), sorted(self.modified), self.changed)
+
+def _unchanged(old, new):
+    """
+    Checks if an element is unchanged using its identity and fingerprint.
+    """
+    return old is new or (type(old) is type(new) and hash(old) == hash(new))
+
+def _members(elem):
+    """
+    Returns members of an element by name.
+    """
+    if type(elem) is Enumeration:
+        return dict((x.value, x) for x in elem.literals)
+    if hasattr(elem, "_members"):
+        return elem._members()
+    return dict()
+
+def _package_elems(package):
+    """
+    Returns direct elements of a package by name.
+    """
+    elems = dict()
+    for qid, elem in package.elems.iteritems():
+        elems[qid._id if type(qid) is Qid else qid] = elem
+    return elems
+
+def _diff_element(qid, old, new):
+    """
+    Returns ElementDiff of an element found in both models.
+    """
+    retval = ElementDiff(qid, old, new)
+    for attr in _ATTRS.get(type(old), ()):
+        if getattr(old, attr) != getattr(new, attr):
+            retval.changed.append(attr)
+
+    old_members = _members(old)
+    new_members = _members(new)
+    for name, member in new_members.iteritems():
+        old_member = old_members.get(name)
+        if old_member is None:
+            retval.added[name] = member
+        elif old_member is not member and old_member != member:
+            retval.modified[name] = (old_member, member)
+    for name, member in old_members.iteritems():
+        if name not in new_members:
+            retval.removed[name] = member
+
+    if not retval and type(old) not in _ATTRS:
+        retval.changed.append("content")
+    return retval
+
+def _diff_elems(old_elems, new_elems, prefix, result):
+    for name, new in new_elems.iteritems():
+        qid = prefix + name
+        old = old_elems.get(name)
+        if old is None:
+            result.added[qid] = new
+        elif _unchanged(old, new):
+            continue
+        elif type(old) is not type(new):
+            result.removed[qid] = old
+            result.added[qid] = new
+        elif type(old) is Package:
+            elem_diff = _diff_element(qid, old, new)
+            if elem_diff.changed:
+                result.modified[qid] = elem_diff
+            _diff_elems(_package_elems(old), _package_elems(new),\
+                qid + ".", result)
+        else:
+            elem_diff = _diff_element(qid, old, new)
+            if elem_diff:
+                result.modified[qid] = elem_diff
+
+    for name, old in old_elems.iteritems():
+        if name not in new_elems:
+            result.removed[prefix + name] = old
+
+def diff(old_model, new_model):
+    """
+    Returns ModelDiff with elements added, removed and modified in
+    new_model compared to old_model.
+
+    Unchanged elements are recognized by their content fingerprints, which
+    are computed once per element and then cached, so after the first diff
+    of a model only changed elements are visited. Two different elements
+    are only taken as equal on fingerprint match.
+    """
+    assert type(old_model) is Model and type(new_model) is Model
+    result = ModelDiff()
+    for attr in ("name", "short_desc", "long_desc"):
+        if getattr(old_model, attr) != getattr(new_model, attr):
+            result.changed.append(attr)
+    if old_model is not new_model:
+        _diff_elems(old_model.elems, new_model.elems, "", result)
+    return result
@@ -194,3 +194,31 @@ class RefFieldMismatchError(DommError):
         super(RefFieldMismatchError, self).__init__("")
         self.message = "In bi-directional reference fields <%s> and <%s> must reference each other!" \
                     % (field1, field2)
+
+class ExtendsCycleError(DommError):
+    """
+    Error when classifiers extend each other in a cycle
+    """
+    def __init__(self, names):
+        super(ExtendsCycleError, self).__init__("")
+        self.names = names
+        self.message = "Classifiers <%s> extend each other in a cycle!" \
+                    % ", ".join(names)
+
+class UnknownElementError(DommError):
+    """
+    Error when a qualified id given by the user isn't an element of the model
+    """
+    def __init__(self, qid):
+        super(UnknownElementError, self).__init__("")
+        self.qid = qid
+        self.message = "Element <%s> isn't in the model!" % qid
+
+class SnapshotError(DommError):
+    """
+    Error when a file isn't a model snapshot or was written by an
+    incompatible version
+    """
+    def __init__(self, file_name, reason):
+        super(SnapshotError, self).__init__("")
+        self.message = "Can't read snapshot <%s>: %s!" % (file_name, reason)
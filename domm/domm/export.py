@@ -5,214 +5,523 @@
 # Copyright: (c) 2014 Daniel Fath <daniel DOT fath7 AT gmail DOT com>
 # License: MIT License
 ##############################################################################
+import os
+import re
+import time
+import multiprocessing
 from metamodel import *
 
+HEADER = """
+digraph %s {
+    fontname = "Bitstream Vera Sans"
+    fontsize = 8
+    node[
+        shape=record,
+        style=filled,
+        fillcolor=aliceblue
+    ]
+    edge[dir=black,arrowtail=empty]\n"""
+
+# Relationships rendered as edges, with their style, in order they're written
+EDGE_STYLES = [
+    (RelType.Extends, "arrowhead = empty"),
+    (RelType.Depends, "style = dashed"),
+    (RelType.Composite, "dir = both, arrowtail=diamond"),
+]
+
+# Types of elements rendered as nodes
+NODE_TYPES = (DataType, Enumeration, ValueObject, ExceptionType, Service,\
+    Entity)
+
+# Name of the index file written by DommExport.export_partitions
+INDEX_FILE = "index.dot"
+
+def _by_name(elems):
+    """
+    Returns elements sorted by their name, so the output doesn't depend on
+    order of sets and dicts.
+    """
+    return sorted(elems, key = lambda x: x.name)
+
 class DommExport(object):
-    """docstring for DommExport"""
-    def __init__(self,):
+    """
+    Exports DOMMLite models to DOT format.
+
+    Elements are written in order of their qualified ids, which are also
+    used as ids of their nodes, so the same model is always exported the
+    same way. Output is streamed through a buffered file, element by
+    element.
+
+    Rendered elements are cached by their fingerprints, when a changed model
+    is exported again by the same exporter only the changed elements are
+    rendered.
+
+    When stats (ParseStats) are given, time of exporting each model is added
+    to their export phase.
+    """
+    def __init__(self, buffer_size = 1 << 16, stats = None):
         super(DommExport, self).__init__()
+        self.buffer_size = buffer_size
+        self.stats = stats
+        self._fragments = dict()
 
-    def render_enum(self, f, enum):
+    def node_id(self, qid):
         """
-        This method renders Enumeration in dot format and writes into f buffer.
-
-        It adds every literal name into a special cell of enumeration.
+        Returns DOT id of the node of element with given qualified id.
         """
-        str_val = '%s[label="   |{%s|' % (id(enum), enum.name)
-        for lit in enum.literals:
-            str_val += "%s\l" % lit.name
-        str_val += '}"]\n'
-        f.write(str_val)
+        return '"%s"' % qid
 
-    def render_prop(self, prop):
+    def render_type(self, type_def):
         """
-        This method returns a string represenatation of property.
+        This method returns a string representation of type of a property,
+        parameter or operation, with its multiplicity.
         """
-        str_val = ''
-        # Add required information
-        if prop.required == True:
-            str_val += '+ '
-        else:
-            str_val += '? '
-
-        # Add name
-        str_val += '%s: ' % prop.name
-
+        parts = []
         # Add type information but check if type is qualified
-        if type(prop.type_def.type) is Qid:
-            str_val += '%s ' % prop.type_def.type._id
+        if type(type_def.type) is Qid:
+            parts.append('%s ' % type_def.type._id)
         else:
-            str_val += '%s ' % prop.type_def.type
+            parts.append('%s ' % type_def.type)
         # Add multiplicity information
-        if prop.type_def.container == True:
-            str_val += "["
-            if prop.type_def.multi:
-                str_val += prop.type_def.multi.__str__()
-            str_val += "]"
+        if type_def.container == True:
+            parts.append("[")
+            if type_def.multi:
+                parts.append(type_def.multi.__str__())
+            parts.append("]")
+        return "".join(parts)
 
-        str_val += '\l'
-        return str_val
+    def render_prop(self, prop):
+        """
+        This method returns a string represenatation of property.
+        """
+        # Add required information
+        required = '+ ' if prop.required == True else '? '
+        return "%s%s: %s\l" % (required, prop.name,\
+            self.render_type(prop.type_def))
 
     def render_param(self, param):
         """
         This method returns string represenatation of parameter
         """
-        # Add name
-        str_val = '%s: ' % param.type_def.name
-
-        # Add type information but check if type is qualified
-        if type(param.type_def.type) is Qid:
-            str_val += '%s ' % param.type_def.type._id
-        else:
-            str_val += '%s ' % param.type_def.type
-        # Add multiplicity information
-        if param.type_def.container == True:
-            str_val += "["
-            if param.type_def.multi:
-                str_val += param.type_def.multi.__str__()
-            str_val += "]"
-
-        return str_val
+        return '%s: %s' % (param.type_def.name,\
+            self.render_type(param.type_def))
 
     def render_op(self, op):
         """
         This method returns a string represenatation of an operation
         and it's parameters.
         """
-        str_val = op.op_name.__str__()
-        str_val += '('
-
-        type_name =''
+        params = ",".join(self.render_param(x) for x in op.params)
         if type(op.type_def.type) is Qid:
             type_name = '%s ' % op.type_def.type._id
         else:
             type_name = '%s ' % op.type_def.type
+        return '%s(%s) : %s\l' % (op.op_name, params, type_name)
 
-        for i, param in enumerate(op.params):
-            if i > 0:
-                str_val += ","
-            str_val += self.render_param(param)
+    def render_feature(self, feat):
+        if type(feat) is Operation:
+            return self.render_op(feat)
+        return self.render_prop(feat)
 
+    def render_compartments(self, compartments):
+        """
+        Returns string representation of compartments, each one in its own
+        cell titled by its short description or name.
+        """
+        parts = []
+        for name in sorted(compartments):
+            comp = compartments[name]
+            parts.append("|%s|" % (comp.short_desc or comp.name))
+            for feat in _by_name(comp.elements):
+                parts.append(self.render_feature(feat))
+        return "".join(parts)
 
-        str_val += ') : %s\l' % type_name
-        return str_val
+    def render_data_type(self, data_type, node_id):
+        return '%s[label="   |%s"]\n' % (node_id, data_type.name)
 
-    def render_vo(self, f, vo):
+    def render_enum(self, enum, node_id):
         """
         This method renders Enumeration in dot format.
+
+        It adds every literal name into a special cell of enumeration.
         """
-        str_val = '%s[style=rounded, label="{%s|' % (id(vo), vo.name)
-        for prop in vo.props.itervalues():
-            str_val += self.render_prop(prop)
-        str_val += '}"]\n'
-        f.write(str_val)
+        literals = sorted(enum.literals, key = lambda x: x.value)
+        return '%s[label="   |{%s|%s}"]\n' % (node_id, enum.name,\
+            "".join("%s\l" % x.name for x in literals))
 
-    def render_excp(self, f, excp):
+    def render_vo(self, vo, node_id):
+        """
+        This method renders ValueObject in dot format.
+        """
+        props = "".join(self.render_prop(vo.props[x]) for x in sorted(vo.props))
+        return '%s[style=rounded, label="{%s|%s}"]\n' % (node_id, vo.name,\
+            props)
+
+    def render_excp(self, excp, node_id):
         """
         This method renders ExceptionType.
         """
-        str_val = '%s[style=dashed, label="{%s|' % (id(excp), excp.name)
-        for prop in excp.props.itervalues():
-            str_val += self.render_prop(prop)
-        str_val += '}"]\n'
-        f.write(str_val)
+        props = "".join(self.render_prop(excp.props[x])\
+            for x in sorted(excp.props))
+        return '%s[style=dashed, label="{%s|%s}"]\n' % (node_id, excp.name,\
+            props)
 
-    def render_service(self, f, serv):
+    def render_service(self, serv, node_id):
         """
-        Renders a service to a buffer - `f`
+        Renders a service.
         """
-        str_val = '%s[style = diagonals, label = "{%s|' % (id(serv), serv.name)
+        ops = "".join(self.render_op(serv.elems[x])\
+            for x in sorted(serv.operations))
+        return '%s[style = diagonals, label = "{%s|%s%s}"]\n' % (node_id,\
+            serv.name, ops, self.render_compartments(serv.op_compartments))
 
-        for op in serv.operations:
-            str_val += self.render_op(serv.elems[op])
+    def render_entity(self, ent, node_id):
+        """
+        Renders an entity, features in compartments are rendered in their
+        compartment and the rest, including key, in the main one.
+        """
+        in_compartment = set()
+        for comp in ent.compartments.itervalues():
+            in_compartment.update(id(x) for x in comp.elements)
+        features = "".join(self.render_feature(ent.elems[x])\
+            for x in sorted(ent.elems) if id(ent.elems[x]) not in in_compartment)
+        return '%s[label = "{%s|%s%s}"]\n' % (node_id, ent.name, features,\
+            self.render_compartments(ent.compartments))
 
-        for comp in serv.op_compartments.itervalues():
-            comp_name = comp.name
-            if comp.short_desc:
-                comp_name = comp.short_desc
-            str_val += "|%s|" % comp_name
-            for op in comp.elements:
-                str_val += self.render_op(op)
+    def render(self, elem, node_id):
+        """
+        Returns DOT fragment of elem or None if elem isn't rendered as node.
+        """
+        renderer = {
+            DataType: self.render_data_type,
+            Enumeration: self.render_enum,
+            ValueObject: self.render_vo,
+            ExceptionType: self.render_excp,
+            Service: self.render_service,
+            Entity: self.render_entity,
+        }.get(type(elem))
+        if renderer is None:
+            return None
+        return renderer(elem, node_id)
 
-        str_val += '}"]\n'
-        f.write(str_val)
+    def _walk(self, elems, prefix = ""):
+        """
+        Yields qualified ids and elements of a model or package tree, in
+        order of their qualified ids.
+        """
+        for name in sorted(elems):
+            elem = elems[name]
+            qid = prefix + name
+            yield qid, elem
+            if type(elem) is Package:
+                nested = dict((x._id, y) for x, y in elem.elems.iteritems()\
+                    if type(x) is Qid)
+                for pair in self._walk(nested, qid + "."):
+                    yield pair
 
-    def render_entity(self, f, ent):
+    def _fragment(self, qid, elem, fragments = None):
         """
-        Renders a service to a buffer - `f`
+        Returns DOT fragment of elem, reused from the cache when elem didn't
+        change since it was last exported. Hash of elem covers everything
+        the renderers use, so it identifies the fragment. Used fragments are
+        stored in fragments.
         """
-        str_val = '%s[label = "{%s|' % (id(ent), ent.name)
+        key = (qid, type(elem), hash(elem))
+        fragment = self._fragments.get(key)
+        if fragment is None:
+            fragment = self.render(elem, self.node_id(qid))
+        if fragment is not None and fragments is not None:
+            fragments[key] = fragment
+        return fragment
 
-        for feature in ent.features:
-            feat = ent.elems[feature]
-            if type(feat) is Operation:
-                str_val += self.render_op(feat)
-            elif type(feat) is Property:
-                str_val += self.render_prop(feat)
+    def neighbourhood(self, model, focus, depth = 1, rel_types = None):
+        """
+        Finds elements rendered as nodes within depth relationship hops of
+        focus, going along relationships in both directions. Only the
+        relationships of reached elements are visited, so the work depends
+        on size of the neighbourhood, not of the model.
 
-        for comp in ent.compartments.itervalues():
-            comp_name = comp.name
-            if comp.short_desc:
-                comp_name = comp.short_desc
-            str_val += "|%s|" % comp_name
-            for el in comp.elements:
-                if type(el) is Operation:
-                    str_val += self.render_op(el)
-                elif type(el) is Property:
-                    str_val += self.render_prop(el)
-
-        str_val += '}"]\n'
-        f.write(str_val)
-
-    def export_model(self, model, file_name):
-        print("TYPE:",type(model))
-        header = """
-digraph %s {
-    fontname = "Bitstream Vera Sans"
-    fontsize = 8
-    node[
-        shape=record,
-        style=filled,
-        fillcolor=aliceblue
-    ]
-    edge[dir=black,arrowtail=empty]\n""" % (model.name)
-
-        with open(file_name, 'w') as f:
-            f.write(header)
-
-            for elem in model.qual_elems.itervalues():
-                if type(elem) is DataType:
-                    # Print dataType
-                    data = '%s[label="   |%s"]\n' % (id(elem), elem.name)
-                    f.write(data)
-                elif type(elem) is Enumeration:
-                    self.render_enum(f, elem)
-                elif type(elem) is ValueObject:
-                    self.render_vo(f, elem)
-                elif type(elem) is ExceptionType:
-                    self.render_excp(f, elem)
-                elif type(elem) is Service:
-                    self.render_service(f, elem)
-                elif type(elem) is Entity:
-                    self.render_entity(f, elem)
-
-            # Filter relationships that aren't part of another
-            filtered_rels = (x for x in model._rels if x._super_rel is None)
-            for rel in filtered_rels:
-                print("rel ", rel)
-                if rel.rel_type == RelType.Extends:
-                    rel_str = '%s -> %s [arrowhead = empty]\n'\
-                            % (id(rel.elem_a), id(rel.elem_b))
-                    f.write(rel_str)
-                elif rel.rel_type == RelType.Depends:
-                    rel_str = '%s -> %s [style = dashed]\n'\
-                            % (id(rel.elem_a), id(rel.elem_b))
-                    f.write(rel_str)
-                elif rel.rel_type == RelType.Composite:
-                    rel_str = '%s -> %s [dir = both, arrowtail=diamond]\n'\
-                            % (id(rel.elem_a), id(rel.elem_b))
-                    f.write(rel_str)
-                elif rel.rel_type == RelType.Reference:
-                    rel_str = '%s -> %s'
+        Args:
+            model(Model): exported model
+            focus(str): qualified id of the element in the center
+            depth(int): maximal number of hops from focus
+            rel_types(list): types of followed relationships, by default
+                all rendered as edges
+
+        Returns:
+            dict with qualified ids of reached elements by their ids
+
+        Raises UnknownElementError if focus isn't in the model.
+        """
+        if rel_types is None:
+            rel_types = [x for x, _ in EDGE_STYLES]
+        start = model.qual_elems.get(focus)
+        if start is None:
+            raise UnknownElementError(focus)
+        reached = {id(start): start}
+        frontier = [start]
+        for _ in range(depth):
+            found = []
+            for elem in frontier:
+                for rel_type in rel_types:
+                    for rel in model.rels_from(elem, rel_type)\
+                            + model.rels_to(elem, rel_type):
+                        if rel._super_rel is not None:
+                            continue
+                        for other in (rel.elem_a, rel.elem_b):
+                            if id(other) not in reached\
+                                    and type(other) in NODE_TYPES:
+                                reached[id(other)] = other
+                                found.append(other)
+            frontier = found
+
+        symbols = model.symbols
+        return dict((x, symbols.namespace_of(y).qid)\
+            for x, y in reached.iteritems())
+
+    def write_model(self, model, f, focus = None, depth = 1,\
+        rel_types = None):
+        """
+        Writes model in DOT format to file like object f. When focus is
+        given only its neighbourhood is written, see neighbourhood method.
+        """
+        start = time.time()
+        f.write(HEADER % model.name)
+
+        fragments = dict()
+        if focus is None:
+            qids = dict()
+            for qid, elem in self._walk(model.elems):
+                if type(elem) in NODE_TYPES:
+                    qids[id(elem)] = qid
+                    f.write(self._fragment(qid, elem, fragments))
+        else:
+            qids = self.neighbourhood(model, focus, depth, rel_types)
+            for qid in sorted(qids.itervalues()):
+                f.write(self._fragment(qid, model[qid], fragments))
+        # Only fragments of the last export are kept, so the cache doesn't
+        # grow with fragments of old revisions
+        self._fragments = fragments
 
+        # Relationships that are part of another aren't rendered
+        for rel_type, style in EDGE_STYLES:
+            if rel_types is not None and rel_type not in rel_types:
+                continue
+            if focus is None:
+                rels = model.rels_of_type(rel_type)
+            else:
+                rels = [x for y in qids.itervalues()\
+                    for x in model.rels_from(model[y], rel_type)]
+            edges = sorted((qids[id(x.elem_a)], qids[id(x.elem_b)])\
+                for x in rels if x._super_rel is None\
+                and id(x.elem_a) in qids and id(x.elem_b) in qids)
+            for source, target in edges:
+                f.write('%s -> %s [%s]\n' % (self.node_id(source),\
+                    self.node_id(target), style))
+
+        f.write('\n}\n')
+        if self.stats is not None:
+            self.stats.phase("export").add(time.time() - start)
+
+    def export_model(self, model, file_name, focus = None, depth = 1,\
+        rel_types = None):
+        """
+        Exports model in DOT format to file_name, whole model or only the
+        neighbourhood of focus element, see write_model.
+        """
+        with open(file_name, 'w', self.buffer_size) as f:
+            self.write_model(model, f, focus, depth, rel_types)
+
+    def partition(self, model, partitions = None):
+        """
+        Splits elements rendered as nodes into partitions.
+
+        Args:
+            model(Model): partitioned model
+            partitions(dict): lists of qualified ids of packages or elements
+                by name of partition. Element belongs to the partition with
+                the longest qualified id containing it. Elements that don't
+                belong to any partition are partitioned by their package.
+
+        Returns:
+            dict with sorted list of qualified ids of elements by partition
+        """
+        prefixes = dict()
+        for name, qids in (partitions or dict()).iteritems():
+            for qid in qids:
+                prefixes[tuple(qid.split("."))] = name
+
+        retval = dict()
+        for qid, elem in self._walk(model.elems):
+            if type(elem) not in NODE_TYPES:
+                continue
+            path = tuple(qid.split("."))
+            name = None
+            for end in range(len(path), 0, -1):
+                name = prefixes.get(path[:end])
+                if name is not None:
+                    break
+            if name is None:
+                name = qid.rsplit(".", 1)[0] if len(path) > 1 else model.name
+            retval.setdefault(name, []).append(qid)
+        return retval
+
+    def write_partition(self, model, name, owners, f):
+        """
+        Writes partition of model in DOT format to file like object f.
+        Elements are grouped in a cluster per package. Elements of other
+        partitions related to the ones in this partition are written as stub
+        nodes linking to their partition.
+
+        Args:
+            model(Model): exported model
+            name(str): name of written partition
+            owners(dict): partition names by qualified ids of all elements,
+                see partition method
+            f(file): file like object output is written to
+        """
+        f.write(HEADER % ('"%s"' % name))
+        qids = sorted(x for x, y in owners.iteritems() if y == name)
+
+        clusters = dict()
+        for qid in qids:
+            package = qid.rsplit(".", 1)[0] if "." in qid else ""
+            clusters.setdefault(package, []).append(qid)
+        for package in sorted(clusters):
+            if package:
+                f.write('subgraph "cluster_%s" {\nlabel = "%s"\n'\
+                    % (package, package))
+            for qid in clusters[package]:
+                f.write(self._fragment(qid, model.qual_elems[qid]))
+            if package:
+                f.write('}\n')
+
+        # Relationships of elements in the partition are found in the
+        # relationship index, instead of going through all of them
+        elem_qids = dict((id(model.qual_elems[x]), x) for x in owners)
+        edges = set()
+        for qid in qids:
+            elem = model.qual_elems[qid]
+            for rel in model.rels_from(elem) + model.rels_to(elem):
+                source = elem_qids.get(id(rel.elem_a))
+                target = elem_qids.get(id(rel.elem_b))
+                if rel._super_rel is None and source and target:
+                    edges.add((rel.rel_type, source, target))
+
+        stubs = set()
+        for rel_type, style in EDGE_STYLES:
+            for _, source, target in sorted(x for x in edges\
+                    if x[0] == rel_type):
+                stubs.update(x for x in (source, target)\
+                    if owners[x] != name)
+                f.write('%s -> %s [%s]\n' % (self.node_id(source),\
+                    self.node_id(target), style))
+        for qid in sorted(stubs):
+            f.write('%s[label = "%s", style = dashed, URL = "%s"]\n'\
+                % (self.node_id(qid), qid, partition_file(owners[qid])))
+
+        f.write('\n}\n')
+
+    def export_partitions(self, model, folder_name, partitions = None,\
+        workers = None):
+        """
+        Exports model in DOT format to a file per partition, so each diagram
+        stays small enough to be laid out quickly, and writes an index
+        linking them to INDEX_FILE in the same folder.
+
+        Args:
+            model(Model): exported model
+            folder_name(str): folder files are written to
+            partitions(dict): partitions given by qualified ids, see
+                partition method. By default there's a partition per package.
+            workers(int): number of worker processes writing partitions.
+                When None the number of CPUs is used, with 1 all partitions
+                are written in this process.
+
+        Returns:
+            dict with paths of written files by partition name
+        """
+        owners = dict()
+        for name, qids in self.partition(model, partitions).iteritems():
+            for qid in qids:
+                owners[qid] = name
+        names = sorted(set(owners.itervalues()))
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        workers = max(1, min(workers, len(names)))
+
+        jobs = [(x, os.path.join(folder_name, partition_file(x)))\
+            for x in names]
+        if workers == 1:
+            files = [_export_partition(x, (self, model, owners))\
+                for x in jobs]
+        else:
+            # Workers get the model and the fragment cache when they are
+            # created, instead of them being sent with every partition
+            pool = multiprocessing.Pool(workers, _init_partition_worker,\
+                (self, model, owners))
+            try:
+                files = list(pool.imap_unordered(_export_partition, jobs))
+            finally:
+                pool.close()
+                pool.join()
+
+        self._write_index(model, owners, os.path.join(folder_name,\
+            INDEX_FILE))
+        return dict(files)
+
+    def _write_index(self, model, owners, file_name):
+        """
+        Writes index of partitions, with a node linking to each partition and
+        edges counting relationships between them.
+        """
+        sizes = dict()
+        for name in owners.itervalues():
+            sizes[name] = sizes.get(name, 0) + 1
+        elem_qids = dict((id(model.qual_elems[x]), x) for x in owners)
+        links = dict()
+        for rel_type, style in EDGE_STYLES:
+            for rel in model.rels_of_type(rel_type):
+                source = elem_qids.get(id(rel.elem_a))
+                target = elem_qids.get(id(rel.elem_b))
+                if rel._super_rel is None and source and target\
+                        and owners[source] != owners[target]:
+                    key = (owners[source], owners[target])
+                    links[key] = links.get(key, 0) + 1
+
+        with open(file_name, 'w', self.buffer_size) as f:
+            f.write(HEADER % ('"%s"' % model.name))
+            for name in sorted(sizes):
+                f.write('%s[label = "%s (%s)", URL = "%s"]\n'\
+                    % (self.node_id(name), name, sizes[name],\
+                    partition_file(name)))
+            for source, target in sorted(links):
+                f.write('%s -> %s [label = "%s"]\n' % (self.node_id(source),\
+                    self.node_id(target), links[(source, target)]))
             f.write('\n}\n')
+
+def partition_file(name):
+    """
+    Returns name of the file partition with given name is exported to.
+    """
+    return "%s.dot" % re.sub(r"[^\w.-]", "_", name)
+
+# Exporter, model and partitioning shared by partitions written in a worker
+# process
+_partition_state = None
+
+def _init_partition_worker(exporter, model, owners):
+    global _partition_state
+    _partition_state = (exporter, model, owners)
+
+def _export_partition(job, state = None):
+    """
+    Writes a single partition for export_partitions, returns partition name
+    and path of the written file. State is (exporter, model, owners), by
+    default the one of the worker process.
+    """
+    name, file_name = job
+    exporter, model, owners = state or _partition_state
+    with open(file_name, 'w', exporter.buffer_size) as f:
+        exporter.write_partition(model, name, owners, f)
+    return name, file_name
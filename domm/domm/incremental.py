@@ -0,0 +1,517 @@
+##############################################################################
+# Name: incremental.py
+# Purpose: Incremental reparsing of edited DOMMLite sources
+# Author: Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# Copyright: (c) 2014 Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# License: MIT License
+#
+# Source of a model is split into blocks: model level types and constraints,
+# packages and classifiers inside packages. When the source is edited only
+# the smallest blocks enclosing the edits are parsed again. Their elements
+# are spliced into the existing model and only the cross references that
+# could be affected by the change are checked again.
+##############################################################################
+import time
+
+from arpeggio import NonTerminal, NoMatch
+from metamodel import *
+
+# Rules of model level blocks in the parse tree
+TOP_RULES = ["user_type", "constraint_type", "package"]
+
+# Rule names of semantic actions having a second pass, by element type
+SECOND_PASS_RULES = {
+    Property: "prop",
+    Operation: "oper",
+    Entity: "entity",
+    Service: "service",
+    ValueObject: "value_object",
+}
+
+# Name of the model that wraps reparsed fragments
+FRAGMENT_MODEL = "__fragment__"
+
+class Edit(object):
+    """
+    Replacement of text between start and end offsets of the old content
+    with new text.
+    """
+    def __init__(self, start, end, text):
+        super(Edit, self).__init__()
+        assert 0 <= start <= end
+        self.start = start
+        self.end = end
+        self.text = text
+
+    @property
+    def delta(self):
+        return len(self.text) - (self.end - self.start)
+
+    def __repr__(self):
+        return "Edit(%s, %s, %r)" % (self.start, self.end, self.text)
+
+class Block(object):
+    """
+    Part of the source that is parsed into a single model element.
+
+    Attributes:
+        kind(str): "type" for model level types and constraints, "package"
+            for packages and "classifier" for elements of packages
+        name(str): name of the element
+        start(int): offset of the first character of the block
+        end(int): offset after the last character of the block
+        children(list): blocks of package elements
+        element: model element parsed from the block
+    """
+    def __init__(self, kind, name, start, end):
+        super(Block, self).__init__()
+        self.kind = kind
+        self.name = name
+        self.start = start
+        self.end = end
+        self.children = []
+        self.element = None
+        self._referenced = None
+
+    def referenced(self):
+        """
+        Returns (node, names) pairs of second pass nodes of the element and
+        short names they refer to. Reparse replaces blocks instead of
+        changing their elements, so they're found only once.
+        """
+        if self._referenced is None:
+            self._referenced = [(x, referenced_names(x))\
+                for x in second_pass_nodes(self.element)]
+        return self._referenced
+
+    def contains(self, start, end):
+        """
+        Checks if text between start and end is strictly inside the block,
+        so that text inserted next to the block is never mistaken for its
+        part.
+        """
+        return self.start < start and end < self.end
+
+    def walk(self):
+        yield self
+        for child in self.children:
+            for block in child.walk():
+                yield block
+
+    def shift(self, delta):
+        for block in self.walk():
+            block.start += delta
+            block.end += delta
+
+    def __repr__(self):
+        return "Block(%s %s [%s:%s])" % (self.kind, self.name, self.start,\
+            self.end)
+
+class IncrementalResult(object):
+    """
+    Model parsed from content together with the blocks of content, needed
+    by DommParser.reparse. A result passed to reparse shares its model with
+    the new result and must not be used afterwards.
+
+    Attributes:
+        changed(tuple): (removed, added) lists of blocks replaced by the
+            reparse that returned the result, None when the whole content
+            was parsed
+    """
+    def __init__(self, content, model, blocks, skip_crossref):
+        super(IncrementalResult, self).__init__()
+        self.content = content
+        self.model = model
+        self.blocks = blocks
+        self.skip_crossref = skip_crossref
+        self.changed = None
+
+    def walk(self):
+        for block in self.blocks:
+            for inner in block.walk():
+                yield inner
+
+def _node_end(node):
+    while isinstance(node, NonTerminal):
+        node = node[-1]
+    return node.position + len(node.value)
+
+def _node_name(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, NonTerminal):
+            stack.extend(reversed(node))
+        elif node.rule_name == "name":
+            return node.value
+    return None
+
+def _package_blocks(node, package):
+    """
+    Returns blocks of package elements found in the parse tree node of
+    package, bound to their elements.
+    """
+    elements = dict()
+    for elem in package.elems.itervalues():
+        elements[elem.name] = elem
+
+    blocks = []
+    for child in node:
+        if child.rule_name != "pack_elem":
+            continue
+        inner = child[0]
+        name = _node_name(inner)
+        if inner.rule_name == "package":
+            block = Block("package", name, child.position, _node_end(child))
+            block.element = elements[name]
+            block.children = _package_blocks(inner, block.element)
+        else:
+            block = Block("classifier", name, child.position,\
+                _node_end(child))
+            block.element = elements[name]
+        blocks.append(block)
+    return blocks
+
+def model_blocks(parse_tree, model):
+    """
+    Returns blocks of the model level elements found in the parse tree,
+    bound to elements of model parsed from it.
+    """
+    model_node = parse_tree[0]
+    blocks = []
+    for child in model_node:
+        if child.rule_name not in TOP_RULES:
+            continue
+        name = _node_name(child)
+        kind = "package" if child.rule_name == "package" else "type"
+        block = Block(kind, name, child.position, _node_end(child))
+        block.element = model.qual_elems[name]
+        if kind == "package":
+            block.children = _package_blocks(child, block.element)
+        blocks.append(block)
+    return blocks
+
+def parse_incremental(parser, content):
+    """
+    Parses whole content and returns IncrementalResult that can later be
+    passed to reparse.
+    """
+    parse_tree = parser.parse(content)
+    model = parser.getASG()
+    blocks = model_blocks(parse_tree, model)
+    # Memoized results of the whole content are big, so they are freed
+    # now instead of slowing down the first reparse
+    parser.parser_model.clear_cache()
+    parser.parse_tree = None
+    return IncrementalResult(content, model, blocks, parser.skip_crossref)
+
+def enclosing(blocks, start, end, parents = None):
+    """
+    Returns path (list of blocks from the outermost) to the smallest block
+    enclosing the text between start and end. Empty path means that no block
+    encloses it.
+    """
+    path = list(parents or [])
+    for block in blocks:
+        if block.contains(start, end):
+            path.append(block)
+            return enclosing(block.children, start, end, path)
+    return path
+
+def _parse_fragment(parser, content, block, parents):
+    """
+    Parses text of block wrapped in its packages and returns the new block
+    bound to the new element. Returns None if the text isn't a single
+    element of the same kind.
+    """
+    prefix = "model %s " % FRAGMENT_MODEL
+    for parent in parents:
+        prefix += "package %s { " % parent.name
+    suffix = " }" * len(parents)
+    text = content[block.start:block.end]
+
+    try:
+        with parser.parsing(parser.new_context(skip_crossref = True)):
+            parse_tree = parser.parse(prefix + text + suffix)
+            fragment = parser.getASG()
+    except (DommError, NoMatch):
+        return None
+
+    blocks = model_blocks(parse_tree, fragment)
+    for parent in parents:
+        if len(blocks) != 1 or blocks[0].kind != "package":
+            return None
+        blocks = blocks[0].children
+    if len(blocks) != 1 or blocks[0].kind != block.kind:
+        return None
+
+    new_block = blocks[0]
+    new_block.shift(block.start - len(prefix))
+    return new_block
+
+def _add_elem(package, elem):
+    if type(elem) is Constraint:
+        package.add_constraint(elem)
+    else:
+        package.add_elem(elem)
+
+def _rebuild_model(model, blocks):
+    """
+    Fills model namespaces from model level blocks again.
+    """
+    model._clear_elems()
+    for block in blocks:
+        if type(block.element) is Package:
+            model.add_package(block.element)
+        elif type(block.element) is Constraint:
+            model.add_constraint(block.element)
+        else:
+            model.add_type(block.element)
+
+def second_pass_nodes(element):
+    """
+    Yields nodes of element which have a second pass semantic action,
+    features before the classifier, like Arpeggio does.
+    """
+    if type(element) is Entity or type(element) is Service:
+        for feat in element.elems.itervalues():
+            yield feat
+    elif type(element) is ValueObject or type(element) is ExceptionType:
+        for prop in element.props.itervalues():
+            yield prop
+    if type(element) in SECOND_PASS_RULES:
+        yield element
+
+def referenced_names(node):
+    """
+    Returns short names of all elements node refers to.
+    """
+    names = set()
+    for ref in node._refs():
+        target = ref._target
+        if type(target) is Qid:
+            names.add(target._id)
+        else:
+            names.add(target.split(".")[-1])
+    if type(node) is Property and node.relationship\
+            and node.relationship.opposite_end:
+        names.add(node.relationship.opposite_end._id)
+    return names
+
+def defined_names(element):
+    """
+    Returns short names of element and its features.
+    """
+    names = set([element.name])
+    if type(element) is Entity or type(element) is Service:
+        names.update(element.elems.iterkeys())
+    elif type(element) is ValueObject or type(element) is ExceptionType:
+        names.update(element.props.iterkeys())
+    return names
+
+def _reset_node(model, node):
+    """
+    Forgets results of the previous second pass on node.
+    """
+    for ref in node._refs():
+        ref._qid = None
+        ref._bound = None
+    if type(node) is Property:
+        node._ref = None
+        relation = node.relationship
+        # Relationship without containment and opposite end is only
+        # added in second pass, for properties referencing classifiers
+        if relation and not relation.containment\
+                and relation.opposite_end is None:
+            node.relationship = None
+
+def crossref_nodes(result, removed, added):
+    """
+    Returns added nodes and nodes that refer to elements defined by removed
+    or added blocks, whose second pass has to run again. Relations created
+    by their previous second pass are removed from the model.
+    """
+    model = result.model
+    touched = set()
+    for block in removed + added:
+        for inner in block.walk():
+            touched.update(defined_names(inner.element))
+
+    added_ids = set()
+    for block in added:
+        for inner in block.walk():
+            added_ids.update(id(x) for x in second_pass_nodes(inner.element))
+
+    rerun = []
+    for block in result.walk():
+        if block.kind == "package":
+            continue
+        for node, names in block.referenced():
+            if id(node) in added_ids or names & touched:
+                rerun.append(node)
+
+    # Drop relations created by removed or rerun nodes
+    owners = set(id(x) for x in rerun)
+    for block in removed:
+        for inner in block.walk():
+            owners.update(id(x) for x in second_pass_nodes(inner.element))
+    refs = set(id(x._ref) for x in rerun if type(x) is Property)
+    for block in removed:
+        for inner in block.walk():
+            refs.update(id(x._ref) for x in second_pass_nodes(inner.element)\
+                if type(x) is Property)
+    model._remove_rels([x for x in model._rels if _owned_by(x, owners, refs)])
+
+    qids = dict()
+    for qid, elem in model.qual_elems.iteritems():
+        qids[id(elem)] = qid
+    model._containment = set(qids.get(id(x.elem_b))\
+        for x in model.rels_of_type(RelType.Composite))
+    return rerun
+
+def _rerun_crossref(parser, result, removed, added):
+    """
+    Runs second pass on nodes affected by removed and added blocks, see
+    crossref_nodes.
+    """
+    model = result.model
+    run_second_pass(parser, model, crossref_nodes(result, removed, added))
+    model.check_cycles()
+
+def run_second_pass(parser, model, nodes, errors = None):
+    """
+    Forgets results of the previous second pass on nodes and runs it again.
+    When errors dict is given, DommErrors are collected into it by id of
+    the failing node instead of being raised, so the rest of nodes are
+    still checked.
+    """
+    for node in nodes:
+        _reset_node(model, node)
+    sem_actions = parser.sem_actions
+    profiler = parser.profiler
+    if profiler is not None:
+        sem_actions = profiler.wrap(sem_actions)
+        start = time.time()
+    for node in nodes:
+        action = sem_actions[SECOND_PASS_RULES[type(node)]]
+        if errors is None:
+            action.second_pass(parser, node)
+            continue
+        try:
+            action.second_pass(parser, node)
+        except DommError as e:
+            errors[id(node)] = e
+    if profiler is not None:
+        profiler.phase("second_pass").add(time.time() - start)
+    invalidate_caches(model)
+
+def _owned_by(rel, owners, refs):
+    """
+    Checks if relation was created by second pass of one of owner nodes.
+    Classifiers own their extends and depends relations, properties own
+    relations they reference.
+    """
+    if rel.rel_type == RelType.Extends or rel.rel_type == RelType.Depends:
+        return id(rel.elem_a) in owners
+    return id(rel) in refs
+
+def apply_edits(content, edits):
+    """
+    Returns content with edits applied. Edits must not overlap.
+    """
+    retval = []
+    pos = 0
+    for edit in edits:
+        retval.append(content[pos:edit.start])
+        retval.append(edit.text)
+        pos = edit.end
+    retval.append(content[pos:])
+    return "".join(retval)
+
+def reparse(parser, old_result, edits):
+    """
+    Applies edits to content of old_result and returns IncrementalResult
+    for the new content, reparsing only blocks touched by edits.
+
+    Args:
+        parser(DommParser): parser used for reparsing
+        old_result(IncrementalResult): result of previous (re)parse
+        edits(list): Edit objects or (start, end, text) tuples with offsets
+            into the old content
+    """
+    edits = sorted((x if type(x) is Edit else Edit(*x) for x in edits),\
+        key = lambda x: x.start)
+    content = apply_edits(old_result.content, edits)
+
+    if old_result.skip_crossref != parser.skip_crossref:
+        return parse_incremental(parser, content)
+
+    # Find the smallest block enclosing each edit, when some edit isn't
+    # inside a block model header changed and everything is parsed again
+    paths = []
+    for edit in edits:
+        path = enclosing(old_result.blocks, edit.start, edit.end)
+        if not path:
+            return parse_incremental(parser, content)
+        paths.append(path)
+
+    # Merge edits of nested blocks into the outer block
+    targets = []
+    for path in sorted(paths, key = len):
+        if not any(x[-1] in path for x in targets):
+            targets.append(path)
+
+    # Blocks are parsed from the new content, so their offsets are moved
+    # by edits that precede them or are inside of them
+    for block in old_result.walk():
+        block.start += sum(x.delta for x in edits if x.end <= block.start)
+        block.end += sum(x.delta for x in edits if x.end <= block.end)
+
+    parsed = []
+    for path in targets:
+        block = path[-1]
+        new_block = _parse_fragment(parser, content, block, path[:-1])
+        # Retry with the enclosing block, if text no longer parses
+        # as a single element
+        while new_block is None and len(path) > 1:
+            path = path[:-1]
+            block = path[-1]
+            new_block = _parse_fragment(parser, content, block, path[:-1])
+        if new_block is None:
+            return parse_incremental(parser, content)
+        parsed.append((path, new_block))
+
+    # Retries may have reached blocks enclosing other reparsed blocks, which
+    # are then already parsed as part of the enclosing one
+    replaced = []
+    for path, new_block in parsed:
+        if not any(x[-1] in path for x, y in replaced):
+            replaced = [(x, y) for x, y in replaced if path[-1] not in x]
+            replaced.append((path, new_block))
+
+    removed = []
+    added = []
+    try:
+        for path, new_block in replaced:
+            if len(path) > 1:
+                path[-2].element.remove_elem(path[-1].element)
+        for path, new_block in replaced:
+            block = path[-1]
+            siblings = old_result.blocks
+            if len(path) > 1:
+                siblings = path[-2].children
+                _add_elem(path[-2].element, new_block.element)
+            siblings[siblings.index(block)] = new_block
+            removed.append(block)
+            added.append(new_block)
+
+        _rebuild_model(old_result.model, old_result.blocks)
+        result = IncrementalResult(content, old_result.model,\
+            old_result.blocks, parser.skip_crossref)
+        result.changed = (removed, added)
+        if not parser.skip_crossref:
+            _rerun_crossref(parser, result, removed, added)
+    except DommError:
+        # Let full parse report the error
+        return parse_incremental(parser, content)
+    return result
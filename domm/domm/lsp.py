@@ -0,0 +1,481 @@
+##############################################################################
+# Name: lsp.py
+# Purpose: Language server for DOMMLite documents
+# Author: Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# Copyright: (c) 2014 Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# License: MIT License
+#
+# Language Server Protocol over stdio. Open documents are parsed with
+# parse_incremental and edits are applied with reparse, so only blocks
+# touched by an edit are parsed again. Documents are parsed without cross
+# referencing, which is then done node by node and only for nodes affected
+# by the edit, so every semantic error is reported, not only the first one.
+#
+#   python lsp.py
+##############################################################################
+import re
+import sys
+import json
+import bisect
+import inspect
+import traceback
+
+from arpeggio import NoMatch
+from metamodel import *
+from parser import DommParser
+from incremental import Edit, second_pass_nodes, crossref_nodes,\
+    run_second_pass, enclosing
+from client import PARSE_ERROR, METHOD_NOT_FOUND, INVALID_PARAMS,\
+    INTERNAL_ERROR
+
+# Diagnostic severity of errors
+ERROR = 1
+
+# Characters of (qualified) names
+_NAME = re.compile(r"[\w.]+")
+
+def _target_text(ref):
+    target = ref._target
+    if type(target) is Qid:
+        return target._canon
+    return target
+
+class Document(object):
+    """
+    Parse state of an open document.
+
+    Attributes:
+        uri(str): uri of the document
+        content(str): current content, UTF-8 encoded
+        version(int): version given by the client
+        result(IncrementalResult): result of the last (re)parse, None when
+            the content doesn't parse
+        error: (offset, message) of the error that stopped parsing
+        node_errors(dict): (block, node, DommError) of nodes whose cross
+            references are wrong, by id of the node
+    """
+    def __init__(self, uri, content, version = None):
+        super(Document, self).__init__()
+        self.uri = uri
+        self.content = content
+        self.version = version
+        self.result = None
+        self.error = None
+        self.node_errors = dict()
+        self._lines = None
+        self._index = None
+
+    def set_content(self, content):
+        self.content = content
+        self._lines = None
+        self._index = None
+
+    @property
+    def lines(self):
+        """
+        Offsets of line starts.
+        """
+        if self._lines is None:
+            lines = [0]
+            pos = self.content.find("\n")
+            while pos >= 0:
+                lines.append(pos + 1)
+                pos = self.content.find("\n", pos + 1)
+            self._lines = lines
+        return self._lines
+
+    def offset(self, position):
+        """
+        Returns offset of LSP position, a dict with line and character.
+        Characters are counted in UTF-16 code units, as LSP does.
+        """
+        lines = self.lines
+        line = min(position["line"], len(lines) - 1)
+        start = lines[line]
+        end = lines[line + 1] if line + 1 < len(lines) else len(self.content)
+        text = self.content[start:end].decode("utf-8", "replace")\
+            .encode("utf-16-le")
+        text = text[:2 * position["character"]].decode("utf-16-le", "ignore")
+        return start + len(text.encode("utf-8"))
+
+    def position(self, offset):
+        """
+        Returns LSP position of offset.
+        """
+        line = bisect.bisect_right(self.lines, offset) - 1
+        start = self.lines[line]
+        text = self.content[start:offset].decode("utf-8", "replace")
+        return {"line": line, "character": len(text.encode("utf-16-le")) // 2}
+
+    def range(self, start, end):
+        return {"start": self.position(start), "end": self.position(end)}
+
+    def header(self, block):
+        """
+        Returns (start, end) offsets of the first line of block.
+        """
+        end = self.content.find("\n", block.start, block.end)
+        return block.start, block.end if end < 0 else end
+
+    def span(self, block, elem):
+        """
+        Returns (start, end) offsets of the definition of elem in block, the
+        first line of block for its own element. Members are found by their
+        name inside their classifier.
+        """
+        if block.element is not elem:
+            name = elem.op_name if type(elem) is Operation else elem.name
+            found = self.occurrences(block, name) if name else None
+            if found:
+                return found[0]
+        return self.header(block)
+
+    def index(self):
+        """
+        Returns (blocks, refs), where blocks maps ids of elements and of
+        their members to blocks defining them and refs are (block, ref)
+        pairs of all references. It's built once per content.
+        """
+        if self._index is None:
+            blocks = dict()
+            refs = []
+            for block in self.result.walk():
+                blocks[id(block.element)] = block
+                if block.kind == "package":
+                    continue
+                for node in second_pass_nodes(block.element):
+                    blocks.setdefault(id(node), block)
+                    for ref in node._refs():
+                        refs.append((block, ref))
+            self._index = (blocks, refs)
+        return self._index
+
+    def name_at(self, offset):
+        """
+        Returns (start, end) offsets of the (qualified) name at offset.
+        """
+        start = offset
+        while start > 0 and _NAME.match(self.content[start - 1]):
+            start -= 1
+        match = _NAME.match(self.content, start)
+        if match is None or match.end() < offset:
+            return None
+        return start, match.end()
+
+    def occurrences(self, block, text):
+        """
+        Returns (start, end) offsets of text used as a name inside block.
+        """
+        pattern = re.compile(r"(?<![\w.])%s(?![\w.])" % re.escape(text))
+        return [(x.start(), x.end()) for x in\
+            pattern.finditer(self.content, block.start, block.end)]
+
+class LanguageServer(object):
+    """
+    Language server of DOMMLite documents, speaking LSP over a pair of
+    streams.
+
+    Args:
+        reader(file): stream requests are read from
+        writer(file): stream responses and notifications are written to
+        parser(DommParser): parser of documents
+    """
+    def __init__(self, reader = None, writer = None, parser = None):
+        super(LanguageServer, self).__init__()
+        self.reader = reader or sys.stdin
+        self.writer = writer or sys.stdout
+        self.parser = parser or DommParser()
+        self.documents = dict()
+        self.running = True
+        self.methods = {
+            "initialize": self.initialize,
+            "initialized": lambda **params: None,
+            "shutdown": lambda **params: None,
+            "exit": self.exit,
+            "textDocument/didOpen": self.did_open,
+            "textDocument/didChange": self.did_change,
+            "textDocument/didClose": self.did_close,
+            "textDocument/definition": self.definition,
+            "textDocument/references": self.references,
+        }
+
+    def read(self):
+        """
+        Returns the next message or None at the end of input.
+        """
+        length = None
+        while True:
+            line = self.reader.readline()
+            if not line:
+                return None
+            line = line.strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        return json.loads(self.reader.read(length))
+
+    def send(self, message):
+        body = json.dumps(message)
+        self.writer.write("Content-Length: %s\r\n\r\n%s" % (len(body), body))
+        self.writer.flush()
+
+    def notify(self, method, params):
+        self.send({"jsonrpc": "2.0", "method": method, "params": params})
+
+    def serve(self):
+        while self.running:
+            try:
+                message = self.read()
+            except ValueError:
+                self.send({"jsonrpc": "2.0", "id": None, "error":\
+                    {"code": PARSE_ERROR, "message": "invalid message"}})
+                continue
+            if message is None:
+                break
+            response = self.handle(message)
+            if response is not None:
+                self.send(response)
+
+    def handle(self, message):
+        """
+        Handles a message and returns the response, None for notifications.
+        Errors of requests are answered, errors of notifications are logged
+        to stderr and ignored.
+        """
+        if type(message) is not dict:
+            return None
+        handler = self.methods.get(message.get("method"))
+        if handler is None:
+            if "id" not in message:
+                return None
+            return {"jsonrpc": "2.0", "id": message["id"], "error":\
+                {"code": METHOD_NOT_FOUND, "message": "unknown method %s"\
+                % message.get("method")}}
+        params = message.get("params") or dict()
+        try:
+            if type(params) is not dict:
+                raise TypeError("params must be an object")
+            params = dict((str(x), y) for x, y in params.iteritems())
+            inspect.getcallargs(handler, **params)
+        except (TypeError, UnicodeError) as e:
+            error = {"code": INVALID_PARAMS, "message": str(e)}
+        else:
+            try:
+                result = handler(**params)
+            except Exception as e:
+                error = {"code": INTERNAL_ERROR, "message": "%s: %s" %\
+                    (type(e).__name__, e)}
+            else:
+                error = None
+
+        if "id" not in message:
+            if error is not None:
+                traceback.print_exc()
+            return None
+        if error is not None:
+            return {"jsonrpc": "2.0", "id": message["id"], "error": error}
+        return {"jsonrpc": "2.0", "id": message["id"], "result": result}
+
+    def initialize(self, **params):
+        return {"capabilities": {
+            # Changes are sent as edits of the previous content
+            "textDocumentSync": 2,
+            "definitionProvider": True,
+            "referencesProvider": True,
+        }}
+
+    def exit(self, **params):
+        self.running = False
+
+    def did_open(self, textDocument, **params):
+        doc = Document(textDocument["uri"],\
+            textDocument["text"].encode("utf-8"),\
+            textDocument.get("version"))
+        self.documents[doc.uri] = doc
+        self.update(doc)
+
+    def did_change(self, textDocument, contentChanges, **params):
+        doc = self.documents[textDocument["uri"]]
+        doc.version = textDocument.get("version")
+        for change in contentChanges:
+            text = change["text"].encode("utf-8")
+            if "range" not in change:
+                doc.set_content(text)
+                self.update(doc)
+                continue
+            edit = Edit(doc.offset(change["range"]["start"]),\
+                doc.offset(change["range"]["end"]), text)
+            doc.set_content(doc.content[:edit.start] + text\
+                + doc.content[edit.end:])
+            self.update(doc, edit)
+
+    def did_close(self, textDocument, **params):
+        self.documents.pop(textDocument["uri"], None)
+        self.notify("textDocument/publishDiagnostics",\
+            {"uri": textDocument["uri"], "diagnostics": []})
+
+    def update(self, doc, edit = None):
+        """
+        Parses content of doc again, only blocks touched by edit when the
+        previous content parsed, checks cross references of nodes affected
+        by the change and publishes diagnostics.
+        """
+        parser = self.parser
+        with parser.parsing(parser.new_context(skip_crossref = True)):
+            try:
+                if edit is not None and doc.result is not None:
+                    doc.result = parser.reparse(doc.result, [edit])
+                else:
+                    doc.result = parser.parse_incremental(doc.content)
+                doc.error = None
+            except NoMatch as e:
+                doc.result = None
+                doc.error = (e.position, str(e))
+            except DommError as e:
+                # Errors of the first pass have no position, the edit that
+                # caused them is the best guess
+                doc.result = None
+                doc.error = (edit.start if edit else 0,\
+                    "%s: %s" % (type(e).__name__, e.message))
+
+        if doc.result is not None:
+            self.check(doc)
+        self.publish(doc)
+
+    def check(self, doc):
+        """
+        Runs second pass on nodes affected by the last (re)parse and keeps
+        their errors.
+        """
+        result = doc.result
+        if result.changed is None:
+            doc.node_errors = dict()
+            nodes = []
+            for block in result.walk():
+                if block.kind != "package":
+                    nodes.extend(second_pass_nodes(block.element))
+        else:
+            removed, added = result.changed
+            nodes = crossref_nodes(result, removed, added)
+            removed_blocks = set(id(x) for y in removed for x in y.walk())
+            rerun = set(id(x) for x in nodes)
+            doc.node_errors = dict((x, y) for x, y in\
+                doc.node_errors.iteritems() if x not in rerun\
+                and id(y[0]) not in removed_blocks)
+
+        errors = dict()
+        with self.parser.parsing(self.parser.new_context(\
+                skip_crossref = False)):
+            run_second_pass(self.parser, result.model, nodes, errors)
+        if errors:
+            blocks = dict()
+            for block in result.walk():
+                for node in second_pass_nodes(block.element):
+                    blocks[id(node)] = block
+            for node in nodes:
+                if id(node) in errors:
+                    doc.node_errors[id(node)] = (blocks[id(node)], node,\
+                        errors[id(node)])
+
+    def diagnostics(self, doc):
+        """
+        Returns LSP diagnostics of doc.
+        """
+        retval = []
+        def add(start, end, message):
+            retval.append({"range": doc.range(start, end),\
+                "severity": ERROR, "source": "domm", "message": message})
+
+        if doc.error is not None:
+            add(doc.error[0], doc.error[0], doc.error[1])
+            return retval
+
+        for block, node, error in sorted(doc.node_errors.itervalues(),\
+                key = lambda x: x[0].start):
+            start, end = doc.span(block, node)
+            add(start, end, "%s: %s" % (type(error).__name__, error.message))
+
+        model = doc.result.model
+        for cycle in model.rel_closure(RelType.Extends).cycles:
+            message = ExtendsCycleError([x.name for x in cycle]).message
+            # Index is only built when it's needed, it's a walk of every
+            # node of the document
+            blocks = doc.index()[0]
+            for elem in cycle:
+                start, end = doc.header(blocks[id(elem)])
+                add(start, end, "ExtendsCycleError: %s" % message)
+        return retval
+
+    def publish(self, doc):
+        self.notify("textDocument/publishDiagnostics", {"uri": doc.uri,\
+            "version": doc.version, "diagnostics": self.diagnostics(doc)})
+
+    def _target(self, doc, position):
+        """
+        Returns the element whose name is at position, using the reference
+        bound there, or None.
+        """
+        if doc.result is None:
+            return None
+        span = doc.name_at(doc.offset(position))
+        if span is None:
+            return None
+        text = doc.content[span[0]:span[1]]
+        path = enclosing(doc.result.blocks, span[0], span[1])
+        block = path[-1] if path else None
+
+        blocks, refs = doc.index()
+        for ref_block, ref in refs:
+            if ref_block is block and ref._bound is not None\
+                    and _target_text(ref) == text:
+                return ref._bound
+        # Names of elements themselves, at their definition
+        model = doc.result.model
+        qid = model.get_qid(text, block.element if block else None)
+        return model.qual_elems.get(qid)
+
+    def _location(self, doc, elem):
+        """
+        Returns location of the definition of elem or None.
+        """
+        blocks = doc.index()[0]
+        block = blocks.get(id(elem))
+        if block is None:
+            return None
+        start, end = doc.span(block, elem)
+        return {"uri": doc.uri, "range": doc.range(start, end)}
+
+    def definition(self, textDocument, position, **params):
+        doc = self.documents.get(textDocument["uri"])
+        if doc is None:
+            return None
+        elem = self._target(doc, position)
+        if elem is None:
+            return None
+        return self._location(doc, elem)
+
+    def references(self, textDocument, position, context = None, **params):
+        doc = self.documents.get(textDocument["uri"])
+        if doc is None:
+            return []
+        elem = self._target(doc, position)
+        if elem is None:
+            return []
+        retval = []
+        if context and context.get("includeDeclaration"):
+            location = self._location(doc, elem)
+            if location is not None:
+                retval.append(location)
+
+        found = set()
+        for block, ref in doc.index()[1]:
+            if ref._bound is elem:
+                found.update(doc.occurrences(block, _target_text(ref)))
+        for start, end in sorted(found):
+            retval.append({"uri": doc.uri, "range": doc.range(start, end)})
+        return retval
+
+if __name__ == "__main__":
+    LanguageServer().serve()
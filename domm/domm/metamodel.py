@@ -9,6 +9,8 @@
 # For more information about DOMMLite DSL please consult the guide
 #    Metamodel, model editor and business  applications generator
 ##############################################################################
+import weakref
+import collections
 from error import *
 from enum import Enum
 
@@ -51,6 +53,148 @@ def print_partial_map(print_map, partial):
         retStr += "\n%s" % print_map[part]
     return retStr
 
+def constraint_refs(constraints):
+    """
+    Yields constraint specs and cross references in their parameters.
+    """
+    for spec in constraints:
+        yield spec
+        for param in spec.parameters:
+            if type(param) is CrossRef:
+                yield param
+
+# Generations of the state of models. Values cached on elements, like their
+# fingerprints or effective members, are only valid in the generation of the
+# model the element belongs to, or of all elements not in a model, that they
+# were computed in. A change creates a new generation object of the model,
+# so changes of one model don't invalidate values cached in other models.
+# Generations aren't pickled, so values restored by unpickling are never
+# taken as valid. The epoch changes with invalidate_caches for all models.
+_generation = object()
+_epoch = object()
+
+def _model_of(elem):
+    if type(elem) is Model:
+        return elem
+    return elem.__dict__.get("_parent_model")
+
+def _generation_of(elem):
+    """
+    Returns the generation of the model of elem, or of elements not in a
+    model when elem isn't in one.
+    """
+    model = _model_of(elem)
+    if model is None:
+        return _generation
+    generation = model.__dict__.get("_generation")
+    if generation is None:
+        generation = model._generation = object()
+    return generation
+
+def _attach(elem, model):
+    """
+    Makes elem and elements it contains part of model, so their changes
+    invalidate values cached on elements of the model. Elements already in
+    the model are assumed to have their contents in it too.
+    """
+    stack = [elem]
+    while stack:
+        elem = stack.pop()
+        if not isinstance(elem, _MODEL_ELEMENTS) or type(elem) is Model\
+            or elem.__dict__.get("_parent_model") is model:
+            continue
+        elem._parent_model = model
+        for name, value in elem.__dict__.iteritems():
+            if name.startswith("_"):
+                continue
+            if type(value) is dict:
+                stack.extend(value.itervalues())
+            elif type(value) is list or type(value) is set:
+                stack.extend(value)
+            else:
+                stack.append(value)
+
+def _changed(elem, *added):
+    """
+    Invalidates values cached on elements of the model of elem, or on all
+    elements not in a model when elem isn't in one. Elements added to elem
+    become part of its model.
+    """
+    global _generation
+    model = _model_of(elem)
+    if model is None:
+        _generation = object()
+        return
+    model._generation = object()
+    for child in added:
+        _attach(child, model)
+
+def invalidate_caches(model = None):
+    """
+    Invalidates values cached on elements of model, or of all models when
+    it's not given. Methods changing elements do it themselves, it's only
+    needed after their attributes were assigned directly.
+    """
+    global _epoch, _generation
+    if model is None:
+        _epoch = object()
+        _generation = object()
+    else:
+        model._generation = object()
+
+def _valid(elem, cached):
+    return cached is not None and cached[0] is _epoch\
+        and cached[1] is _generation_of(elem)
+
+def _fingerprint(elem, content_hash):
+    """
+    Returns content fingerprint of elem, computed by content_hash and cached
+    until its model changes. Hashes of children are fingerprints too, so
+    fingerprints of unchanged subtrees aren't computed again.
+    """
+    cached = elem.__dict__.get("_fingerprint")
+    if _valid(elem, cached):
+        return cached[2]
+    value = content_hash()
+    elem._fingerprint = (_epoch, _generation_of(elem), value)
+    return value
+
+def unordered_hash(items):
+    """
+    Hash of a collection that doesn't depend on the order of its items, for
+    sets and dicts whose equal instances may iterate in different order.
+    """
+    return hash(frozenset(hash(x) for x in items))
+
+def _effective_members(elem, members, cache):
+    """
+    Returns dict of members of elem merged with members it inherits through
+    extends, own members taking precedence. members returns own members of a
+    classifier as a dict and cache names the attribute used to memoize the
+    result. Classifiers whose views are valid are reused, so in a hierarchy
+    each classifier is merged once.
+    """
+    chain = []
+    seen = set()
+    result = dict()
+    while elem is not None:
+        cached = getattr(elem, cache)
+        if _valid(elem, cached):
+            result = cached[2]
+            break
+        if id(elem) in seen:
+            raise ExtendsCycleError([x.name for x in chain])
+        seen.add(id(elem))
+        chain.append(elem)
+        elem = elem.extends._bound if elem.extends else None
+
+    for elem in reversed(chain):
+        merged = dict(result)
+        merged.update(members(elem))
+        setattr(elem, cache, (_epoch, _generation_of(elem), merged))
+        result = merged
+    return result
+
 def type_to_name(element):
     if type(element) is Entity:
         return "entity"
@@ -81,6 +225,7 @@ class NamedElement(object):
         self.long_desc = long_desc
 
     def set_descs(self, named_el):
+        _changed(self)
         assert type(named_el) is NamedElement
         assert named_el is not None
         self.short_desc = named_el.short_desc
@@ -125,32 +270,38 @@ class Id(object):
 class Qid(object):
     """
     Qualified ID
+
+    Qids are immutable and interned, there is only one Qid object for each
+    path. Canonical string and hash are computed once, when the Qid is
+    created, since Qids are used as keys of all namespaces.
     """
-    def __init__(self, path):
-        super(Qid, self).__init__()
-        assert type(path) is list or type(path) is str
-        self.path = []
-        if type(path) is list:
-            if path and len(path) > 0:
-                self.path = path
-        elif type(path) is str:
-            self.path = path.split(".")
+    __slots__ = ("path", "_canon", "_id", "_hash", "__weakref__")
 
-    @property
-    def _canon(self):
-        retval = ""
-        for i, part in enumerate(self.path):
-            if i > 0:
-                retval += "."
-            retval += part
-        return retval
+    _interned = weakref.WeakValueDictionary()
 
-    @property
-    def _id(self):
-        if self.path and len(self.path) > 0:
-            return self.path[-1]
+    def __new__(cls, path):
+        assert type(path) is list or type(path) is tuple or type(path) is str
+        if type(path) is str:
+            path = tuple(path.split("."))
         else:
-            return None
+            path = tuple(path)
+
+        retval = cls._interned.get(path)
+        if retval is None:
+            retval = super(Qid, cls).__new__(cls)
+            canon = ".".join(path)
+            object.__setattr__(retval, "path", path)
+            object.__setattr__(retval, "_canon", canon)
+            object.__setattr__(retval, "_id", path[-1] if path else None)
+            object.__setattr__(retval, "_hash", hash(canon))
+            retval = cls._interned.setdefault(path, retval)
+        return retval
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Qid is immutable")
+
+    def __reduce__(self):
+        return (Qid, (self.path,))
 
     def depth(self):
         return len(self.path)
@@ -159,11 +310,15 @@ class Qid(object):
         return len(self.path) > 1
 
     def add_outer_level(self, outer):
+        """
+        Returns Qid with outer level prepended to the path of this Qid.
+        """
         assert type(outer) is str
-        self.path.insert(0, outer)
-        return self
+        return Qid((outer,) + self.path)
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if type(self) is type(other):
             return self.path == other.path
         return False
@@ -172,16 +327,10 @@ class Qid(object):
         return not self.__eq__(other)
 
     def __hash__(self):
-        return fnvhash(self.path)
+        return self._hash
 
     def __repr__(self):
-        retval = "Qid("
-        for i, part in enumerate(self.path):
-            if i > 0:
-                retval += "."
-            retval += part
-        retval += ")"
-        return retval
+        return "Qid(%s)" % self._canon
 
 class RelObj(object):
     """Helper object for relationships"""
@@ -220,6 +369,293 @@ class RelType(Enum):
     Composite = 3,
     Reference = 4
 
+class Namespace(object):
+    """
+    Node of the namespace tree of a model. Symbols defined directly in its
+    scope are kept in the symbols table, by their short name.
+
+    Attributes:
+        name(str): short name of the node, None for the root
+        parent(Namespace): enclosing namespace, None for the root
+        qid(str): canonical qualified id of the element defined by the node
+            or None if the node is only a level of some longer qid
+        elem: element defined by the node
+        symbols(dict): child namespaces by their short names
+    """
+    def __init__(self, name = None, parent = None):
+        super(Namespace, self).__init__()
+        self.name = name
+        self.parent = parent
+        self.qid = None
+        self.elem = None
+        self.symbols = dict()
+
+    def child(self, name):
+        retval = self.symbols.get(name)
+        if retval is None:
+            retval = Namespace(name, self)
+            self.symbols[name] = retval
+        return retval
+
+    def is_scope(self):
+        """
+        Packages (and levels that aren't elements) open a scope for name
+        resolution, classifiers and their features don't.
+        """
+        return self.elem is None or type(self.elem) is Package
+
+    def find(self, path):
+        """
+        Returns the namespace of the element path refers to, relative to this
+        namespace, or None.
+        """
+        node = self
+        for part in path:
+            node = node.symbols.get(part)
+            if node is None:
+                return None
+        if node.qid is None:
+            return None
+        return node
+
+class SymbolTable(object):
+    """
+    Hierarchical symbol table of a model, built from its qualified elements.
+
+    Names are resolved from the package enclosing the referencing element
+    outwards to the root of the model, so that the innermost definition of
+    a name wins. Short names that aren't visible from the scope fall back
+    to model wide unique names. Resolved names are memoized per scope.
+    """
+    def __init__(self, model):
+        super(SymbolTable, self).__init__()
+        self.root = Namespace()
+        self._unique = model.unique
+        self._nodes = dict()
+        self._resolved = dict()
+
+        for qid, elem in model.qual_elems.iteritems():
+            node = self.root
+            for part in qid.split("."):
+                node = node.child(part)
+            node.qid = qid
+            node.elem = elem
+            self._nodes[id(elem)] = node
+
+    def namespace_of(self, elem):
+        """
+        Returns namespace defined by elem, or None if elem isn't in model.
+        """
+        return self._nodes.get(id(elem))
+
+    def scope_of(self, elem):
+        """
+        Returns namespace of the package enclosing elem.
+        """
+        node = self._nodes.get(id(elem))
+        if node is None:
+            return self.root
+        node = node.parent
+        while not node.is_scope():
+            node = node.parent
+        return node
+
+    def resolve(self, path, scope = None):
+        """
+        Returns canonical qid of the element path refers to, seen from scope
+        namespace, or None if it can't be resolved.
+        """
+        if scope is None:
+            scope = self.root
+        key = (scope, path)
+        if key in self._resolved:
+            return self._resolved[key]
+
+        retval = None
+        node = scope
+        while node is not None and retval is None:
+            found = node.find(path)
+            if found is not None:
+                retval = found.qid
+            node = node.parent
+
+        if retval is None and len(path) == 1:
+            retval = self._unique.get(path[0]) or None
+
+        self._resolved[key] = retval
+        return retval
+
+class RelGraph(object):
+    """
+    Index of relationships of a model. Relationships are kept in adjacency
+    maps by their source (elem_a) and target (elem_b), both for all types
+    and per RelType, so neighbours of an element are found in O(degree).
+    Elements are indexed by identity, since their hashes depend on their
+    whole content.
+    """
+    def __init__(self, rels = None):
+        super(RelGraph, self).__init__()
+        self._out = dict()
+        self._in = dict()
+        self._by_type = dict()
+        if rels:
+            for rel in rels:
+                self.add(rel)
+
+    def add(self, rel):
+        source = id(rel.elem_a)
+        target = id(rel.elem_b)
+        self._out.setdefault((source, None), []).append(rel)
+        self._out.setdefault((source, rel.rel_type), []).append(rel)
+        self._in.setdefault((target, None), []).append(rel)
+        self._in.setdefault((target, rel.rel_type), []).append(rel)
+        self._by_type.setdefault(rel.rel_type, []).append(rel)
+
+    def _discard(self, index, key, rel):
+        rels = index.get(key)
+        if rels is not None:
+            rels[:] = [x for x in rels if x is not rel]
+            if not rels:
+                del index[key]
+
+    def remove(self, rel):
+        source = id(rel.elem_a)
+        target = id(rel.elem_b)
+        self._discard(self._out, (source, None), rel)
+        self._discard(self._out, (source, rel.rel_type), rel)
+        self._discard(self._in, (target, None), rel)
+        self._discard(self._in, (target, rel.rel_type), rel)
+        self._discard(self._by_type, rel.rel_type, rel)
+
+    def outgoing(self, elem, rel_type = None):
+        """
+        Returns relationships with elem as their source (elem_a).
+        """
+        return list(self._out.get((id(elem), rel_type), ()))
+
+    def incoming(self, elem, rel_type = None):
+        """
+        Returns relationships with elem as their target (elem_b).
+        """
+        return list(self._in.get((id(elem), rel_type), ()))
+
+    def of_type(self, rel_type):
+        return list(self._by_type.get(rel_type, ()))
+
+class RelClosure(object):
+    """
+    Strongly connected components and transitive closure of relationships
+    of one type. Components are found with Tarjan's algorithm in a single
+    linear pass, which yields them in reverse topological order, so elements
+    reachable from a component are known by the time it is emitted and are
+    memoized per component.
+
+    Attributes:
+        rel_type(RelType): type of relationships followed
+        reverse(bool): when True relationships are followed from their
+            target (elem_b) to their source (elem_a)
+        cycles(list): lists of elements forming a cycle, in order they were
+            found
+    """
+    def __init__(self, graph, rel_type, reverse = False):
+        super(RelClosure, self).__init__()
+        self.rel_type = rel_type
+        self.reverse = reverse
+        self.cycles = []
+        self._graph = graph
+        self._elems = dict()
+        self._comp = dict()
+        self._reach = []
+        self._reach_ids = []
+        for rel in graph.of_type(rel_type):
+            self._elems[id(rel.elem_a)] = rel.elem_a
+            self._elems[id(rel.elem_b)] = rel.elem_b
+        self._tarjan()
+
+    def _next(self, elem):
+        if self.reverse:
+            return [x.elem_a for x in self._graph.incoming(elem, self.rel_type)]
+        return [x.elem_b for x in self._graph.outgoing(elem, self.rel_type)]
+
+    def _tarjan(self):
+        index = dict()
+        low = dict()
+        stack = []
+        on_stack = set()
+        for root in self._elems.itervalues():
+            if id(root) in index:
+                continue
+            index[id(root)] = low[id(root)] = len(index)
+            stack.append(root)
+            on_stack.add(id(root))
+            work = [(root, iter(self._next(root)))]
+            while work:
+                elem, succs = work[-1]
+                for succ in succs:
+                    if id(succ) not in index:
+                        index[id(succ)] = low[id(succ)] = len(index)
+                        stack.append(succ)
+                        on_stack.add(id(succ))
+                        work.append((succ, iter(self._next(succ))))
+                        break
+                    elif id(succ) in on_stack:
+                        low[id(elem)] = min(low[id(elem)], index[id(succ)])
+                else:
+                    work.pop()
+                    if work:
+                        parent = id(work[-1][0])
+                        low[parent] = min(low[parent], low[id(elem)])
+                    if low[id(elem)] == index[id(elem)]:
+                        members = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(id(member))
+                            members.append(member)
+                            if member is elem:
+                                break
+                        self._add_component(members[::-1])
+
+    def _add_component(self, members):
+        comp = len(self._reach)
+        for member in members:
+            self._comp[id(member)] = comp
+        cyclic = len(members) > 1 or\
+            any(x is members[0] for x in self._next(members[0]))
+        if cyclic:
+            self.cycles.append(members)
+
+        reach = []
+        reach_ids = set()
+        for member in members:
+            for succ in self._next(member):
+                other = self._comp[id(succ)]
+                if other == comp:
+                    found = [succ]
+                else:
+                    found = [succ] + self._reach[other]
+                for elem in found:
+                    if id(elem) not in reach_ids:
+                        reach_ids.add(id(elem))
+                        reach.append(elem)
+        self._reach.append(reach)
+        self._reach_ids.append(frozenset(reach_ids))
+
+    def reachable(self, elem):
+        """
+        Returns elements reachable from elem, nearest ones first.
+        """
+        comp = self._comp.get(id(elem))
+        if comp is None:
+            return []
+        return list(self._reach[comp])
+
+    def reaches(self, elem, other):
+        """
+        Returns True when other is reachable from elem.
+        """
+        comp = self._comp.get(id(elem))
+        return comp is not None and id(other) in self._reach_ids[comp]
+
 class Model(NamedElement):
     """
     This class represents the meta model for DOMMLite model
@@ -227,32 +663,121 @@ class Model(NamedElement):
     """
     def __init__(self, name =None, short_desc = None, long_desc = None):
         super(Model, self).__init__(name, short_desc, long_desc)
+        self.elems = dict()
         self.qual_elems = dict()
         self.unique = dict()
         self._rels = []
+        self._graph = None
+        self._closures = dict()
         self._containment = set()
+        self._symbols = None
+        self._constraint_checks = dict()
 
     def _flatten_package(self, pack):
-        for qid, elem in pack.elems.iteritems():
-            if type(elem) is not Package:
-                if type(qid) is Qid:
-                    self.add_elem(elem, qid._canon, qid._id,\
-                        type_to_name(elem))
-                elif type(qid) is str:
-                    self.add_elem(elem, qid, qid, type_to_name(elem))
-        for qid, elem in pack._imported.iteritems():
+        for path, elem in pack._walk_paths():
             if type(elem) is not Package:
-                if type(qid) is Qid:
-                    self.add_elem(elem, qid._canon, qid._id,\
+                if type(path) is tuple:
+                    self.add_elem(elem, ".".join(path), path[-1],\
                         type_to_name(elem))
-                elif type(qid) is str:
-                    self.add_elem(elem, qid, qid, type_to_name(elem))
+                else:
+                    self.add_elem(elem, path, path, type_to_name(elem))
 
     def _add_rel(self, rel):
         assert type(rel) is RelObj
         self._rels.append(rel)
+        self._closures = dict()
+        _changed(self)
+        if self._graph is not None:
+            self._graph.add(rel)
+
+    def _remove_rels(self, rels):
+        """
+        Removes given relationships from the model.
+        """
+        removed = set(id(x) for x in rels)
+        self._rels = [x for x in self._rels if id(x) not in removed]
+        self._closures = dict()
+        _changed(self)
+        if self._graph is not None:
+            for rel in rels:
+                self._graph.remove(rel)
+
+    @property
+    def rel_graph(self):
+        """
+        Index of the model relationships, see RelGraph. It's built on first
+        use and then kept up to date as relationships are added.
+        """
+        if self._graph is None:
+            self._graph = RelGraph(self._rels)
+        return self._graph
+
+    def rels_from(self, elem, rel_type = None):
+        """
+        Returns relationships of given type (all when None) going from elem,
+        e.g. rels_from(ent, RelType.Depends) are services ent depends on.
+        """
+        return self.rel_graph.outgoing(elem, rel_type)
+
+    def rels_to(self, elem, rel_type = None):
+        """
+        Returns relationships of given type (all when None) going to elem,
+        e.g. rels_to(ent, RelType.Extends) are classifiers extending ent.
+        """
+        return self.rel_graph.incoming(elem, rel_type)
+
+    def rels_of_type(self, rel_type):
+        return self.rel_graph.of_type(rel_type)
+
+    def rel_closure(self, rel_type, reverse = False):
+        """
+        Returns RelClosure of relationships of given type. It's computed once
+        and reused until relationships of the model change.
+        """
+        key = (rel_type, reverse)
+        closure = self._closures.get(key)
+        if closure is None:
+            closure = RelClosure(self.rel_graph, rel_type, reverse)
+            self._closures[key] = closure
+        return closure
+
+    def ancestors(self, elem):
+        """
+        Returns classifiers elem extends directly or indirectly, starting
+        with the one it extends directly.
+        """
+        return self.rel_closure(RelType.Extends).reachable(elem)
+
+    def descendants(self, elem):
+        """
+        Returns classifiers that extend elem directly or indirectly.
+        """
+        return self.rel_closure(RelType.Extends, True).reachable(elem)
+
+    def is_ancestor(self, base, elem):
+        """
+        Returns True when elem extends base directly or indirectly.
+        """
+        return self.rel_closure(RelType.Extends).reaches(elem, base)
+
+    def cycles(self, rel_type):
+        """
+        Returns lists of elements forming cycles of relationships of given
+        type, e.g. services that depend on each other.
+        """
+        return [list(x) for x in self.rel_closure(rel_type).cycles]
+
+    def check_cycles(self):
+        """
+        Raises ExtendsCycleError if some classifiers extend each other.
+        Cycles of dependencies are allowed, see cycles method.
+        """
+        cycles = self.rel_closure(RelType.Extends).cycles
+        if cycles:
+            raise ExtendsCycleError([x.name for x in cycles[0]])
 
     def add_elem(self, ref, qid, name, type_of):
+        _changed(self, ref)
         if ref and qid:
             if not qid in self.qual_elems:
                 self.qual_elems[qid] = ref
@@ -260,28 +785,167 @@ class Model(NamedElement):
                     self.unique[name] = False
                 else:
                     self.unique[name] = qid
+                self._symbols = None
+                self._constraint_checks = dict()
             else:
                 raise DuplicateTypeError(type_of, name)
 
-    def get_qid(self, name_or_qid):
-        retval = ""
-        if type(name_or_qid) is str \
-            or (type(name_or_qid) is Qid and not name_or_qid.is_resolved()):
-            needle = name_or_qid
-            if type(name_or_qid) is Qid:
-                needle = name_or_qid._canon
-
-            if needle in self.unique:
-                if self.unique[needle] != False:
-                    retval = self.unique[needle]
-        elif type(name_or_qid) is Qid:
-            retval = name_or_qid._canon
+    def _clear_elems(self):
+        """
+        Removes all elements, so that model can be filled again.
+        """
+        _changed(self)
+        self.elems = dict()
+        self.qual_elems = dict()
+        self.unique = dict()
+        self._symbols = None
+        self._constraint_checks = dict()
+
+    @property
+    def symbols(self):
+        """
+        Symbol table of the model, rebuilt when the model was changed.
+        """
+        if self._symbols is None:
+            self._symbols = SymbolTable(self)
+        return self._symbols
+
+    def get_qid(self, name_or_qid, scope = None):
+        """
+        Returns canonical qid of the element referred to by name_or_qid.
+
+        Args:
+            name_or_qid(str or Qid): short or qualified name
+            scope: element from which the name is referred to. Name is looked
+                up from package of scope outwards. When None, the name is
+                looked up from the root of the model.
+
+        Returns empty string for unresolved short names and canonical form of
+        unresolved qualified names.
+        """
+        if type(name_or_qid) is not Qid\
+                and not isinstance(name_or_qid, basestring):
+            return ""
+        if scope is not None:
+            scope = self.symbols.scope_of(scope)
+        return self._resolve(name_or_qid, scope)
+
+    def _resolve(self, name_or_qid, scope):
+        """
+        Resolves name_or_qid from scope namespace, see get_qid.
+        """
+        if type(name_or_qid) is Qid:
+            path = name_or_qid.path
+        else:
+            path = tuple(name_or_qid.split("."))
+
+        retval = self.symbols.resolve(path, scope)
+        if retval is None:
+            retval = ".".join(path) if len(path) > 1 else ""
         return retval
 
-    def get_elem_by_crosref(self, cross_ref):
+    def get_member_qid(self, elem, name_or_qid):
+        """
+        Returns canonical qid of the member of elem (e.g. a property of an
+        entity), falling back to get_qid when elem has no such member.
+        """
+        if type(name_or_qid) is Qid:
+            path = name_or_qid.path
+        else:
+            path = tuple(name_or_qid.split("."))
+
+        node = self.symbols.namespace_of(elem)
+        if node is not None and node.find(path) is not None:
+            return node.find(path).qid
+        return self.get_qid(name_or_qid, elem)
+
+    def get_ref_qid(self, ref, scope = None):
+        """
+        Returns canonical qid of the element ref (a TypeDef, CrossRef or
+        ConstraintSpec) refers to, as get_qid does. Result is kept in the
+        reference, so it is resolved only once.
+        """
+        if ref._qid is None:
+            ref._qid = self.get_qid(ref._target, scope)
+        return ref._qid
+
+    def resolve_refs(self):
+        """
+        Resolves references of all elements of the model in one pass, before
+        they are checked by the second pass of semantic actions.
+
+        Elements are visited scope by scope through the symbol table, each
+        distinct name is resolved once per scope and resolved elements are
+        bound to type definitions and cross references in bulk.
+        """
+        symbols = self.symbols
+        qual_elems = self.qual_elems
+        caches = dict()
+        stack = [(symbols.root, symbols.root)]
+        while stack:
+            node, scope = stack.pop()
+            if node.is_scope():
+                scope = node
+            resolved = caches.setdefault(scope, dict())
+            for child in node.symbols.itervalues():
+                stack.append((child, scope))
+                if child.elem is None or not hasattr(child.elem, "_refs"):
+                    continue
+                for ref in child.elem._refs():
+                    target = ref._target
+                    qid = resolved.get(target)
+                    if qid is None:
+                        qid = self._resolve(target, scope)
+                        resolved[target] = qid
+                    ref._qid = qid
+
+                    bound = qual_elems.get(qid)
+                    if type(ref) is TypeDef:
+                        ref._bound = bound
+                    elif type(ref) is CrossRef and ref.ref_type is not None\
+                            and type(bound) is ref.ref_type.into_type():
+                        ref._bound = bound
+
+    def bind_constraint(self, constr_spec, scope = None):
+        """
+        Binds constraint spec to its definition, checks its parameters and
+        binds references among them, names being resolved from scope.
+        Returns the constraint definition.
+
+        Specs with the same definition and parameters, including references
+        resolved to the same elements, are only checked once, the rest share
+        the result of the first one.
+        """
+        qid = self.get_ref_qid(constr_spec, scope)
+        params = []
+        for param in constr_spec.parameters:
+            if type(param) is CrossRef:
+                params.append((CrossRef, self.get_ref_qid(param, scope)))
+            else:
+                params.append((type(param), param))
+        key = (qid, tuple(params))
+
+        checked = self._constraint_checks.get(key)
+        if checked is None:
+            constr_def = self.qual_elems[qid]
+            constr_def.check_params(constr_spec)
+            constr_spec._replace_qids(self, scope)
+            checked = (constr_def, constr_spec)
+            self._constraint_checks[key] = checked
+        else:
+            for param, shared in zip(constr_spec.parameters,\
+                    checked[1].parameters):
+                if type(param) is CrossRef:
+                    param.ref = shared.ref
+                    param._bound = shared._bound
+
+        constr_spec._bound = checked[0]
+        return checked[0]
+
+    def get_elem_by_crosref(self, cross_ref, scope = None):
         assert type(cross_ref) is CrossRef
         elem = None
-        qid = self.get_qid(cross_ref.ref._canon)
+        qid = self.get_ref_qid(cross_ref, scope)
         if qid in self.qual_elems:
             elem = self.qual_elems[qid]
             if type(elem) is not cross_ref.ref_type.into_type():
@@ -291,21 +955,34 @@ class Model(NamedElement):
         cross_ref._bound = elem
         return elem
 
+    def __getstate__(self):
+        # Symbol table and relationship graph are keyed by ids of elements,
+        # they are rebuilt on demand
+        state = self.__dict__.copy()
+        state["_symbols"] = None
+        state["_graph"] = None
+        state["_closures"] = dict()
+        state["_constraint_checks"] = dict()
+        state.pop("_generation", None)
+        return state
+
     def add_type(self, type_def):
         assert type(type_def) is DataType
         self.add_elem(type_def, type_def.name, type_def.name, "dataType")
+        self.elems[type_def.name] = type_def
         return self
 
     def add_package(self, package):
         assert type(package) is Package
-        package._update_parent_model(self)
         self.add_elem(package, package.name, package.name, "package")
+        self.elems[package.name] = package
         self._flatten_package(package)
         return self
 
     def add_constraint(self, constr):
         assert type(constr) is Constraint
         self.add_elem(constr, constr.name, constr.name, "constraint")
+        self.elems[constr.name] = constr
         return self
 
 
@@ -314,8 +991,11 @@ class Model(NamedElement):
         (self.name, self.short_desc, self.long_desc, self.qual_elems)
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if type(other) is type(self):
-            return NamedElement.__eq__(self, other)\
+            return hash(self) == hash(other)\
+                and NamedElement.__eq__(self, other)\
                 and self.qual_elems == other.qual_elems
         else:
             return False
@@ -324,12 +1004,31 @@ class Model(NamedElement):
         return not self.__eq__(other)
 
     def __hash__(self):
-        return hash((self.name, self.short_desc, self.long_desc,\
-        fnvhash(self.qual_elems.items())))
+        return _fingerprint(self, lambda: hash((self.name, self.short_desc,\
+            self.long_desc, unordered_hash(self.qual_elems.iteritems()))))
 
     def __getitem__(self, key):
         return self.qual_elems[key]
 
+    def lookup(self, path):
+        """
+        Returns element under path, e.g. "pkg.sub.Ent.prop", or None if
+        there is no such element. Path can be also given as Qid or as a list
+        of names. Each segment is looked up by name in its container, so
+        nested packages and compartments can be on the path as well.
+        """
+        if type(path) is Qid:
+            path = path.path
+        elif isinstance(path, basestring):
+            path = path.split(".")
+
+        elem = self.qual_elems.get(path[0])
+        for part in path[1:]:
+            if elem is None or not hasattr(elem, "_child"):
+                return None
+            elem = elem._child(part)
+        return elem
+
 class DataType(NamedElement):
 
 
@@ -338,9 +1037,6 @@ class DataType(NamedElement):
         super(DataType, self).__init__(name, short_desc, long_desc)
         self.built_in = built_in
 
-    def _update_parent_model(self, model):
-        pass
-
     def __repr__(self):
         return '\ndataType "%s" built_in(%s) (%s %s)' % (
             self.name, self.built_in, self.short_desc, self.long_desc)
@@ -401,6 +1097,57 @@ def constr_to_type(constr_param):
         param_type = CrossRef
     return param_type
 
+class ConstraintChecker(object):
+    """
+    Signature of a tag or validator compiled for checking constraint specs.
+
+    Attributes:
+        name(str): name of the constraint
+        mask(int): bitmask of element types the constraint applies to, see
+            ApplyDef.mask
+        types(tuple): types of parameters at fixed positions
+        variadic(type): type of any number of trailing parameters, None when
+            there are none
+        any_params(bool): True when the signature is `(...)`, which accepts
+            any parameters
+    """
+    def __init__(self, tag):
+        super(ConstraintChecker, self).__init__()
+        self.name = tag.name
+        self.mask = tag.applies.mask if tag.applies else 0
+        constraints = tag.constr_def.constraints if tag.constr_def else []
+        self.any_params = constraints == ["..."]
+        self.variadic = None
+        if len(constraints) == 2 and constraints[1] == "...":
+            self.variadic = constr_to_type(constraints[0])
+            constraints = []
+        self.types = tuple(constr_to_type(x) for x in constraints)
+
+    def check_applies(self, field, field_name):
+        if not _APPLY_BITS.get(type(field), 0) & self.mask:
+            raise ConstraintDoesntApplyError(self.name, field_name)
+
+    def check_params(self, constr):
+        params = constr.parameters
+        if self.any_params:
+            return True
+        if self.variadic is not None:
+            for param in params:
+                if type(param) is not self.variadic:
+                    raise WrongConstraintError(self.name, param)
+            return True
+
+        types = self.types
+        if len(params) != len(types):
+            if not types:
+                raise NoParameterError(self.name)
+            raise WrongNumberOfParameterError(self.name, len(types),\
+                len(params))
+        for pos, param in enumerate(params):
+            if type(param) is not types[pos]:
+                raise WrongConstraintAtPosError(self.name, param, pos)
+        return True
+
 class Constraint(object):
     """
     A unified container for tagTypes and validators,
@@ -412,58 +1159,28 @@ class Constraint(object):
         self.tag = tag
         self.built_in = built_in
         self.constr_type = constr_type
+        self._checker = None
 
-    def _update_parent_model(self, model):
-        pass
+    @property
+    def checker(self):
+        """
+        ConstraintChecker compiled from the signature of the constraint on
+        first use, None if constraint has no tag.
+        """
+        if self._checker is None and self.tag:
+            self._checker = ConstraintChecker(self.tag)
+        return self._checker
 
     # Returns whether the constraint spec matched by id
     # is compatible with property it is bound to
     # and the parameters provided
     def check_applies(self, field, field_name):
         if self.tag:
-            if not self.tag.applies.check_applies(field):
-                raise ConstraintDoesntApplyError(self.tag.name, field_name)
+            self.checker.check_applies(field, field_name)
 
     def check_params(self, constr):
         if self.tag:
-            # Check is constraint definition doesn't have any parameter
-            if self.tag.constr_def is None:
-                if len(constr.parameters) > 0:
-                    raise NoParameterError(self.tag.name)
-            elif self.tag.constr_def is not None \
-                and len(self.tag.constr_def.constraints) == 0:
-                if len(constr.parameters) > 0:
-                    raise NoParameterError(self.tag.name)
-            # Check if constraint definition has elipsis
-            elif self.tag.constr_def is not None\
-                    and len(self.tag.constr_def.constraints) == 1\
-                    and self.tag.constr_def.constraints[0] == "..." :
-                return True
-            elif self.tag.constr_def is not None\
-                    and len(self.tag.constr_def.constraints) == 2\
-                    and self.tag.constr_def.constraints[1] == "...":
-                param_type = constr_to_type(self.tag.constr_def.constraints[0])
-                for param in constr.parameters:
-                    if type(param) is not param_type:
-                        raise WrongConstraintError(self.tag.name, param)
-                return True
-            elif self.tag.constr_def is not None\
-                    and len(self.tag.constr_def.constraints) !=\
-                    len(constr.parameters):
-                expected = len(self.tag.constr_def.constraints)
-                found = len(constr.parameters)
-                raise WrongNumberOfParameterError(self.tag.name, expected,\
-                    found)
-            elif self.tag.constr_def is not None\
-                    and len(self.tag.constr_def.constraints) ==\
-                    len(constr.parameters):
-                for pos, param in enumerate(constr.parameters):
-                    constr_def = self.tag.constr_def.constraints[pos]
-                    param_type = constr_to_type(constr_def)
-                    if type(param) is not param_type:
-                        raise WrongConstraintAtPosError(self.tag.name, param,\
-                            pos)
-                return True
+            return self.checker.check_params(constr)
 
     @property
     def name(self):
@@ -522,10 +1239,8 @@ class Enumeration(NamedElement):
 
         return self
 
-    def _update_parent_model(self, model):
-        pass
-
     def add_literal(self, literal):
+        _changed(self, literal)
         if literal in self.literals:
             raise DuplicateLiteralError(literal.value)
         else:
@@ -535,10 +1250,12 @@ class Enumeration(NamedElement):
             self.literals.add(literal)
 
     def __hash__(self):
-        return hash((self.name, self.short_desc, self.long_desc,\
-            fnvhash(self.literals) ))
+        return _fingerprint(self, lambda: hash((self.name, self.short_desc,\
+            self.long_desc, unordered_hash(self.literals))))
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if type(other) is type(self):
             return self.name == other.name and\
             self.short_desc == other.short_desc and\
@@ -601,23 +1318,25 @@ class ApplyDef(object):
         self.to_op = to_op
         self.to_value_object = to_value_object
 
+    @property
+    def mask(self):
+        """
+        Bitmask of element types the definition applies to, bits are given
+        by _APPLY_BITS.
+        """
+        mask = 0
+        flags = (self.to_entity, self.to_prop, self.to_param,\
+            self.to_service, self.to_op, self.to_value_object)
+        for bit, flag in enumerate(flags):
+            if flag:
+                mask |= 1 << bit
+        return mask
+
     def check_applies(self, field):
-        retval = False
-        if type(field) is Entity:
-            retval = self.to_entity
-        elif type(field) is Property:
-            retval = self.to_prop
-        elif type(field) is OpParam:
-            retval = self.to_param
-        elif type(field) is Service:
-            retval = self.to_service
-        elif type(field) is Operation:
-            retval = self.to_op
-        elif type(field) is ValueObject:
-            retval = self.to_value_object
-        return retval
+        return bool(_APPLY_BITS.get(type(field), 0) & self.mask)
 
     def add_apply(self, appl):
+        _changed(self)
         if appl == "_entity":
             if self.to_entity:
                 raise DuplicateApplyError(appl)
@@ -658,7 +1377,7 @@ class ApplyDef(object):
 
     def __eq__(self, other):
         if type(other) is type(self):
-            return self.__dict__ == other.__dict__
+            return self.mask == other.mask
         return False
 
     def __ne__(self, other):
@@ -702,6 +1421,7 @@ class ConstrDef(object):
         #if size == 0 and constr.
 
     def add_constr(self, constr):
+        _changed(self, constr)
         if "..." in self.constraints:
             raise ElipsisMustBeLast()
         else:
@@ -710,7 +1430,7 @@ class ConstrDef(object):
 
     def __eq__(self, other):
         if type(other) is type(self):
-            return self.__dict__ == other.__dict__
+            return self.constraints == other.constraints
         return False
 
     def __ne__(self, other):
@@ -729,55 +1449,125 @@ class ConstrDef(object):
 class Package(NamedElement):
     """
     Package model that contains other packages or package elements
+
+    Only direct elements of a package are stored in it. Qualified names of
+    elements nested deeper are computed from the tree of packages when they
+    are needed, see _walk_ns and _imported.
     """
     def __init__(self, name = None, short_desc = None, long_desc = None):
         super(Package, self).__init__(name, short_desc, long_desc)
         self._parent_model = None
         self.elems = dict()
-        self._imported = dict()
+        self._names = dict()
 
     def _checked_add(self, add_map, qid, element):
         if qid in add_map:
             raise DuplicateTypeError(type_to_name(element), qid._id)
         add_map[qid] = element
 
-    def _flatten_ns(self, prefix):
-        flatten = dict()
-        for qid, elem in self.elems.iteritems():
-            flatten[qid.add_outer_level(prefix)] = elem
-        for imp_qid, import_val in self._imported.iteritems():
-            flatten[imp_qid.add_outer_level(prefix)] = import_val
-        return flatten
+    @property
+    def _imported(self):
+        """
+        Read only mapping of qualified ids of elements nested in packages and
+        classifiers of this package to the elements.
+        """
+        return NamespaceView(self)
+
+    def _walk_ns(self, direct = True):
+        """
+        Yields (qid, element) pairs for all elements in the package tree.
+        Direct elements of package are skipped when direct is False.
+        """
+        for path, elem in self._walk_paths(direct):
+            if type(path) is tuple:
+                yield Qid(path), elem
+            else:
+                yield path, elem
 
-    def _update_parent_model(self, model):
-        self._parent_model = model
-        for elem in self.elems.itervalues():
-            elem._update_parent_model(model)
+    def _walk_paths(self, direct = True):
+        """
+        Yields (path, element) pairs for all elements in the package tree in
+        a single pass, each path is built once from the path of its parent.
+        Paths are tuples, except for constraints which are kept under their
+        name. Direct elements of package are skipped when direct is False.
+        """
+        stack = [(self, (self.name,))]
+        while stack:
+            pack, pack_path = stack.pop()
+            is_direct = pack is self
+            for qid, elem in pack.elems.iteritems():
+                if type(qid) is not Qid:
+                    if direct or not is_direct:
+                        yield qid, elem
+                    continue
+                path = pack_path + (qid._id,)
+                if direct or not is_direct:
+                    yield path, elem
+                if type(elem) is Package:
+                    stack.append((elem, path))
+                elif hasattr(elem, "_members"):
+                    for name, member in elem._members().iteritems():
+                        yield path + (name,), member
+
+    def _lookup_ns(self, path):
+        """
+        Returns element nested in package under path relative to package or
+        None if there is no such element.
+        """
+        elem = self
+        for part in path:
+            if type(elem) is Package:
+                elem = elem._names.get(part)
+                if type(elem) is Constraint:
+                    return None
+            elif hasattr(elem, "_members"):
+                elem = elem._members().get(part)
+            else:
+                return None
+            if elem is None:
+                return None
+        return elem
 
     def set_name(self, name):
+        _changed(self)
         self.name = name
 
     def add_elem(self, element):
+        _changed(self, element)
         if element and element.name:
-            qid = Qid(element.name).add_outer_level(self.name)
+            qid = Qid((self.name, element.name))
             self._checked_add(self.elems, qid, element)
-            try:
-                flattened = element._flatten_ns(self.name)
-                for qid, element in flattened.iteritems():
-                    self._imported[qid] = element
-            except AttributeError:
-                # We just attempt to read a method or nothing happens
-                pass
+            self._names[element.name] = element
         return self
 
     def add_constraint(self, constraint):
+        _changed(self, constraint)
         assert type(constraint) is Constraint
         self.elems[constraint.name] = constraint
+        self._names[constraint.name] = constraint
         return self
 
+    def remove_elem(self, element):
+        """
+        Removes direct element or constraint from the package.
+        """
+        _changed(self)
+        if type(element) is Constraint:
+            del self.elems[element.name]
+        else:
+            del self.elems[Qid((self.name, element.name))]
+        del self._names[element.name]
+        return self
+
+    def _child(self, name):
+        return self._names.get(name)
+
     def __eq__(self, other):
+        if self is other:
+            return True
         if type(self) is type(other):
-            return self.name == other.name \
+            return hash(self) == hash(other)\
+             and self.name == other.name \
              and self.short_desc == other.short_desc\
              and self.long_desc == other.long_desc\
              and self.elems == other.elems
@@ -787,8 +1577,8 @@ class Package(NamedElement):
         return not self.__eq__(other)
 
     def __hash__(self):
-        return hash((self.name, self.short_desc, self.long_desc,\
-            fnvhash(self.elems.items()) ))
+        return _fingerprint(self, lambda: hash((self.name, self.short_desc,\
+            self.long_desc, unordered_hash(self.elems.iteritems()))))
 
     def __repr__(self):
         retStr = '\n--------------\npackage %s {\n' % self.name
@@ -798,12 +1588,58 @@ class Package(NamedElement):
         return retStr
 
     def __getitem__(self, key):
-        retval = None
-        for i in self.elems:
-            if i._id == key or i._canon == key:
-                retval = self.elems[i]
+        retval = self._names.get(key)
+        # Direct elements can be also given by their qualified id
+        if retval is None and isinstance(key, basestring)\
+                and key.startswith("%s." % self.name):
+            retval = self._names.get(key[len(self.name) + 1:])
         return retval
 
+class NamespaceView(collections.Mapping):
+    """
+    Read only view of the qualified ids of elements nested in a package,
+    without the direct elements of the package. It is computed from the
+    package tree on access, so nothing is copied at each package level.
+    """
+    def __init__(self, package):
+        super(NamespaceView, self).__init__()
+        self._package = package
+
+    def __getitem__(self, key):
+        if type(key) is Qid and len(key.path) > 2\
+                and key.path[0] == self._package.name:
+            elem = self._package._lookup_ns(key.path[1:])
+            if elem is not None:
+                return elem
+        elif type(key) is not Qid:
+            for qid, elem in self.iteritems():
+                if qid == key:
+                    return elem
+        raise KeyError(key)
+
+    def __iter__(self):
+        for qid, elem in self._package._walk_ns(direct = False):
+            yield qid
+
+    def __len__(self):
+        return sum(1 for x in self)
+
+    def iteritems(self):
+        return self._package._walk_ns(direct = False)
+
+    def itervalues(self):
+        for qid, elem in self._package._walk_ns(direct = False):
+            yield elem
+
+    def items(self):
+        return list(self.iteritems())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def __repr__(self):
+        return "NamespaceView(%s)" % dict(self.iteritems())
+
 class Relationship(object):
     """Describes all properties of a Relationship property"""
     def __init__(self, containment = False, opposite_end = None):
@@ -841,8 +1677,14 @@ class TypeDef(NamedElement):
         self.container = False
         self.multi = None
         self._bound = None
+        self._qid = None
+
+    @property
+    def _target(self):
+        return self.type
 
     def set_multi(self, multi = None):
+        _changed(self)
         if multi is None:
             self.multi = None
         elif multi is not None and multi > 0:
@@ -855,6 +1697,7 @@ class TypeDef(NamedElement):
         return self
 
     def set_type(self, type_sign):
+        _changed(self)
         self.type = type_sign
         return self
 
@@ -898,23 +1741,28 @@ class ConstraintSpec(object):
             for param in parameters:
                 self.add_param(param)
         self._bound = None
+        self._qid = None
 
-    def _update_parent_model(self, model):
-        pass
+    @property
+    def _target(self):
+        return self.ident
 
-    def _replace_qids(self, model):
+    def _replace_qids(self, model, scope = None):
+        _changed(self)
         refs = (x for x in self.parameters if type(x) is CrossRef)
         for cref in refs:
-            qual_id = model.unique[cref.ref._canon]
+            qual_id = model.get_ref_qid(cref, scope)
 
-            if qual_id is None:
+            if qual_id not in model.qual_elems:
                 raise TypeNotFoundError(cref.ref._canon)
             else:
                 elem  = model.qual_elems[qual_id]
-                cref.ref = qual_id
+                # Reference stays a Qid, so it can be resolved again
+                cref.ref = Qid(qual_id.split("."))
                 cref._bound = elem
 
     def add_param(self, param):
+        _changed(self, param)
         if type(param) is Id:
             qid = Qid(param._id)
             cross_ref = CrossRef(ref = qid)
@@ -968,8 +1816,13 @@ class Property(object):
         self.relationship = relation
         self.constraints = set()
 
-    def _update_parent_model(self, model):
-        self._parent_model = model
+    def _refs(self):
+        """
+        Yields references of the property resolved by the model.
+        """
+        yield self.type_def
+        for ref in constraint_refs(self.constraints):
+            yield ref
 
     @property
     def name(self):
@@ -979,14 +1832,17 @@ class Property(object):
             return None
 
     def add_relationship(self, rel):
+        _changed(self, rel)
         self.relationship = rel
         return self
 
     def add_type_def(self, type_def):
+        _changed(self, type_def)
         self.type_def = type_def
         return self
 
     def add_constraint_spec(self, constraint_spec):
+        _changed(self, constraint_spec)
         assert type(constraint_spec) is ConstraintSpec
         self.constraints.add(constraint_spec)
         return self
@@ -994,8 +1850,8 @@ class Property(object):
     def __hash__(self):
         # FIXME this should not be frozenset but fhvhash
         return hash((self.ordered, self.unique, self.readonly,
-            self.type_def, self.relationship, frozenset(self.constraints)
-            ))
+            self.required, self.type_def, self.relationship,
+            frozenset(self.constraints)))
 
     def __eq__(self, other):
         if type(other) is type(self):
@@ -1055,19 +1911,11 @@ class ExceptionType(NamedElement):
         self._parent_model = None
         self.props = dict()
 
-    def _update_parent_model(self, model):
-        self._parent_model = model
-        for prop in self.props.itervalues():
-            prop._update_parent_model(model)
-
-    def _flatten_ns(self, prefix):
-        retval = dict()
-        for name, val in self.props.iteritems():
-            namespace = "%s.%s.%s" % (prefix, self.name, name)
-            retval[Qid(namespace)] = val
-        return retval
+    def _members(self):
+        return self.props
 
     def add_prop(self, prop):
+        _changed(self, prop)
         # In exception we can't for example have two same named fields
         #
         # exception FileNotFound {
@@ -1086,6 +1934,8 @@ class ExceptionType(NamedElement):
 
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if type(self) is type(other):
             return NamedElement.__eq__(self, other)\
                 and self.props == other.props
@@ -1095,8 +1945,8 @@ class ExceptionType(NamedElement):
         return not self.__eq__(other)
 
     def __hash__(self):
-        return hash((self.name, self.short_desc, self.long_desc,\
-            fnvhash(self.props.items())))
+        return _fingerprint(self, lambda: hash((self.name, self.short_desc,\
+            self.long_desc, unordered_hash(self.props.iteritems()))))
 
     def __repr__(self):
         retStr = ' exception %s "%s" "%s" {\n' %\
@@ -1105,6 +1955,9 @@ class ExceptionType(NamedElement):
             retStr += "    %s\n" % prop
         return retStr
 
+    def _child(self, name):
+        return self.props.get(name)
+
     def __getitem__(self, key):
         return self.props[key]
 
@@ -1151,9 +2004,11 @@ class CrossRef(object):
         self.ref = ref
         self.ref_type = ref_type
         self._bound = None
+        self._qid = None
 
-    def _update_parent_model(self, model):
-        self._parent_model = model
+    @property
+    def _target(self):
+        return self.ref
 
     def __repr__(self):
         return "%s (of type %s)" % (self.ref._id, self.ref_type)
@@ -1213,7 +2068,7 @@ class OpParam(NamedElement):
     def __hash__(self):
         return hash((self.name, self.short_desc, self.long_desc,
             self.type_def, self.unique, self.required, self.ordered,
-            fnvhash(self.constraints)))
+            unordered_hash(self.constraints)))
 
 class Operation(NamedElement):
     """
@@ -1253,11 +2108,20 @@ class Operation(NamedElement):
         self.throws = []
         self.constraints = set()
 
-    def _update_parent_model(self, model):
-        self._parent_model = model
-        #for param in self.params:
-        #    param._update_parent_model(model)
-
+    def _refs(self):
+        """
+        Yields references of the operation and its parameters resolved by
+        the model.
+        """
+        yield self.type_def
+        for exception in self.throws:
+            yield exception
+        for ref in constraint_refs(self.constraints):
+            yield ref
+        for param in self.params:
+            yield param.type_def
+            for ref in constraint_refs(param.constraints):
+                yield ref
 
     @property
     def op_name(self):
@@ -1271,6 +2135,7 @@ class Operation(NamedElement):
             raise DuplicateExceptionError(self.op_name, exception.ref._canon)
 
     def add_param(self, param):
+        _changed(self, param)
         assert type(param) is OpParam
         for p in self.params:
             if param.type_def.name == p.type_def.name:
@@ -1279,11 +2144,13 @@ class Operation(NamedElement):
         return self
 
     def add_constraint_spec(self, constraint):
+        _changed(self, constraint)
         assert type(constraint) is ConstraintSpec
         self.constraints.add(constraint)
         return self
 
     def add_throws_exception(self, exception):
+        _changed(self, exception)
         assert type(exception) is CrossRef
         assert exception.ref_type == Ref.ExceptType
         self._check_throws(exception)
@@ -1291,6 +2158,8 @@ class Operation(NamedElement):
         return self
 
     def __eq__(self, other):
+        if self is other:
+            return True
         return NamedElement.__eq__(self,other)\
             and self.ordered == other.ordered and self.unique == other.unique\
             and self.required == other.required\
@@ -1302,9 +2171,10 @@ class Operation(NamedElement):
         return not self.__eq__(other)
 
     def __hash__(self):
-        return hash((self.name, self.short_desc, self.long_desc, self.ordered,\
-            self.unique, self.required, self.type_def, fnvhash(self.params),\
-            fnvhash(self.constraints), fnvhash(self.throws)))
+        return _fingerprint(self, lambda: hash((self.name, self.short_desc,\
+            self.long_desc, self.ordered, self.unique, self.required,\
+            self.type_def, fnvhash(self.params),\
+            unordered_hash(self.constraints), fnvhash(self.throws))))
 
     def __repr__(self):
         retStr = " op "
@@ -1345,18 +2215,44 @@ class Compartment(NamedElement):
     def __init__(self, name = None, short_desc = None, long_desc = None,\
         is_op = True):
         super(Compartment, self).__init__(name, short_desc, long_desc)
-        self.elements = set()
+        self._elements = set()
+        self._names = dict()
         self.is_op = is_op
 
+    @property
+    def elements(self):
+        # Unpickled compartments hold elements in a list until first access,
+        # see __setstate__
+        if type(self._elements) is list:
+            self._elements = set(self._elements)
+        return self._elements
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_elements"] = list(self._elements)
+        return state
+
+    def __setstate__(self, state):
+        # Elements are also reachable through their classifier, so while
+        # unpickling they may not be fully restored yet and can't be hashed
+        self.__dict__.update(state)
+
     def add_elem(self, elem):
+        _changed(self, elem)
         if self.is_op:
             assert type(elem) is Operation
         else:
             assert type(elem) is Operation or type(elem) is Property
         self.elements.add(elem)
+        self._names[elem.name] = elem
         return self
 
+    def _child(self, name):
+        return self._names.get(name)
+
     def __eq__(self, other):
+        if self is other:
+            return True
         if type(self) is type(other):
             return NamedElement.__eq__(self, other)\
             and self.elements == other.elements
@@ -1366,8 +2262,8 @@ class Compartment(NamedElement):
         return not self.__eq__(other)
 
     def __hash__(self):
-        return hash((self.name, self.short_desc, self.long_desc,\
-                    fnvhash(self.elements)))
+        return _fingerprint(self, lambda: hash((self.name, self.short_desc,\
+            self.long_desc, unordered_hash(self.elements))))
 
     def __repr__(self):
         retStr = "comparement %s (%s %s) {\n" %\
@@ -1379,12 +2275,7 @@ class Compartment(NamedElement):
         return retStr
 
     def __getitem__(self, key):
-        retval = None
-        for val in self.elements:
-            if key == val.name:
-                retval = val
-                break
-        return retval
+        return self._names.get(key)
 
 class Service(NamedElement):
     """
@@ -1403,29 +2294,33 @@ class Service(NamedElement):
         self.operations = set()
         self.op_compartments = dict()
 
-    def _flatten_ns(self, prefix):
-        retval = dict()
-        for name, val in self.elems.iteritems():
-            namespace = "%s.%s.%s" % (prefix, self.name, name)
-            retval[Qid(namespace)] = val
-        return retval
+    def _members(self):
+        return self.elems
 
     def _check_op(self, oper):
         if oper.op_name in self.elems:
             raise DuplicateTypeError("operation", oper.op_name)
 
-    def _update_parent_model(self, model):
-        self._parent_model = model
-        for elem in self.elems.itervalues():
-            elem._update_parent_model(model)
+    def _refs(self):
+        """
+        Yields references of the service resolved by the model.
+        """
+        if self.extends:
+            yield self.extends
+        for dep in self.dependencies:
+            yield dep
+        for ref in constraint_refs(self.constraints):
+            yield ref
 
     def set_extends(self, extends):
+        _changed(self, extends)
         assert type(extends) is CrossRef
         self.extends = extends
         self.extends.ref_type = Ref.Service
         return self
 
     def set_dependencies(self, deps):
+        _changed(self, *deps)
         assert type(deps) is list
         for cross_ref in deps:
             cross_ref.ref_type = Ref.Service
@@ -1433,11 +2328,13 @@ class Service(NamedElement):
         return self
 
     def add_constraint_spec(self, constr):
+        _changed(self, constr)
         assert type(constr) is ConstraintSpec
         self.constraints.add(constr)
         return self
 
     def add_operation(self, oper, is_compartment = False):
+        _changed(self, oper)
         assert type(oper) is Operation
         self._check_op(oper)
         self.elems[oper.op_name] = oper
@@ -1446,6 +2343,7 @@ class Service(NamedElement):
         return self
 
     def add_op_compartment(self, compartment):
+        _changed(self, compartment)
         self.op_compartments[compartment.name] = compartment
         for op in compartment.elements:
             self.add_operation(op, True)
@@ -1479,21 +2377,31 @@ class Service(NamedElement):
         return retStr
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if type(self) is type(other):
             return NamedElement.__eq__(self, other)\
             and self.extends == other.extends\
             and self.dependencies == other.dependencies\
             and self.constraints == other.constraints\
-            and self.elems == other.elems
+            and self.elems == other.elems\
+            and self.op_compartments == other.op_compartments
         return False
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
     def __hash__(self):
-        return hash((self.name, self.short_desc, self.long_desc, self.extends,
-            fnvhash(self.dependencies), fnvhash(self.constraints),
-            fnvhash(self.elems.items())))
+        return _fingerprint(self, lambda: hash((self.name, self.short_desc,\
+            self.long_desc, self.extends, fnvhash(self.dependencies),\
+            unordered_hash(self.constraints),\
+            unordered_hash(self.elems.iteritems()),\
+            unordered_hash(self.op_compartments.iteritems()))))
+
+    def _child(self, name):
+        if name in self.op_compartments:
+            return self.op_compartments[name]
+        return self.elems.get(name)
 
     def __getitem__(self, key):
         if key in self.op_compartments:
@@ -1514,30 +2422,48 @@ class ValueObject(NamedElement):
             self.dependencies = depends
         self.constraints = set()
         self.props = dict()
+        self._effective = None
 
-    def _flatten_ns(self, prefix):
-        retval = dict()
-        for name, val in self.props.iteritems():
-            namespace = "%s.%s.%s" % (prefix, self.name, name)
-            retval[Qid(namespace)] = val
-        return retval
+    def _members(self):
+        return self.props
+
+    def effective_props(self):
+        """
+        Returns dict of properties of the value object, including ones it
+        inherits from value objects it extends. The dict is computed once and
+        shared until some classifier changes, so it mustn't be modified.
+        """
+        return _effective_members(self, ValueObject._members, "_effective")
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_effective"] = None
+        return state
 
     def _check_prop(self, element):
         if element.name in self.props:
             raise DuplicatePropertyError(element.name)
 
-    def _update_parent_model(self, model):
-        self._parent_model = model
-        for prop in self.props.itervalues():
-            prop._update_parent_model(model)
+    def _refs(self):
+        """
+        Yields references of the value object resolved by the model.
+        """
+        if self.extends:
+            yield self.extends
+        for dep in self.dependencies:
+            yield dep
+        for ref in constraint_refs(self.constraints):
+            yield ref
 
     def set_extends(self, extends):
         assert type(extends) is CrossRef
         self.extends = extends
         self.extends.ref_type = Ref.ValueObject
+        _changed(self, extends)
         return self
 
     def set_dependencies(self, deps):
+        _changed(self, *deps)
         assert type(deps) is list
         for depend in deps:
             depend.ref_type = Ref.Entity
@@ -1545,6 +2471,7 @@ class ValueObject(NamedElement):
         return self
 
     def add_constraint_spec(self, constr):
+        _changed(self, constr)
         assert type(constr) is ConstraintSpec
         self.constraints.add(constr)
         return self
@@ -1554,6 +2481,7 @@ class ValueObject(NamedElement):
         self._check_prop(prop)
         prop._parent = self
         self.props[prop.type_def.name] = prop
+        _changed(self, prop)
         return self
 
     def __repr__(self):
@@ -1581,6 +2509,8 @@ class ValueObject(NamedElement):
         return retStr
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if type(self) is type(other):
             return NamedElement.__eq__(self, other)\
             and self.extends == other.extends\
@@ -1593,9 +2523,13 @@ class ValueObject(NamedElement):
         return not self.__eq__(other)
 
     def __hash__(self):
-        return hash((self.name, self.short_desc, self.long_desc, self.extends,
-            fnvhash(self.dependencies), fnvhash(self.constraints),
-            fnvhash(self.props.items())))
+        return _fingerprint(self, lambda: hash((self.name, self.short_desc,\
+            self.long_desc, self.extends, fnvhash(self.dependencies),\
+            unordered_hash(self.constraints),\
+            unordered_hash(self.props.iteritems()))))
+
+    def _child(self, name):
+        return self.props.get(name)
 
     def __getitem__(self, key):
         return self.props[key]
@@ -1607,11 +2541,14 @@ class Key(object):
         self.props = set()
 
     def add_prop(self, prop):
+        _changed(self, prop)
         assert type(prop) is Property
         self.props.add(prop)
         return self
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if type(self) is type(other):
             return self.props == other.props
         return False
@@ -1620,7 +2557,7 @@ class Key(object):
         return not self.__eq__(other)
 
     def __hash__(self):
-        return fnvhash(self.props)
+        return _fingerprint(self, lambda: unordered_hash(self.props))
 
     def __repr__(self):
         retStr = "key {\n"
@@ -1636,6 +2573,7 @@ class Repr(object):
         self.parts = []
 
     def add_elem(self, elem):
+        _changed(self, elem)
         self.parts.append(elem)
         return self
 
@@ -1684,18 +2622,47 @@ class Entity(NamedElement):
         self.features = set()
         self.key = set()
         self.compartments = dict()
+        self._effective = None
+        self._effective_key = None
 
-    def _update_parent_model(self, model):
-        self._parent_model = model
-        for elem in self.elems.itervalues():
-            elem._update_parent_model(model)
+    def _refs(self):
+        """
+        Yields references of the entity resolved by the model.
+        """
+        if self.extends:
+            yield self.extends
+        for dep in self.dependencies:
+            yield dep
+        for ref in constraint_refs(self.constraints):
+            yield ref
 
-    def _flatten_ns(self, prefix):
-        retval = dict()
-        for key, val in self.elems.iteritems():
-            namespace = "%s.%s.%s" % (prefix, self.name, key)
-            retval[Qid(namespace)] = val
-        return retval
+    def _members(self):
+        return self.elems
+
+    def _key_props(self):
+        return dict((x, self.elems[x]) for x in self.key)
+
+    def effective_features(self):
+        """
+        Returns dict of features of the entity, including features of its
+        compartments and key, together with ones it inherits from entities it
+        extends. The dict is computed once and shared until some classifier
+        changes, so it mustn't be modified.
+        """
+        return _effective_members(self, Entity._members, "_effective")
+
+    def effective_key(self):
+        """
+        Returns dict of key properties of the entity, including inherited
+        ones. Like effective_features, it's cached and mustn't be modified.
+        """
+        return _effective_members(self, Entity._key_props, "_effective_key")
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_effective"] = None
+        state["_effective_key"] = None
+        return state
 
     def set_key(self, key):
         assert type(key) is Key
@@ -1706,6 +2673,7 @@ class Entity(NamedElement):
         return self
 
     def set_repr(self, arg):
+        _changed(self, arg)
         assert type(arg) is Repr
         self.repr = arg
         return self
@@ -1714,9 +2682,11 @@ class Entity(NamedElement):
         assert type(extends) is CrossRef
         self.extends = extends
         self.extends.ref_type = Ref.Entity
+        _changed(self, extends)
         return self
 
     def set_dependencies(self, deps):
+        _changed(self, *deps)
         assert type(deps) is list
         for val in deps:
             val.ref_type = Ref.Service
@@ -1724,6 +2694,7 @@ class Entity(NamedElement):
         return self
 
     def add_constraint_spec(self, constr):
+        _changed(self, constr)
         assert type(constr) is ConstraintSpec
         self.constraints.add(constr)
         return self
@@ -1738,10 +2709,12 @@ class Entity(NamedElement):
         if type(feat) is Property:
             feat._parent = self
         self.elems[feat.type_def.name] = feat
+        _changed(self, feat)
         return self
 
     def add_comparment(self, compartment):
         assert type(compartment) is Compartment
+        _changed(self, compartment)
         if compartment.elements:
             self.compartments[compartment.name] = compartment
             for part in compartment.elements:
@@ -1778,24 +2751,44 @@ class Entity(NamedElement):
         return retStr
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if type(self) is type(other):
             return NamedElement.__eq__(self,other) \
             and self.elems == other.elems and self.extends == other.extends\
             and self.dependencies == other.dependencies\
             and self.repr == other.repr\
-            and self.constraints == other.constraints
+            and self.constraints == other.constraints\
+            and self.key == other.key\
+            and self.compartments == other.compartments
         return False
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
     def __hash__(self):
-        return hash((self.name, self.short_desc, self.long_desc, self.extends,
-            fnvhash(self.dependencies), fnvhash(self.constraints),
-            fnvhash(self.elems.items()), self.repr))
+        return _fingerprint(self, lambda: hash((self.name, self.short_desc,\
+            self.long_desc, self.extends, fnvhash(self.dependencies),\
+            unordered_hash(self.constraints),\
+            unordered_hash(self.elems.iteritems()), self.repr,\
+            frozenset(self.key),\
+            unordered_hash(self.compartments.iteritems()))))
+
+    def _child(self, name):
+        if name in self.compartments:
+            return self.compartments[name]
+        return self.elems.get(name)
 
     def __getitem__(self, key):
         if key in self.compartments:
             return self.compartments[key]
         else:
             return self.elems[key]
+
+# Bits of element types in ApplyDef.mask, in order of ApplyDef flags
+_APPLY_BITS = dict((x, 1 << bit) for bit, x in enumerate((Entity, Property,\
+    OpParam, Service, Operation, ValueObject)))
+
+# Types of elements that belong to a model, see _attach
+_MODEL_ELEMENTS = (NamedElement, ApplyDef, ConstrDef, Constraint,\
+    ConstraintSpec, CrossRef, Property, Relationship, Key, Repr)
@@ -11,14 +11,25 @@
 ##############################################################################
 from __future__ import unicode_literals
 
+import os
 import sys
-
+import time
+import Queue
+import argparse
+import threading
+import functools
+import contextlib
+import multiprocessing
+
+import arpeggio
 from arpeggio import *
-from arpeggio.export import PMDOTExporter, PTDOTExporter
 from arpeggio import RegExMatch as _
 
 from actions import *
+from cache import ModelCache, digest, source_signature
 from export import DommExport
+from stats import ParseStats
+import incremental
 
 # Defines a meta type named element and its sub rules
 def named_elem():       return [(string, string), string]
@@ -241,7 +252,54 @@ service.sem = ServiceAction()
 value_object.sem = ValueObjectAction()
 entity.sem = EntityAction()
 
+_grammar_keys = dict()
 
+def grammar_key(ignore_case = False):
+    """
+    Returns the version of DOMMLite grammar, a digest of this file and of
+    the installed Arpeggio.
+    """
+    if ignore_case not in _grammar_keys:
+        source_name = os.path.splitext(os.path.abspath(__file__))[0] + ".py"
+        with open(source_name, "rb") as grammar_file:
+            source = grammar_file.read()
+        arpeggio_version = getattr(arpeggio, "__version__", "")
+        _grammar_keys[ignore_case] = digest(source, arpeggio_version,\
+            source_signature(arpeggio.__file__), ignore_case)
+    return _grammar_keys[ignore_case]
+
+_model_keys = dict()
+
+def model_key(ignore_case = False):
+    """
+    Returns the version of models produced by DOMMLite parser, a digest of
+    the grammar and of the sources of semantic actions and metamodel.
+    Used to key the model cache.
+    """
+    if ignore_case not in _model_keys:
+        folder = os.path.dirname(os.path.abspath(__file__))
+        sources = []
+        for module in ["actions.py", "metamodel.py", "error.py"]:
+            with open(os.path.join(folder, module), "rb") as source_file:
+                sources.append(source_file.read())
+        _model_keys[ignore_case] = digest(grammar_key(ignore_case), *sources)
+    return _model_keys[ignore_case]
+
+class ParseContext(object):
+    """
+    Options of a single parse. Semantic actions are shared by all parsers
+    and keep no state of their own, they read the options of the current
+    parse through the parser, see DommParser.parse_context.
+
+    Attributes:
+        skip_crossref(boolean): when True, cross references aren't checked
+        debugDomm(boolean): when True, DOMM specific debug information is
+            written
+    """
+    def __init__(self, skip_crossref = False, debugDomm = False):
+        super(ParseContext, self).__init__()
+        self.skip_crossref = skip_crossref
+        self.debugDomm = debugDomm
 
 class DommParser(ParserPython):
     keywords = ["dataType","buildinDataType","enum", "tagType",\
@@ -251,9 +309,15 @@ class DommParser(ParserPython):
             "throws","compartment","valueObject","exception","model"]
     """
     Parser of DOMMLite DSL language
+
+    Parsing state is kept in the parser, so a parser parses one content at a
+    time. parse_model and the other methods parsing a whole model hold the
+    parser lock for the whole parse, so a parser can be shared by threads,
+    which then wait for each other. Threads parsing at the same time should
+    use their own parsers, see ParserPool.
     """
     def __init__(self, skip_crossref = False, debugDomm = False\
-        , *args, **kwargs):
+        , model_cache = None, profile = False, *args, **kwargs):
         """
         Initializes the parser for DOMMLite language.
 
@@ -265,31 +329,268 @@ class DommParser(ParserPython):
 
         debugDomm(boolean): When true will write DOMM Specific debug
             information
+
+        model_cache(ModelCache): when given, parse_model will reuse models
+            of already parsed content stored in the cache.
+
+        profile(boolean): when True, time of parsing phases and of each
+            semantic action is recorded, see stats method.
         """
+        self._defaults = ParseContext(skip_crossref, debugDomm)
+        self._context = None
+        # debugDomm of the current parse, kept as a plain attribute since
+        # semantic actions check it on every call
+        self.debug_actions = debugDomm
+        self._lock = threading.RLock()
+        self.profiler = None
         super(DommParser, self).__init__(domm, None, *args, **kwargs)
-        self.debugDomm = debugDomm
-        self.skip_crossref = skip_crossref
+        self.model_cache = model_cache
+        self.profile = profile
+
+    @property
+    def parse_context(self):
+        """
+        ParseContext of the current parse, or default options of the parser
+        when it isn't parsing.
+        """
+        if self._context is not None:
+            return self._context
+        return self._defaults
+
+    @property
+    def skip_crossref(self):
+        return self.parse_context.skip_crossref
+
+    @skip_crossref.setter
+    def skip_crossref(self, value):
+        self._defaults.skip_crossref = value
+
+    @property
+    def debugDomm(self):
+        return self.parse_context.debugDomm
+
+    @debugDomm.setter
+    def debugDomm(self, value):
+        self._defaults.debugDomm = value
+        self.debug_actions = self.parse_context.debugDomm
+
+    @property
+    def profile(self):
+        return self.profiler is not None
+
+    @profile.setter
+    def profile(self, value):
+        if not value:
+            self.profiler = None
+        elif self.profiler is None:
+            self.profiler = ParseStats()
+
+    def stats(self, reset = False):
+        """
+        Returns call counts, cumulative and maximal times of parsing phases
+        and semantic actions recorded since the parser was created or last
+        reset, see ParseStats.as_dict. Nothing is recorded unless profile
+        is True.
+        """
+        if self.profiler is None:
+            return ParseStats().as_dict()
+        with self._lock:
+            result = self.profiler.as_dict()
+            if reset:
+                self.profiler = ParseStats()
+        return result
+
+    def new_context(self, skip_crossref = None):
+        """
+        Returns ParseContext with options of the current parse, or default
+        options of the parser, unless they are given.
+        """
+        if skip_crossref is None:
+            skip_crossref = self.parse_context.skip_crossref
+        return ParseContext(skip_crossref, self.parse_context.debugDomm)
+
+    @contextlib.contextmanager
+    def parsing(self, context = None):
+        """
+        Locks the parser and makes context the current parse context, until
+        the end of the with block. Parses can be nested in the same thread.
+        """
+        if context is None:
+            context = self.new_context()
+        with self._lock:
+            previous = self._context
+            self._context = context
+            self.debug_actions = context.debugDomm
+            try:
+                yield context
+            finally:
+                self._context = previous
+                self.debug_actions = self.parse_context.debugDomm
+
+    def parse(self, _input):
+        profiler = self.profiler
+        if profiler is None:
+            return super(DommParser, self).parse(_input)
+        with profiler.timer("grammar"):
+            return super(DommParser, self).parse(_input)
+
+    def getASG(self, sem_actions = None, defaults = True):
+        """
+        Returns the model of the last parsed content. When cross references
+        are checked, the model is also checked for inheritance cycles once
+        all semantic actions are done.
+        """
+        profiler = self.profiler
+        if profiler is not None:
+            return self._profiled_asg(profiler, sem_actions, defaults)
+        model = super(DommParser, self).getASG(sem_actions, defaults)
+        # Semantic actions assign attributes of elements directly
+        invalidate_caches(model if type(model) is Model else None)
+        if not self.skip_crossref and type(model) is Model:
+            model.check_cycles()
+        return model
+
+    def _profiled_asg(self, profiler, sem_actions, defaults):
+        """
+        getASG recording time of both passes and of each semantic action.
+        Time of the first pass is what isn't spent in the second one.
+        """
+        if sem_actions is None:
+            sem_actions = self.sem_actions
+        second_before = profiler.pass_total("second_pass")
+        start = time.time()
+        model = super(DommParser, self).getASG(profiler.wrap(sem_actions),\
+            defaults)
+        elapsed = time.time() - start
+        second = profiler.pass_total("second_pass") - second_before
+        profiler.phase("first_pass").add(elapsed - second)
+
+        invalidate_caches(model if type(model) is Model else None)
+        if not self.skip_crossref and type(model) is Model:
+            cycles_start = time.time()
+            model.check_cycles()
+            second += time.time() - cycles_start
+        profiler.phase("second_pass").add(second)
+        return model
+
+    def parse_model(self, content, skip_crossref = None):
+        """
+        Parses content and returns its model. If parser has a model cache and
+        the same content was already parsed in the same mode, the model is
+        loaded from cache and both parsing and semantic analysis are skipped.
+        Cross references are checked unless skip_crossref is True, by default
+        as given when the parser was created.
+        """
+        with self.parsing(self.new_context(skip_crossref)) as context:
+            key = None
+            if self.model_cache is not None:
+                key = self.model_cache.key(content,\
+                    model_key(self.ignore_case), context.skip_crossref)
+                model = self.model_cache.get(key)
+                if model is not None:
+                    return model
+
+            self.parse(content)
+            model = self.getASG()
+
+        if key is not None:
+            self.model_cache.put(key, model)
+        return model
+
+    def parse_incremental(self, content):
+        """
+        Parses content and returns IncrementalResult, which holds the model
+        together with positions of its blocks, so that the content can later
+        be edited and reparsed with reparse method.
+        """
+        with self.parsing():
+            return incremental.parse_incremental(self, content)
+
+    def reparse(self, old_result, edits):
+        """
+        Applies edits to content of old_result and returns IncrementalResult
+        with model of the new content. Only packages and classifiers enclosing
+        the edits are parsed again and only cross references that could be
+        affected by them are checked again. Edits that can't be handled
+        incrementally cause the whole content to be parsed again.
+
+        old_result(IncrementalResult): result of parse_incremental or reparse,
+            its model is updated in place and shouldn't be used afterwards.
 
+        edits(list): list of Edit objects or (start, end, text) tuples, with
+            offsets into the content of old_result.
+        """
+        with self.parsing():
+            return incremental.reparse(self, old_result, edits)
 
     def _test_parse(self, content):
         """
         Method that reads a given content, parses it and returns a parsed AST, without
         verifying that references are correct. Only used for debugging.
         """
-        self.skip_crossref = True
-        self.parse(content)
-        val = self.getASG()
-        return val
+        with self.parsing(self.new_context(skip_crossref = True)):
+            self.parse(content)
+            return self.getASG()
 
     def _test_crossref(self, content):
         """
         Method that reads a given content, parses it and returns a parsed AST, but
         verifies that references are correct
         """
-        self.skip_crossref = False
-        self.parse(content)
-        val = self.getASG()
-        return val
+        with self.parsing(self.new_context(skip_crossref = False)):
+            self.parse(content)
+            return self.getASG()
+
+class ParserPool(object):
+    """
+    Pool of reusable DommParser instances, for parsing from several threads
+    at once. Parsers are created when all existing ones are in use, up to
+    size of the pool, and are then kept, so the grammar isn't loaded again
+    for each parse.
+
+    Args:
+        size(int): maximal number of parsers, threads wait for a free one
+            when all are in use. When None the pool isn't bounded.
+        kwargs: arguments of created parsers, see DommParser
+    """
+    def __init__(self, size = None, **kwargs):
+        super(ParserPool, self).__init__()
+        self.size = size
+        self._kwargs = kwargs
+        self._free = Queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        try:
+            return self._free.get_nowait()
+        except Queue.Empty:
+            pass
+        with self._lock:
+            create = self.size is None or self._created < self.size
+            if create:
+                self._created += 1
+        if create:
+            return DommParser(**self._kwargs)
+        return self._free.get()
+
+    @contextlib.contextmanager
+    def parser(self):
+        """
+        Lends a parser for the duration of the with block.
+        """
+        parser = self._acquire()
+        try:
+            yield parser
+        finally:
+            self._free.put(parser)
+
+    def parse_model(self, content, skip_crossref = None):
+        """
+        Parses content with a free parser, see DommParser.parse_model.
+        """
+        with self.parser() as parser:
+            return parser.parse_model(content, skip_crossref)
 
 def parse_file(file_name):
     with open(file_name, "r") as dommfile:
@@ -299,34 +600,290 @@ def parse_file(file_name):
 
     # Then we export it to a dot file in order to visualise it.
     # This is also optional.
+    from arpeggio.export import PTDOTExporter
     PTDOTExporter().exportFile(parse_tree, "domm_parse_tree.dot")
     parser.skip_crossref = False
     model = parser.getASG()
-    DommExport().export_model(model, "domm_model.dot")
+    DommExport(stats = parser.profiler).export_model(model, "domm_model.dot")
 
-def parse_folder(folder_name):
-    pass
+class FileResult(object):
+    """
+    Result of parsing and cross checking a single DOMMLite file.
+
+    Attributes:
+        file_name(str): path of the parsed file
+        model(Model): parsed model, None if parsing failed
+        error(str): description of the error that stopped parsing
+        wall_time(float): wall clock time spent on the file in seconds
+        cpu_time(float): CPU time spent on the file in seconds
+        stats(ParseStats): stats of parsing the file, when it was profiled
+    """
+    def __init__(self, file_name, model = None, error = None,\
+        wall_time = 0.0, cpu_time = 0.0, stats = None):
+        super(FileResult, self).__init__()
+        self.file_name = file_name
+        self.model = model
+        self.error = error
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.stats = stats
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        status = "OK"
+        if self.error:
+            status = self.error
+        return "%s (wall: %.3fs cpu: %.3fs) %s" % (self.file_name,\
+            self.wall_time, self.cpu_time, status)
+
+class FolderResult(object):
+    """
+    Aggregate result of parse_folder.
+
+    Attributes:
+        folder_name(str): parsed folder
+        results(list): FileResult for every file, sorted by file name
+        wall_time(float): wall clock time spent on the whole folder
+    """
+    def __init__(self, folder_name, results = None, wall_time = 0.0):
+        super(FolderResult, self).__init__()
+        self.folder_name = folder_name
+        self.results = []
+        if results:
+            self.results = sorted(results, key = lambda x: x.file_name)
+        self.wall_time = wall_time
+
+    @property
+    def ok(self):
+        return all(x.ok for x in self.results)
+
+    @property
+    def models(self):
+        return dict((x.file_name, x.model) for x in self.results if x.ok)
+
+    @property
+    def errors(self):
+        return dict((x.file_name, x.error) for x in self.results\
+            if not x.ok)
+
+    @property
+    def cpu_time(self):
+        return sum(x.cpu_time for x in self.results)
+
+    @property
+    def stats(self):
+        """
+        ParseStats of all profiled files, None if none was profiled.
+        """
+        profiled = [x.stats for x in self.results if x.stats is not None]
+        if not profiled:
+            return None
+        stats = ParseStats()
+        for file_stats in profiled:
+            stats.merge(file_stats)
+        return stats
+
+    def __repr__(self):
+        retStr = ""
+        for result in self.results:
+            retStr += "%s\n" % result
+        retStr += "%s files, %s failed (wall: %.3fs cpu: %.3fs)" %\
+            (len(self.results), len(self.errors), self.wall_time,\
+            self.cpu_time)
+        return retStr
+
+# Parser reused by all files parsed in one (worker) process
+_folder_parser = None
+
+def _parse_folder_file(file_name, model_cache = None, keep_models = True,\
+    profile = False):
+    """
+    Parses and cross checks a single file for parse_many. Errors are
+    returned as text, since DOMM errors can't be pickled back from workers.
+    """
+    global _folder_parser
+    if _folder_parser is None:
+        _folder_parser = DommParser()
+    _folder_parser.model_cache = model_cache
+    _folder_parser.profile = profile
+
+    wall_start = time.time()
+    cpu_start = time.clock()
+    result = FileResult(file_name)
+    try:
+        with open(file_name, "r") as dommfile:
+            content = dommfile.read()
+        result.model = _folder_parser.parse_model(content,\
+            skip_crossref = False)
+    except (DommError, NoMatch, IOError) as e:
+        result.error = "%s: %s" % (type(e).__name__, e)
+    if not keep_models:
+        result.model = None
+    if profile:
+        result.stats = _folder_parser.profiler
+        _folder_parser.profiler = ParseStats()
+    result.wall_time = time.time() - wall_start
+    result.cpu_time = time.clock() - cpu_start
+    return result
+
+def find_domm_files(folder_name):
+    """
+    Returns sorted paths of all .domm files in folder and its subfolders.
+    """
+    found = []
+    for root, dirs, files in os.walk(folder_name):
+        for name in files:
+            if name.endswith(".domm"):
+                found.append(os.path.join(root, name))
+    return sorted(found)
+
+def parse_many(file_names, concurrency = None, model_cache = None,\
+    keep_models = True, profile = False):
+    """
+    Parses and cross checks files in worker processes, yielding a FileResult
+    for each file as soon as it is done, in order of completion.
+
+    At most concurrency files are being read and parsed at a time and
+    file_names is consumed only as workers become free, so it can be a lazy
+    iterable over any number of files. Nothing blocks until the next result
+    is requested, so an event loop can drive it from an executor.
+
+    Args:
+        file_names(iterable): paths of files to parse
+        concurrency(int): number of worker processes. When None the number
+            of CPUs is used, with 1 all files are parsed in this process.
+        model_cache(ModelCache): cache of models, unchanged files found in
+            it aren't parsed again.
+        keep_models(bool): when False models aren't sent back from workers,
+            results only tell if files are valid.
+        profile(bool): when True, results have stats of their parse.
+    """
+    if concurrency is None:
+        concurrency = multiprocessing.cpu_count()
+    parse_one = functools.partial(_parse_folder_file,\
+        model_cache = model_cache, keep_models = keep_models,\
+        profile = profile)
+
+    if concurrency <= 1:
+        for file_name in file_names:
+            yield parse_one(file_name)
+        return
+
+    done = Queue.Queue()
+    pending = iter(file_names)
+    pool = multiprocessing.Pool(concurrency)
+    submitted = []
+    def submit():
+        for file_name in pending:
+            submitted.append(pool.apply_async(parse_one, (file_name,),\
+                callback = done.put))
+            return True
+        return False
+    def check_failed():
+        # Callback isn't called for failed tasks, get raises their exception
+        for task in submitted:
+            if task.ready() and not task.successful():
+                task.get()
+        submitted[:] = [x for x in submitted if not x.ready()]
+
+    try:
+        running = 0
+        while running < concurrency and submit():
+            running += 1
+        while running:
+            try:
+                result = done.get(timeout = 0.1)
+            except Queue.Empty:
+                check_failed()
+                continue
+            check_failed()
+            running -= 1
+            if submit():
+                running += 1
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+def parse_folder(folder_name, workers = None, model_cache = None,\
+    profile = False):
+    """
+    Parses and cross checks every .domm file in folder and its subfolders.
+
+    Args:
+        folder_name(str): folder to search for .domm files
+        workers(int): number of worker processes. When None the number of
+            CPUs is used, with 1 all files are parsed in this process.
+        model_cache(ModelCache): cache of models, unchanged files found in
+            it aren't parsed again.
+        profile(bool): when True, files are profiled, see FolderResult.stats
+
+    Returns:
+        FolderResult with a FileResult for every found file
+    """
+    file_names = find_domm_files(folder_name)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = max(1, min(workers, len(file_names)))
+
+    wall_start = time.time()
+    results = list(parse_many(file_names, workers, model_cache,\
+        profile = profile))
+    return FolderResult(folder_name, results, time.time() - wall_start)
 
 if __name__ == "__main__":
-    # First parameter is bibtex file
+    arg_parser = argparse.ArgumentParser(description = "DOMMLite parser")
+    arg_parser.add_argument("paths", nargs = "+", metavar = "path",\
+        help = "files or folders to parse")
+    arg_parser.add_argument("--grammar-dot", action = "store_true",\
+        help = "export parser model to domm_parse_tree_model.dot")
+    arg_parser.add_argument("-j", "--workers", type = int, default = None,\
+        help = "number of processes used to parse a folder")
+    arg_parser.add_argument("--cache", action = "store_true",\
+        help = "reuse models of unchanged files from the model cache")
+    arg_parser.add_argument("--profile", action = "store_true",\
+        help = "write timing of parsing phases and semantic actions to "\
+        "domm_profile.json and domm_profile.folded")
+    args = arg_parser.parse_args()
+
     # First we will make a parser - an instance of the DOMMLite parser model.
     # Parser model is given in the form of python constructs therefore we
     # are using ParserPython class.
-    parser = DommParser(debugDomm = True)
+    parser = DommParser(debugDomm = True, profile = args.profile)
 
-    # Then we export it to a dot file in order to visualise DOMMLite's model.
-    # This step is optional but it is handy for debugging purposes.
+    # Then we can export it to a dot file in order to visualise DOMMLite's
+    # model. This step is optional but it is handy for debugging purposes.
     # We can make a png out of it using dot (part of graphviz) like this
     # dot -O -Tpng domm_parse_tree_model.dot
-    PMDOTExporter().exportFile(parser.parser_model,\
-                    "domm_parse_tree_model.dot")
-
-    # We only parse if there is an input
-    if len(sys.argv) > 1:
-        if (sys.argv[1].endswith(".domm")):
-            parse_file(sys.argv[1])
-        else:
-            parse_folder(sys.argv[1])
-    else:
-        print("Usage: python parser.py file_to_parse")
-
+    if args.grammar_dot:
+        from arpeggio.export import PMDOTExporter
+        PMDOTExporter().exportFile(parser.parser_model,\
+                        "domm_parse_tree_model.dot")
+
+    model_cache = None
+    if args.cache:
+        model_cache = ModelCache()
+    stats = None
+    if args.profile:
+        stats = ParseStats()
+    failed = False
+    for path in args.paths:
+        if path.endswith(".domm"):
+            parse_file(path)
+            continue
+        result = parse_folder(path, workers = args.workers,\
+            model_cache = model_cache, profile = args.profile)
+        print(result)
+        if stats is not None:
+            stats.merge(result.stats)
+        failed = failed or not result.ok
+
+    if stats is not None:
+        # Files are parsed by the parser of this process
+        stats.merge(parser.profiler)
+        stats.write("domm_profile.json")
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,323 @@
+##############################################################################
+# Name: server.py
+# Purpose: Validation daemon for DOMMLite models and its client
+# Author: Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# Copyright: (c) 2014 Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# License: MIT License
+#
+# The daemon listens on a Unix domain socket and speaks JSON-RPC 2.0, one
+# request or response per line. Each connection is served by its own
+# thread, parsers are taken from a pool of warm DommParser instances.
+# Requests are sent by client.py.
+#
+#   python server.py [--socket PATH] [--workers N] [--cache]
+##############################################################################
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import inspect
+import argparse
+import threading
+import traceback
+import collections
+import SocketServer
+from StringIO import StringIO
+
+from arpeggio import NoMatch
+from error import DommError
+from cache import ModelCache, digest
+from export import DommExport
+from parser import ParserPool
+from client import RpcError, default_socket, PARSE_ERROR, INVALID_REQUEST,\
+    METHOD_NOT_FOUND, INVALID_PARAMS, INTERNAL_ERROR, MODEL_ERROR
+
+# Upper bounds of latency histogram buckets in milliseconds
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+class LatencyHistogram(object):
+    """
+    Counts of request latencies in LATENCY_BUCKETS, the last bucket counts
+    the ones slower than all bounds.
+    """
+    def __init__(self):
+        super(LatencyHistogram, self).__init__()
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+
+    def add(self, seconds):
+        millis = seconds * 1000.0
+        index = 0
+        while index < len(LATENCY_BUCKETS) and millis > LATENCY_BUCKETS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.total += millis
+
+    def as_dict(self):
+        bounds = [str(x) for x in LATENCY_BUCKETS] + ["inf"]
+        return {"buckets": zip(bounds, self.counts),\
+            "count": sum(self.counts), "total_ms": round(self.total, 3)}
+
+class Validator(object):
+    """
+    Handles requests of the daemon. Parsed models are kept in memory by a
+    digest of their content, so models parsed again, like std.domm which is
+    parsed on start, are served without parsing.
+
+    Args:
+        workers(int): number of warm parsers, requests over it wait for a
+            free parser
+        max_models(int): number of parsed models kept in memory
+        model_cache(ModelCache): on-disk cache of models shared by parsers
+    """
+    def __init__(self, workers = 4, max_models = 64, model_cache = None):
+        super(Validator, self).__init__()
+        self.pool = ParserPool(workers, model_cache = model_cache)
+        self.max_models = max_models
+        self.started = time.time()
+        self._models = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._requests = collections.defaultdict(int)
+        self._errors = collections.defaultdict(int)
+        self._latency = collections.defaultdict(LatencyHistogram)
+        self.methods = {
+            "parse": self.parse,
+            "check": self.check,
+            "export": self.export,
+            "stats": self.stats,
+        }
+
+    def warm_up(self):
+        """
+        Creates all parsers of the pool and parses std.domm with each.
+        """
+        std_name = os.path.join(os.path.dirname(os.path.abspath(__file__)),\
+            "std.domm")
+        with open(std_name, "r") as std_file:
+            content = std_file.read()
+        parsers = [self.pool._acquire() for _ in range(self.pool.size or 1)]
+        for parser in parsers:
+            parser.parse_model(content)
+            self.pool._free.put(parser)
+        self.model(content = content)
+
+    def model(self, content = None, path = None, skip_crossref = False):
+        """
+        Returns model of content, or of the file at path, parsing it only if
+        it isn't kept in memory.
+        """
+        if content is None:
+            if path is None:
+                raise RpcError(INVALID_PARAMS, "content or path is required")
+            try:
+                with open(path, "r") as domm_file:
+                    content = domm_file.read()
+            except IOError as e:
+                raise RpcError(INVALID_PARAMS, str(e))
+        if type(content) is unicode:
+            content = content.encode("utf-8")
+
+        key = digest(content, skip_crossref)
+        with self._lock:
+            model = self._models.pop(key, None)
+            if model is not None:
+                self._models[key] = model
+                return model
+
+        model = self.pool.parse_model(content, skip_crossref)
+        with self._lock:
+            self._models[key] = model
+            while len(self._models) > self.max_models:
+                self._models.popitem(last = False)
+        return model
+
+    def parse(self, content = None, path = None, skip_crossref = False):
+        """
+        Returns name of the model and types of its elements by their qids.
+        """
+        model = self.model(content, path, skip_crossref)
+        return {"model": model.name, "elements": dict((x, type(y).__name__)\
+            for x, y in model.qual_elems.iteritems())}
+
+    def check(self, content = None, path = None):
+        """
+        Returns whether the model is valid and the error found in it.
+        """
+        try:
+            model = self.model(content, path)
+        except (DommError, NoMatch) as e:
+            return {"ok": False, "error": "%s: %s" % (type(e).__name__, e)}
+        return {"ok": True, "model": model.name,\
+            "elements": len(model.qual_elems)}
+
+    def export(self, content = None, path = None, output = None,\
+        focus = None, depth = 1):
+        """
+        Returns the model in DOT format, or writes it to output file.
+        """
+        model = self.model(content, path)
+        exporter = DommExport()
+        if focus is not None and focus not in model.qual_elems:
+            raise RpcError(INVALID_PARAMS, "unknown element %s" % focus)
+        if output is not None:
+            exporter.export_model(model, output, focus, depth)
+            return {"output": output}
+        out = StringIO()
+        exporter.write_model(model, out, focus, depth)
+        return {"dot": out.getvalue()}
+
+    def stats(self):
+        """
+        Returns request counters and latency histograms by method.
+        """
+        with self._lock:
+            return {
+                "uptime": round(time.time() - self.started, 3),
+                "models": len(self._models),
+                "requests": dict(self._requests),
+                "errors": dict(self._errors),
+                "latency_ms": dict((x, y.as_dict())\
+                    for x, y in self._latency.iteritems()),
+            }
+
+    def _params(self, handler, params):
+        """
+        Returns positional and keyword arguments of handler from params of a
+        request, checking that handler accepts them.
+        """
+        if params is None:
+            params = dict()
+        if type(params) is list:
+            args, kwargs = params, dict()
+        elif type(params) is dict:
+            try:
+                args, kwargs = [], dict((str(x), y)\
+                    for x, y in params.iteritems())
+            except UnicodeError:
+                raise RpcError(INVALID_PARAMS, "invalid parameter name")
+        else:
+            raise RpcError(INVALID_PARAMS, "params must be object or array")
+        try:
+            inspect.getcallargs(handler, *args, **kwargs)
+        except TypeError as e:
+            raise RpcError(INVALID_PARAMS, str(e))
+        return args, kwargs
+
+    def handle(self, request):
+        """
+        Returns JSON-RPC response to a decoded request, or None for
+        notifications.
+        """
+        request_id = None
+        method = None
+        start = time.time()
+        try:
+            if type(request) is not dict or "method" not in request:
+                raise RpcError(INVALID_REQUEST, "invalid request")
+            request_id = request.get("id")
+            method = request["method"]
+            handler = self.methods.get(method)
+            if handler is None:
+                raise RpcError(METHOD_NOT_FOUND, "unknown method %s" % method)
+            args, kwargs = self._params(handler, request.get("params"))
+            try:
+                result = handler(*args, **kwargs)
+            except (DommError, NoMatch) as e:
+                raise RpcError(MODEL_ERROR, "%s: %s" % (type(e).__name__, e))
+            response = {"jsonrpc": "2.0", "id": request_id, "result": result}
+        except RpcError as e:
+            response = {"jsonrpc": "2.0", "id": request_id,\
+                "error": {"code": e.code, "message": e.message}}
+        except Exception as e:
+            traceback.print_exc()
+            response = {"jsonrpc": "2.0", "id": request_id,\
+                "error": {"code": INTERNAL_ERROR, "message": "%s: %s" %\
+                (type(e).__name__, e)}}
+
+        if method in self.methods:
+            with self._lock:
+                self._requests[method] += 1
+                if "error" in response:
+                    self._errors[method] += 1
+                self._latency[method].add(time.time() - start)
+        if type(request) is dict and "id" not in request:
+            return None
+        return response
+
+class _RequestHandler(SocketServer.StreamRequestHandler):
+    """
+    Serves a connection, requests are read and answered line by line.
+    """
+    def handle(self):
+        for line in iter(self.rfile.readline, ""):
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = {"jsonrpc": "2.0", "id": None, "error":\
+                    {"code": PARSE_ERROR, "message": "invalid JSON"}}
+            else:
+                response = self.server.validator.handle(request)
+            if response is not None:
+                self.wfile.write(json.dumps(response) + "\n")
+                self.wfile.flush()
+
+class DommServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """
+    Validation daemon listening on a Unix domain socket, each connection is
+    handled in its own thread.
+
+    Args:
+        socket_name(str): path of the socket, an existing socket file is
+            replaced
+        validator(Validator): handles requests
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_name, validator):
+        if os.path.exists(socket_name):
+            os.remove(socket_name)
+        folder = os.path.dirname(socket_name)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        SocketServer.UnixStreamServer.__init__(self, socket_name,\
+            _RequestHandler)
+        self.validator = validator
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+def main(argv = None):
+    """
+    Starts the daemon and serves requests until it's interrupted.
+    """
+    arg_parser = argparse.ArgumentParser(description = "DOMM daemon")
+    arg_parser.add_argument("--socket", default = None,\
+        help = "daemon socket (default: %s)" % default_socket())
+    arg_parser.add_argument("-j", "--workers", type = int, default = 4,\
+        help = "number of warm parsers")
+    arg_parser.add_argument("--cache", action = "store_true",\
+        help = "reuse models from the model cache")
+    args = arg_parser.parse_args(argv)
+    socket_name = args.socket or default_socket()
+
+    validator = Validator(args.workers,\
+        model_cache = ModelCache() if args.cache else None)
+    validator.warm_up()
+    server = DommServer(socket_name, validator)
+    print("Listening on %s" % socket_name)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
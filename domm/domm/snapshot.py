@@ -0,0 +1,508 @@
+##############################################################################
+# Name: snapshot.py
+# Purpose: Binary snapshots of validated DOMMLite models
+# Author: Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# Copyright: (c) 2014 Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# License: MIT License
+#
+# Snapshot file layout, all integers are little endian:
+#
+#   header       magic, version, model key of the parser and sizes of the
+#                sections, see _HEADER
+#   qid offsets  n_records + 1 offsets of qids in the string table
+#   records      type, flags and position of each element record
+#   rels         relationships of the model by their ends
+#   rels by end  indexes of rels sorted by their second end
+#   refs         (source, target) records bound by references, e.g. type
+#                of a property or entity in extends
+#   refs by end  indexes of refs sorted by their target
+#   strings      sorted qualified ids of records
+#   model        pickled attributes of the model itself
+#   data         pickled state of each record
+#
+# Records are packages and elements directly in packages or in the model,
+# their members (properties, operations...) are stored in their record.
+# References to other records, to the model and to relationships are kept
+# in records as indexes, so each record can be unpickled on its own.
+##############################################################################
+import mmap
+import bisect
+import struct
+import cPickle as pickle
+from cStringIO import StringIO
+from metamodel import *
+from cache import atomic_write
+from parser import model_key
+
+MAGIC = "DOMMSNAP"
+VERSION = 2
+
+_HEADER = struct.Struct("<8sI40sIIII")
+_OFFSET = struct.Struct("<I")
+_RECORD = struct.Struct("<BBII")
+_REL = struct.Struct("<Biiiiiii")
+_REF = struct.Struct("<II")
+
+# Types of elements stored as records, by their type code
+RECORD_TYPES = (DataType, Constraint, Enumeration, ExceptionType, Service,\
+    ValueObject, Entity, Package)
+
+_REL_TYPES = (RelType.Extends, RelType.Depends, RelType.Composite,\
+    RelType.Reference)
+
+# Record flags
+_TOP_LEVEL = 1
+
+# Persistent id of the model in records
+_MODEL_ID = "m"
+
+def _members(elem):
+    if hasattr(elem, "_members"):
+        return elem._members()
+    return dict()
+
+def _ref_targets(elem):
+    """
+    Yields elements bound by references of elem and its members.
+    """
+    holders = [elem] + _members(elem).values()
+    for holder in holders:
+        if hasattr(holder, "_refs"):
+            for ref in holder._refs():
+                if ref._bound is not None:
+                    yield ref._bound
+
+def _state(elem):
+    if hasattr(elem, "__getstate__"):
+        state = elem.__getstate__()
+    else:
+        state = elem.__dict__.copy()
+    state.pop("_fingerprint", None)
+    return state
+
+def dump_snapshot(model):
+    """
+    Returns snapshot of model as a string.
+    """
+    records = []
+    seen = set()
+    for qid, elem in model.qual_elems.iteritems():
+        if type(elem) in RECORD_TYPES and id(elem) not in seen:
+            seen.add(id(elem))
+            if type(qid) is unicode:
+                qid = qid.encode("utf-8")
+            records.append((qid, elem))
+    records.sort(key = lambda x: x[0])
+    indexes = dict((id(y), x) for x, (_, y) in enumerate(records))
+    top_level = set(id(x) for x in model.elems.itervalues())
+
+    rels = sorted(model._rels, key = lambda x: (indexes[id(x.elem_a)],\
+        indexes[id(x.elem_b)], _REL_TYPES.index(x.rel_type)))
+    rel_indexes = dict((id(y), x) for x, y in enumerate(rels))
+
+    def persistent_id(obj):
+        if obj is model:
+            return _MODEL_ID
+        if type(obj) is RelObj:
+            return ("r", rel_indexes[id(obj)])
+        return indexes.get(id(obj))
+
+    data = []
+    size = 0
+    record_table = []
+    refs = set()
+    for index, (qid, elem) in enumerate(records):
+        out = StringIO()
+        pickler = pickle.Pickler(out, pickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = persistent_id
+        pickler.dump(_state(elem))
+        record = out.getvalue()
+        flags = _TOP_LEVEL if id(elem) in top_level else 0
+        record_table.append(_RECORD.pack(RECORD_TYPES.index(type(elem)),\
+            flags, size, len(record)))
+        data.append(record)
+        size += len(record)
+        for target in _ref_targets(elem):
+            if id(target) in indexes:
+                refs.add((index, indexes[id(target)]))
+    refs = sorted(refs)
+
+    state = model.__getstate__()
+    for attr in ("elems", "qual_elems", "unique", "_rels", "_fingerprint"):
+        state.pop(attr, None)
+    model_data = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+
+    parts = []
+    strings = "".join(x[0] for x in records)
+    offset = 0
+    for qid, elem in records:
+        parts.append(_OFFSET.pack(offset))
+        offset += len(qid)
+    parts.append(_OFFSET.pack(offset))
+    parts.extend(record_table)
+    for rel in rels:
+        super_rel = rel._super_rel
+        parts.append(_REL.pack(_REL_TYPES.index(rel.rel_type),\
+            indexes[id(rel.elem_a)], indexes[id(rel.elem_b)],\
+            -1 if super_rel is None else rel_indexes[id(super_rel)],\
+            rel.min_a, rel.min_b, rel.max_a, rel.max_b))
+    by_end = sorted(range(len(rels)), key = lambda x:\
+        (indexes[id(rels[x].elem_b)], x))
+    parts.extend(_OFFSET.pack(x) for x in by_end)
+    parts.extend(_REF.pack(*x) for x in refs)
+    by_end = sorted(range(len(refs)), key = lambda x: (refs[x][1], x))
+    parts.extend(_OFFSET.pack(x) for x in by_end)
+    parts.append(strings)
+    parts.append(model_data)
+    parts.extend(data)
+
+    header = _HEADER.pack(MAGIC, VERSION, str(model_key()), len(records),\
+        len(rels), len(refs), len(model_data))
+    return header + "".join(parts)
+
+def save_snapshot(model, file_name):
+    """
+    Writes snapshot of a validated model to file_name, see Snapshot.
+    """
+    atomic_write(file_name, dump_snapshot(model))
+
+def open_snapshot(file_name):
+    return Snapshot(file_name)
+
+class _Column(object):
+    """
+    Read only sequence of one field of an array of structs in a buffer,
+    used to bisect the array without reading it. When order is given, it's
+    an array of indexes in which the structs are taken.
+    """
+    def __init__(self, buf, offset, fmt, count, field, order = None):
+        super(_Column, self).__init__()
+        self._buf = buf
+        self._offset = offset
+        self._fmt = fmt
+        self._count = count
+        self._field = field
+        self._order = order
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if self._order is not None:
+            index = self._order[index]
+        return self._fmt.unpack_from(self._buf,\
+            self._offset + index * self._fmt.size)[self._field]
+
+class Snapshot(object):
+    """
+    Validated model read from a snapshot file, see save_snapshot.
+
+    The file is memory mapped and only its header is read when it's
+    opened. Qualified ids are looked up by bisecting the sorted string table
+    and relationships and references between elements can be queried from
+    the edge arrays, without creating any element. Elements are unpickled
+    from their records on first access, together with elements they refer
+    to, and then kept. Elements materialised that way refer to the model
+    returned by the model method, which holds all elements once it's called.
+
+    Args:
+        file_name(str): path of the snapshot file
+    """
+    def __init__(self, file_name):
+        super(Snapshot, self).__init__()
+        self.file_name = file_name
+        with open(file_name, "rb") as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0,\
+                    access = mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotError(file_name, "file is empty")
+
+        if len(self._map) < _HEADER.size:
+            raise SnapshotError(file_name, "file is truncated")
+        magic, version, key, self._count, self._rel_count, self._ref_count,\
+            model_size = _HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise SnapshotError(file_name, "not a model snapshot")
+        if version != VERSION:
+            raise SnapshotError(file_name, "unsupported version %s" % version)
+        # Records are pickled metamodel objects, they can only be read by
+        # the parser version that wrote them, like models in ModelCache
+        if key != model_key():
+            raise SnapshotError(file_name, "written by another version of "\
+                "DOMMLite parser")
+
+        offset = _HEADER.size
+        self._qid_offsets = _Column(self._map, offset, _OFFSET,\
+            self._count + 1, 0)
+        offset += (self._count + 1) * _OFFSET.size
+        self._records = offset
+        offset += self._count * _RECORD.size
+        self._rels = offset
+        self._rel_starts = _Column(self._map, offset, _REL, self._rel_count, 1)
+        offset += self._rel_count * _REL.size
+        rel_order = _Column(self._map, offset, _OFFSET, self._rel_count, 0)
+        self._rel_ends = _Column(self._map, self._rels, _REL,\
+            self._rel_count, 2, rel_order)
+        offset += self._rel_count * _OFFSET.size
+        self._refs = offset
+        self._ref_starts = _Column(self._map, offset, _REF, self._ref_count, 0)
+        offset += self._ref_count * _REF.size
+        ref_order = _Column(self._map, offset, _OFFSET, self._ref_count, 0)
+        self._ref_ends = _Column(self._map, self._refs, _REF,\
+            self._ref_count, 1, ref_order)
+        offset += self._ref_count * _OFFSET.size
+        self._strings = offset
+        offset += self._qid_offsets[self._count]
+        self._model_data = (offset, model_size)
+        self._data = offset + model_size
+        self._qids = _QidColumn(self)
+
+        self._elems = dict()
+        self._rel_objs = dict()
+        self._pending = []
+        self._model = None
+        self._loaded = False
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for index in xrange(self._count):
+            yield self._qid(index)
+
+    def __contains__(self, qid):
+        return self.index(qid) is not None
+
+    def _qid(self, index):
+        start = self._strings + self._qid_offsets[index]
+        return self._map[start:self._strings + self._qid_offsets[index + 1]]
+
+    def index(self, qid):
+        """
+        Returns index of the record with given qualified id or None.
+        """
+        if type(qid) is Qid:
+            qid = qid._canon
+        elif type(qid) is unicode:
+            qid = qid.encode("utf-8")
+        index = bisect.bisect_left(self._qids, qid)
+        if index < self._count and self._qid(index) == qid:
+            return index
+        return None
+
+    def _record(self, index):
+        return _RECORD.unpack_from(self._map,\
+            self._records + index * _RECORD.size)
+
+    def type_of(self, qid):
+        """
+        Returns type of the element with given qualified id, without
+        materialising it, or None if there's no such record.
+        """
+        index = self.index(qid)
+        if index is None:
+            return None
+        return RECORD_TYPES[self._record(index)[0]]
+
+    def __getitem__(self, qid):
+        retval = self.get(qid)
+        if retval is None:
+            raise KeyError(qid)
+        return retval
+
+    def get(self, qid, default = None):
+        """
+        Returns element with given qualified id, members of classifiers
+        included, or default if there's no such element.
+        """
+        index = self.index(qid)
+        if index is not None:
+            return self._element(index)
+        if type(qid) is Qid:
+            qid = qid._canon
+        if "." in qid:
+            owner, name = qid.rsplit(".", 1)
+            index = self.index(owner)
+            if index is not None:
+                return _members(self._element(index)).get(name, default)
+        return default
+
+    def rels_from(self, qid, rel_type = None):
+        """
+        Returns (rel_type, qid) pairs of relationships of given type (all
+        when None) going from element with given qid.
+        """
+        index = self.index(qid)
+        if index is None:
+            return []
+        retval = []
+        start = bisect.bisect_left(self._rel_starts, index)
+        end = bisect.bisect_right(self._rel_starts, index, start)
+        for pos in xrange(start, end):
+            rel = self._rel_data(pos)
+            if rel_type is None or _REL_TYPES[rel[0]] == rel_type:
+                retval.append((_REL_TYPES[rel[0]], self._qid(rel[2])))
+        return retval
+
+    def rels_to(self, qid, rel_type = None):
+        """
+        Returns (rel_type, qid) pairs of relationships of given type (all
+        when None) going to element with given qid.
+        """
+        index = self.index(qid)
+        if index is None:
+            return []
+        retval = []
+        start = bisect.bisect_left(self._rel_ends, index)
+        end = bisect.bisect_right(self._rel_ends, index, start)
+        for pos in xrange(start, end):
+            rel = self._rel_data(self._rel_ends._order[pos])
+            if rel_type is None or _REL_TYPES[rel[0]] == rel_type:
+                retval.append((_REL_TYPES[rel[0]], self._qid(rel[1])))
+        return retval
+
+    def refs_from(self, qid):
+        """
+        Returns qids of elements referred to by element with given qid or
+        its members, e.g. types of properties and extended classifiers.
+        """
+        index = self.index(qid)
+        if index is None:
+            return []
+        start = bisect.bisect_left(self._ref_starts, index)
+        end = bisect.bisect_right(self._ref_starts, index, start)
+        return [self._qid(_REF.unpack_from(self._map, self._refs\
+            + x * _REF.size)[1]) for x in xrange(start, end)]
+
+    def refs_to(self, qid):
+        """
+        Returns qids of elements referring to element with given qid.
+        """
+        index = self.index(qid)
+        if index is None:
+            return []
+        start = bisect.bisect_left(self._ref_ends, index)
+        end = bisect.bisect_right(self._ref_ends, index, start)
+        return [self._qid(self._ref_starts[self._ref_ends._order[x]])\
+            for x in xrange(start, end)]
+
+    def _rel_data(self, pos):
+        return _REL.unpack_from(self._map, self._rels + pos * _REL.size)
+
+    def _shell_model(self):
+        if self._model is None:
+            start, size = self._model_data
+            state = pickle.loads(self._map[start:start + size])
+            self._model = Model()
+            self._model.__dict__.update(state)
+        return self._model
+
+    def _shell(self, index):
+        """
+        Creates element of a record, without its state, which is set when
+        pending records are materialised.
+        """
+        elem_type = RECORD_TYPES[self._record(index)[0]]
+        elem = elem_type.__new__(elem_type)
+        self._elems[index] = elem
+        self._pending.append(index)
+        return elem
+
+    def _persistent_load(self, pid):
+        if pid == _MODEL_ID:
+            return self._shell_model()
+        if type(pid) is tuple:
+            return self._rel(pid[1])
+        elem = self._elems.get(pid)
+        if elem is None:
+            elem = self._shell(pid)
+        return elem
+
+    def _rel(self, pos):
+        rel = self._rel_objs.get(pos)
+        if rel is None:
+            rel_type, elem_a, elem_b, super_rel, min_a, min_b, max_a,\
+                max_b = self._rel_data(pos)
+            rel = RelObj.__new__(RelObj)
+            self._rel_objs[pos] = rel
+            rel.rel_type = _REL_TYPES[rel_type]
+            rel.elem_a = self._persistent_load(elem_a)
+            rel.elem_b = self._persistent_load(elem_b)
+            rel._super_rel = None if super_rel < 0 else self._rel(super_rel)
+            rel.min_a, rel.min_b, rel.max_a, rel.max_b = min_a, min_b,\
+                max_a, max_b
+        return rel
+
+    def _element(self, index):
+        elem = self._elems.get(index)
+        if elem is None:
+            elem = self._shell(index)
+            self._materialise()
+        return elem
+
+    def _materialise(self):
+        """
+        Sets state of all pending elements. Elements are created before
+        their state is read, so records can refer to each other in cycles.
+        """
+        while self._pending:
+            index = self._pending.pop()
+            _, _, offset, size = self._record(index)
+            start = self._data + offset
+            unpickler = pickle.Unpickler(StringIO(self._map[start:start\
+                + size]))
+            unpickler.persistent_load = self._persistent_load
+            state = unpickler.load()
+            elem = self._elems[index]
+            if hasattr(elem, "__setstate__"):
+                elem.__setstate__(state)
+            else:
+                elem.__dict__.update(state)
+
+    def model(self):
+        """
+        Returns the whole model, materialising all its elements.
+        """
+        model = self._shell_model()
+        if not self._loaded:
+            for index in xrange(self._count):
+                if index not in self._elems:
+                    self._shell(index)
+            self._materialise()
+            for index in xrange(self._count):
+                if not self._record(index)[1] & _TOP_LEVEL:
+                    continue
+                elem = self._elems[index]
+                if type(elem) is DataType:
+                    model.add_type(elem)
+                elif type(elem) is Package:
+                    model.add_package(elem)
+                else:
+                    model.add_constraint(elem)
+            model._rels = [self._rel(x) for x in xrange(self._rel_count)]
+            self._loaded = True
+        return model
+
+class _QidColumn(object):
+    """
+    Sorted qualified ids of snapshot records, as a sequence for bisect.
+    """
+    def __init__(self, snapshot):
+        super(_QidColumn, self).__init__()
+        self._snapshot = snapshot
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    def __getitem__(self, index):
+        return self._snapshot._qid(index)
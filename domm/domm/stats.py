@@ -0,0 +1,191 @@
+##############################################################################
+# Name: stats.py
+# Purpose: Timing and counters of DOMMLite parsing phases and actions
+# Author: Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# Copyright: (c) 2014 Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# License: MIT License
+#
+# Stats are only recorded by parsers created with profile = True, other
+# parsers call semantic actions directly and pay for a single attribute
+# check per parse.
+##############################################################################
+import time
+import json
+import contextlib
+
+# Phases of a parse, in the order they are run
+PHASES = ("grammar", "first_pass", "second_pass", "export")
+
+# Passes in which semantic actions are timed
+PASSES = ("first_pass", "second_pass")
+
+class Timer(object):
+    """
+    Number of calls, cumulative and maximal time of a timed piece of code.
+    """
+    def __init__(self):
+        super(Timer, self).__init__()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def as_dict(self):
+        return {"count": self.count, "total": round(self.total, 6),\
+            "max": round(self.max, 6)}
+
+class _TimedAction(object):
+    """
+    Semantic action recording time of each pass of the action it wraps.
+    second_pass is only defined when the wrapped action has it, since
+    Arpeggio looks for it to decide if the second pass is needed.
+
+    Passes are closures over bound methods of the wrapped action, so no
+    method objects are created per call, which would make garbage
+    collections of the whole parse tree more frequent.
+    """
+    def __init__(self, stats, action):
+        super(_TimedAction, self).__init__()
+        self.action = action
+        name = type(action).__name__
+
+        first_pass = action.first_pass
+        add_first = stats.action("first_pass", name).add
+        def timed_first_pass(parser, node, children):
+            start = time.time()
+            result = first_pass(parser, node, children)
+            add_first(time.time() - start)
+            return result
+        self.first_pass = timed_first_pass
+
+        if hasattr(action, "second_pass"):
+            second_pass = action.second_pass
+            add_second = stats.action("second_pass", name).add
+            def timed_second_pass(parser, node):
+                start = time.time()
+                result = second_pass(parser, node)
+                add_second(time.time() - start)
+                return result
+            self.second_pass = timed_second_pass
+
+class ParseStats(object):
+    """
+    Timers of parsing phases and of semantic actions by pass and action
+    class. Time of a semantic action doesn't include its children, so the
+    time of a pass not spent in actions is spent walking the parse tree.
+    Timers of actions are created when they are wrapped, actions that
+    weren't called have timers with no calls.
+
+    Attributes:
+        phases(dict): Timer of each phase in PHASES that was run
+        actions(dict): Timer by action class name, for each pass in PASSES
+    """
+    def __init__(self):
+        super(ParseStats, self).__init__()
+        self.phases = dict()
+        self.actions = dict((x, dict()) for x in PASSES)
+
+    def phase(self, name):
+        timer = self.phases.get(name)
+        if timer is None:
+            timer = self.phases[name] = Timer()
+        return timer
+
+    def action(self, pass_name, name):
+        actions = self.actions[pass_name]
+        timer = actions.get(name)
+        if timer is None:
+            timer = actions[name] = Timer()
+        return timer
+
+    def pass_total(self, pass_name):
+        """
+        Returns time spent in all actions of a pass.
+        """
+        return sum(x.total for x in self.actions[pass_name].itervalues())
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """
+        Adds the time spent in the with block to phase name.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phase(name).add(time.time() - start)
+
+    def wrap(self, sem_actions):
+        """
+        Returns semantic actions dict with every action timed.
+        """
+        return dict((x, _TimedAction(self, y))\
+            for x, y in sem_actions.iteritems())
+
+    def merge(self, other):
+        """
+        Adds timers of other ParseStats, e.g. ones from worker processes.
+        """
+        for name, timer in other.phases.iteritems():
+            self.phase(name).merge(timer)
+        for pass_name, actions in other.actions.iteritems():
+            for name, timer in actions.iteritems():
+                self.action(pass_name, name).merge(timer)
+
+    def as_dict(self):
+        """
+        Returns the stats as a dict of plain values, times are in seconds.
+        """
+        return {
+            "phases": dict((x, y.as_dict()) for x, y in\
+                self.phases.iteritems()),
+            "actions": dict((x, dict((z, w.as_dict()) for z, w in\
+                y.iteritems() if w.count)) for x, y in\
+                self.actions.iteritems()),
+        }
+
+    def collapsed(self):
+        """
+        Returns lines of collapsed stacks with self time in microseconds,
+        the input format of flame graph tools.
+        """
+        lines = []
+        for name in PHASES:
+            timer = self.phases.get(name)
+            if timer is None:
+                continue
+            own = timer.total
+            if name in self.actions:
+                for action, action_timer in\
+                    sorted(self.actions[name].iteritems()):
+                    if not action_timer.count:
+                        continue
+                    lines.append("parse;%s;%s %d" % (name, action,\
+                        action_timer.total * 1e6))
+                    own -= action_timer.total
+            lines.append("parse;%s %d" % (name, max(own, 0.0) * 1e6))
+        return lines
+
+    def write(self, file_name):
+        """
+        Writes the stats as JSON to file_name and as collapsed stacks to
+        file_name with .folded extension instead of .json.
+        """
+        with open(file_name, "w") as f:
+            json.dump(self.as_dict(), f, indent = 2, sort_keys = True)
+        folded_name = file_name
+        if folded_name.endswith(".json"):
+            folded_name = folded_name[:-len(".json")]
+        with open(folded_name + ".folded", "w") as f:
+            f.write("\n".join(self.collapsed()) + "\n")
+        return folded_name + ".folded"
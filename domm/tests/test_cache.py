@@ -0,0 +1,103 @@
+##############################################################################
+# Name: test_cache.py
+# Purpose: Test for caches used by DOMM parser
+# Author: Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# Copyright: (c) 2014 Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# License: MIT License
+##############################################################################
+import os
+import pytest
+from  domm.cache import ModelCache, main
+from  domm.parser import DommParser, parse_folder
+from  domm.metamodel import *
+
+SIMPLE = """model x
+    dataType int
+    package test {
+        entity Ent {
+            key { prop int id }
+        }
+    }"""
+
+def test_model_cache(tmpdir, monkeypatch):
+    cache = ModelCache(str(tmpdir))
+    parsed = DommParser(model_cache = cache).parse_model(SIMPLE)
+    assert len(cache.entries()) == 1
+
+    # A cache hit must not parse again
+    def fail_parse(self, content):
+        raise AssertionError("Content parsed again")
+    monkeypatch.setattr(DommParser, "parse", fail_parse)
+
+    cached = DommParser(model_cache = cache).parse_model(SIMPLE)
+    assert cached == parsed
+    assert cached is not parsed
+    int_type = cached["int"]
+    assert cached["test"]["Ent"]["id"].type_def._bound is int_type
+
+    # Cross reference mode is part of the key
+    with pytest.raises(AssertionError):
+        DommParser(skip_crossref = True, model_cache = cache)\
+            .parse_model(SIMPLE)
+
+def test_model_cache_lru(tmpdir):
+    cache = ModelCache(str(tmpdir))
+    models = ["model m%s dataType int" % x for x in range(3)]
+    keys = [cache.key(x, "v", False) for x in models]
+    for i, content in enumerate(models):
+        cache.put(keys[i], DommParser().parse_model(content))
+        os.utime(cache._path(keys[i]), (i, i))
+
+    # Using oldest entry makes it most recently used one
+    assert cache.get(keys[0]).name == "m0"
+    size = cache.entries()[-1][1]
+    cache.max_size = 2 * size
+    cache.prune()
+    assert [x[0] for x in cache.entries()] == [keys[2], keys[0]]
+
+    assert cache.get("missing") is None
+    with open(cache._path(keys[2]), "wb") as cache_file:
+        cache_file.write("not a pickle")
+    assert cache.get(keys[2]) is None
+    assert [x[0] for x in cache.entries()] == [keys[0]]
+
+def test_model_cache_prune(tmpdir, monkeypatch):
+    cache = ModelCache(str(tmpdir))
+    models = ["model m%s dataType int" % x for x in range(4)]
+    keys = [cache.key(x, "v", False) for x in models]
+    cache.put(keys[0], DommParser().parse_model(models[0]))
+    size = cache.entries()[0][1]
+    cache.max_size = 3 * size
+
+    # Cache folder is listed again only when it gets over max_size
+    listed = []
+    entries = ModelCache.entries
+    def count_entries(self):
+        listed.append(True)
+        return entries(self)
+    monkeypatch.setattr(ModelCache, "entries", count_entries)
+    for i in range(1, 4):
+        cache.put(keys[i], DommParser().parse_model(models[i]))
+        os.utime(cache._path(keys[i]), (i, i))
+    assert len(listed) == 1
+    assert len(cache.entries()) == 3
+
+def test_model_cache_cli(tmpdir, capsys):
+    cache = ModelCache(str(tmpdir))
+    cache.put(cache.key(SIMPLE, "v", False), DommParser().parse_model(SIMPLE))
+
+    main(["info", "--folder", str(tmpdir)])
+    assert "1 models" in capsys.readouterr()[0]
+
+    main(["prune", "--folder", str(tmpdir), "--max-size", "0"])
+    assert "Removed 1 models" in capsys.readouterr()[0]
+    assert cache.entries() == []
+
+def test_parse_folder_cache(tmpdir):
+    tmpdir.join("a.domm").write(SIMPLE)
+    cache = ModelCache(str(tmpdir.mkdir("cache")))
+    first = parse_folder(str(tmpdir), workers = 1, model_cache = cache)
+    second = parse_folder(str(tmpdir), workers = 1, model_cache = cache)
+    assert first.ok and second.ok
+    assert len(cache.entries()) == 1
+    assert second.models.values() == first.models.values()
@@ -0,0 +1,90 @@
+##############################################################################
+# Name: test_compare.py
+# Purpose: Test for structural diff of DOMMLite models
+# Author: Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# Copyright: (c) 2014 Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# License: MIT License
+##############################################################################
+from  domm.parser import DommParser
+from  domm.compare import diff
+from  domm.incremental import Edit
+from  domm.metamodel import *
+
+SOURCE = """model x
+    dataType int
+    package test {
+        service Base {}
+        service Serv {
+            op int run()
+        }
+        entity Ent {
+            key { prop int id }
+            prop int count
+        }
+        enum Color {
+            R "Red"
+            G "Green"
+        }
+        package inner {
+            valueObject Vo { prop int val }
+            exception Err { prop int code }
+        }
+    }"""
+
+def parse(content):
+    return DommParser().parse_model(content)
+
+def test_diff_same():
+    old = parse(SOURCE)
+    assert not diff(old, old)
+    assert not diff(old, parse(SOURCE))
+
+def test_diff():
+    old = parse(SOURCE)
+    new = parse(SOURCE.replace("prop int count", "prop int total")\
+        .replace('G "Green"', 'G "Lime" B "Blue"')\
+        .replace("service Serv {", "service Serv depends Base {")\
+        .replace("exception Err { prop int code }", "")\
+        .replace("package inner {", "package inner { entity Other {"\
+            " key { prop int id } }"))
+    result = diff(old, new)
+    assert sorted(result.added) == ["test.inner.Other"]
+    assert sorted(result.removed) == ["test.inner.Err"]
+    assert sorted(result.modified) == ["test.Color", "test.Ent", "test.Serv"]
+
+    ent = result.modified["test.Ent"]
+    assert ent.added.keys() == ["total"]
+    assert ent.removed.keys() == ["count"]
+    assert not ent.modified and not ent.changed
+    color = result.modified["test.Color"]
+    assert color.added.keys() == ["B"] and color.modified.keys() == ["G"]
+    assert result.modified["test.Serv"].changed == ["dependencies"]
+
+def test_diff_incremental():
+    parser = DommParser()
+    result = parser.parse_incremental(SOURCE)
+    old = parse(SOURCE)
+    start = result.content.index("prop int val")
+    result = parser.reparse(result, [Edit(start, start + len("prop int val"),\
+        "prop int value")])
+
+    changes = diff(old, result.model)
+    assert changes.modified.keys() == ["test.inner.Vo"]
+    assert changes.modified["test.inner.Vo"].added.keys() == ["value"]
+    assert changes.modified["test.inner.Vo"].removed.keys() == ["val"]
+
+def test_diff_required():
+    old = parse(SOURCE)
+    new = parse(SOURCE.replace("prop int count", "prop required int count"))
+    result = diff(old, new)
+    assert result.modified.keys() == ["test.Ent"]
+    assert result.modified["test.Ent"].modified.keys() == ["count"]
+
+def test_diff_compartment():
+    source = SOURCE.replace("prop int count", "prop int count"\
+        ' compartment extra "Extra" { prop int note }')
+    old = parse(source)
+    new = parse(source.replace('"Extra"', '"More"'))
+    result = diff(old, new)
+    assert result.modified.keys() == ["test.Ent"]
+    assert result.modified["test.Ent"].changed == ["compartments"]
@@ -0,0 +1,94 @@
+##############################################################################
+# Name: test_concurrent.py
+# Purpose: Test for parsing DOMMLite models from several threads
+# Author: Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# Copyright: (c) 2014 Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# License: MIT License
+##############################################################################
+import threading
+from  domm.parser import DommParser, ParserPool, ParseContext
+from  arpeggio import NoMatch
+from  domm.error import DommError
+from  domm.metamodel import *
+
+GOOD = """model %s
+    dataType int
+    package test {
+        entity Ent {
+            key { prop int id }
+            prop int count
+        }
+    }"""
+
+# Only valid when cross references are skipped
+UNCHECKED = """model unchecked
+    package test {
+        entity Ent {
+            key { prop int id }
+        }
+    }"""
+
+def run_threads(target, count):
+    threads = [threading.Thread(target = target, args = (x,))\
+        for x in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def parse_all(parse):
+    """
+    Parses models in threads with parse and returns the results by thread,
+    errors are returned by their type.
+    """
+    results = dict()
+    def work(index):
+        for _ in range(3):
+            skip_crossref = index % 2 == 0
+            content = UNCHECKED if index % 3 == 0 else GOOD % ("m%s" % index)
+            try:
+                result = parse(content, skip_crossref).name
+            except DommError as e:
+                result = type(e).__name__
+            results.setdefault(index, set()).add(result)
+    run_threads(work, 6)
+    return results
+
+EXPECTED = {0: set(["unchecked"]), 1: set(["m1"]), 2: set(["m2"]),\
+    3: set(["TypeNotFoundError"]), 4: set(["m4"]), 5: set(["m5"])}
+
+def test_parser_pool():
+    pool = ParserPool(2)
+    assert parse_all(pool.parse_model) == EXPECTED
+    assert pool._created <= 2
+
+def test_shared_parser():
+    parser = DommParser()
+    assert parse_all(parser.parse_model) == EXPECTED
+    assert parser.skip_crossref is False
+
+def test_parse_context():
+    parser = DommParser()
+    assert parser._test_parse(UNCHECKED).name == "unchecked"
+    assert parser.skip_crossref is False
+    with parser.parsing(parser.new_context(skip_crossref = True)) as context:
+        assert parser.parse_context is context and parser.skip_crossref
+        assert parser.new_context().skip_crossref
+    assert parser.parse_context is parser._defaults
+
+    # Semantic actions check debug output of the current parse
+    assert not parser.debug_actions
+    with parser.parsing(ParseContext(debugDomm = True)):
+        assert parser.debug_actions
+    assert not parser.debug_actions
+    parser.debugDomm = True
+    assert parser.debug_actions
+
+def test_syntax_error_message():
+    parser = DommParser()
+    try:
+        parser.parse_model("model x package {")
+    except NoMatch as e:
+        assert "Expected" in str(e)
+    else:
+        assert False
@@ -5,6 +5,7 @@
 # Copyright: (c) 2014 Daniel Fath <daniel DOT fath7 AT gmail DOT com>
 # License: MIT License
 ##############################################################################
+import pickle
 import pytest
 from  domm.parser import DommParser
 from  domm.metamodel import *
@@ -553,3 +554,258 @@ def test_bidir_reference():
     assert len(parsed1._rels) == 8
 
 
+
+def test_scoped_crossref():
+    parsed1 = DommParser()._test_crossref("""model x
+        dataType int
+        package sales {
+            valueObject Address {
+                prop int zip
+            }
+            entity Customer {
+                key { prop int id }
+                prop Address address
+            }
+            package billing {
+                valueObject Address {
+                    prop int iban
+                }
+                entity Invoice {
+                    key { prop int id }
+                    prop Address address
+                    prop sales.Address shipping
+                }
+            }
+        }
+        package support {
+            valueObject Address {
+                prop int room
+            }
+            entity Ticket extends sales.Customer {
+                key { prop int id }
+                prop Address address
+            }
+        }""")
+    # Repeated short names are resolved from the innermost package
+    assert parsed1.unique["Address"] == False
+    customer = parsed1["sales.Customer"]
+    invoice = parsed1["sales.billing.Invoice"]
+    ticket = parsed1["support.Ticket"]
+    assert customer["address"].type_def._bound is parsed1["sales.Address"]
+    assert invoice["address"].type_def._bound is\
+        parsed1["sales.billing.Address"]
+    assert invoice["shipping"].type_def._bound is parsed1["sales.Address"]
+    assert ticket["address"].type_def._bound is parsed1["support.Address"]
+    assert ticket.extends._bound is customer
+
+    assert parsed1.get_qid("Address") == ""
+    assert parsed1.get_qid("Address", invoice) == "sales.billing.Address"
+    assert parsed1.get_qid(Qid("billing.Address"), customer) ==\
+        "sales.billing.Address"
+    assert parsed1.get_qid("int", invoice) == "int"
+
+    # Names not visible from the scope must still be unique
+    with pytest.raises(TypeNotFoundError):
+        DommParser()._test_crossref("""model x
+        dataType int
+        package a {
+            valueObject Address { prop int zip }
+        }
+        package b {
+            valueObject Address { prop int room }
+        }
+        package c {
+            valueObject Person { prop Address home }
+        }""")
+
+def test_resolve_refs():
+    parsed1 = DommParser()._test_parse("""model x
+        dataType int
+        buildinValidator minLen(_int) appliesTo _prop
+        package test {
+            exception Err {
+                prop int code
+            }
+            service Serv {
+                op int run(int times) throws Err
+            }
+            entity Ent {
+                key { prop int id }
+            }
+            valueObject Vo depends Ent, Serv {
+                prop int val [minLen(2)]
+                prop Missing other
+            }
+        }""")
+    parsed1.resolve_refs()
+    vo = parsed1["test.Vo"]
+    run = parsed1["test.Serv.run"]
+    int_type = parsed1["int"]
+    assert vo["val"].type_def._bound is int_type
+    assert vo["val"].type_def._qid == "int"
+    assert list(vo["val"].constraints)[0]._qid == "minLen"
+    assert vo.dependencies[0]._bound is parsed1["test.Ent"]
+    # Wrong kind of element is left for the second pass to report
+    assert vo.dependencies[1]._qid == "test.Serv"
+    assert vo.dependencies[1]._bound is None
+    assert run.throws[0]._bound is parsed1["test.Err"]
+    assert run.params[0].type_def._bound is int_type
+    assert vo["other"].type_def._qid == ""
+    assert vo["other"].type_def._bound is None
+
+def test_rel_graph():
+    parsed1 = DommParser()._test_crossref("""model x
+        dataType int
+        package test {
+            service Base {}
+            service Serv extends Base depends Base {}
+            entity Ent depends Serv {
+                key { prop int id }
+            }
+            valueObject Vo {
+                prop int val
+            }
+            entity Holder {
+                key { prop int id }
+                prop +Vo vo
+            }
+        }""")
+    base = parsed1["test.Base"]
+    serv = parsed1["test.Serv"]
+    ent = parsed1["test.Ent"]
+    vo = parsed1["test.Vo"]
+    holder = parsed1["test.Holder"]
+    assert [x.elem_a for x in parsed1.rels_to(base, RelType.Extends)] == [serv]
+    assert len(parsed1.rels_to(base)) == 2
+    assert [x.elem_a for x in parsed1.rels_to(serv, RelType.Depends)] == [ent]
+    assert [x.elem_b for x in parsed1.rels_from(ent)] == [serv]
+    assert parsed1.rels_from(base) == []
+    composite = parsed1.rels_of_type(RelType.Composite)
+    assert [(x.elem_a, x.elem_b) for x in composite] == [(holder, vo)]
+
+    # Index is kept up to date and rebuilt after unpickling
+    rel = RelObj(RelType.Depends, holder, serv)
+    parsed1._add_rel(rel)
+    assert parsed1.rels_to(serv, RelType.Depends)[-1] is rel
+    parsed1._remove_rels([rel])
+    assert rel not in parsed1.rels_to(serv)
+    assert rel not in parsed1._rels
+    copied = pickle.loads(pickle.dumps(parsed1, pickle.HIGHEST_PROTOCOL))
+    assert len(copied.rels_of_type(RelType.Extends)) == 1
+
+def test_extends_closure():
+    parsed1 = DommParser()._test_crossref("""model x
+        dataType int
+        package test {
+            entity Base {
+                key { prop int id }
+            }
+            entity Mid extends Base {
+                key { prop int mid }
+            }
+            entity Leaf extends Mid {
+                key { prop int leaf }
+            }
+            entity Other extends Base {
+                key { prop int other }
+            }
+            service A depends B {}
+            service B depends A {}
+        }""")
+    base = parsed1["test.Base"]
+    mid = parsed1["test.Mid"]
+    leaf = parsed1["test.Leaf"]
+    other = parsed1["test.Other"]
+    assert parsed1.ancestors(leaf) == [mid, base]
+    assert parsed1.ancestors(base) == []
+    assert sorted(x.name for x in parsed1.descendants(base)) ==\
+        ["Leaf", "Mid", "Other"]
+    assert parsed1.is_ancestor(base, leaf)
+    assert not parsed1.is_ancestor(other, leaf)
+    assert parsed1.cycles(RelType.Extends) == []
+    cycles = parsed1.cycles(RelType.Depends)
+    assert [sorted(x.name for x in cycle) for cycle in cycles] == [["A", "B"]]
+
+    # Closure is computed again when relationships change
+    parsed1._add_rel(RelObj(RelType.Extends, base, leaf))
+    assert len(parsed1.cycles(RelType.Extends)) == 1
+
+def test_extends_cycle():
+    with pytest.raises(ExtendsCycleError):
+        DommParser()._test_crossref("""model x
+            package test {
+                service A extends C {}
+                service B extends A {}
+                service C extends B {}
+            }""")
+    with pytest.raises(ExtendsCycleError):
+        DommParser()._test_crossref("""model x
+            package test {
+                valueObject Vo extends Vo {}
+            }""")
+
+def test_effective_features():
+    parsed1 = DommParser()._test_crossref("""model x
+        dataType int
+        package test {
+            entity Base {
+                key { prop int id }
+                prop int name
+            }
+            entity Leaf extends Base {
+                key { prop int code }
+                prop int name
+                op int run()
+                compartment extra { prop int note }
+            }
+            valueObject Vo1 { prop int a }
+            valueObject Vo2 extends Vo1 { prop int b }
+        }""")
+    base = parsed1["test.Base"]
+    leaf = parsed1["test.Leaf"]
+    features = leaf.effective_features()
+    assert sorted(features) == ["code", "id", "name", "note", "run"]
+    assert features["name"] is leaf["name"]
+    assert features["id"] is base["id"]
+    assert sorted(leaf.effective_key()) == ["code", "id"]
+    assert sorted(base.effective_key()) == ["id"]
+    assert leaf.effective_features() is features
+    assert sorted(parsed1["test.Vo2"].effective_props()) == ["a", "b"]
+
+    # Changing an ancestor invalidates views of its descendants
+    base.add_feature(Property(type_def = TypeDef(name = "extra",\
+        type_of = "int")))
+    assert "extra" in leaf.effective_features()
+    assert "extra" not in features
+
+    copied = pickle.loads(pickle.dumps(parsed1, pickle.HIGHEST_PROTOCOL))
+    assert sorted(copied["test.Leaf"].effective_key()) == ["code", "id"]
+
+def test_constraint_shared(monkeypatch):
+    checked = []
+    check_params = Constraint.check_params
+    def count_params(self, constr):
+        checked.append(constr)
+        return check_params(self, constr)
+    monkeypatch.setattr(Constraint, "check_params", count_params)
+
+    parsed1 = DommParser()._test_crossref("""model x
+        dataType int
+        buildinValidator refTo (_ref) appliesTo _prop
+        package test {
+            entity Ent {
+                key { prop int id [refTo(Ent)] }
+                prop int a [refTo(Ent)]
+                prop int b [refTo(Ent)]
+                prop int c [refTo(int)]
+            }
+        }""")
+    ent = parsed1["test.Ent"]
+    specs = [list(ent[x].constraints)[0] for x in ["id", "a", "b", "c"]]
+    # References to the same element are checked once
+    assert len(checked) == 2
+    for spec in specs[:3]:
+        assert spec._bound is parsed1["refTo"]
+        assert spec.parameters[0]._bound is ent
+        assert spec.parameters[0].ref == Qid("test.Ent")
+    assert specs[3].parameters[0]._bound is parsed1["int"]
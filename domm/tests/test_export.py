@@ -0,0 +1,168 @@
+##############################################################################
+# Name: test_export.py
+# Purpose: Test for DOT export of DOMMLite models
+# Author: Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# Copyright: (c) 2014 Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# License: MIT License
+##############################################################################
+import pytest
+from StringIO import StringIO
+from  domm.parser import DommParser
+import domm.export
+from  domm.export import DommExport
+from  domm.metamodel import *
+from  domm.error import UnknownElementError
+
+SOURCE = """model x
+    dataType int
+    package test {
+        service Serv {
+            op int run(int times)
+        }
+        entity Ent depends Serv {
+            key { prop int id }
+            prop int count
+            op int total()
+            compartment extra { prop int note }
+        }
+        valueObject Vo { prop int val }
+        entity Holder {
+            key { prop int id }
+            prop +Vo vo
+        }
+    }"""
+
+def export(exporter, model):
+    out = StringIO()
+    exporter.write_model(model, out)
+    return out.getvalue()
+
+def test_export_stable():
+    first = export(DommExport(), DommParser().parse_model(SOURCE))
+    second = export(DommExport(), DommParser().parse_model(SOURCE))
+    assert first == second
+    assert '"test.Ent"[label = "{Ent|? count: int \\l? id: int \\l'\
+        'total() : int \\l|extra|? note: int \\l}"]' in first
+    assert '"test.Ent" -> "test.Serv" [style = dashed]' in first
+    assert '"test.Holder" -> "test.Vo" [dir = both, arrowtail=diamond]'\
+        in first
+
+def test_export_cache(monkeypatch):
+    model = DommParser().parse_model(SOURCE)
+    exporter = DommExport()
+    first = export(exporter, model)
+
+    rendered = []
+    render = DommExport.render
+    def count_render(self, elem, node_id):
+        rendered.append(elem.name)
+        return render(self, elem, node_id)
+    monkeypatch.setattr(DommExport, "render", count_render)
+
+    assert export(exporter, model) == first
+    assert rendered == []
+    model["test.Vo"].add_prop(Property(type_def = TypeDef(name = "other",\
+        type_of = "int")))
+    assert export(exporter, model) != first
+    assert rendered == ["Vo"]
+
+def test_export_cache_edit():
+    exporter = DommExport()
+    export(exporter, DommParser().parse_model(SOURCE))
+    result = export(exporter, DommParser().parse_model(SOURCE\
+        .replace("prop int count", "prop required int count")\
+        .replace("compartment extra", 'compartment extra "Extra"')))
+    assert '"test.Ent"[label = "{Ent|+ count: int \\l? id: int \\l'\
+        'total() : int \\l|Extra|? note: int \\l}"]' in result
+
+PACKAGES = """model x
+    dataType int
+    package base {
+        service Serv {
+            op int run(int times)
+        }
+        package inner {
+            valueObject Vo { prop int val }
+        }
+    }
+    package app {
+        entity Ent depends base.Serv {
+            key { prop int id }
+            prop +base.inner.Vo vo
+        }
+    }"""
+
+def test_export_partitions(tmpdir):
+    model = DommParser().parse_model(PACKAGES)
+    files = DommExport().export_partitions(model, str(tmpdir), workers = 1)
+    # Model isn't kept by the exporting process
+    assert domm.export._partition_state is None
+    assert sorted(files) == ["app", "base", "base.inner", "x"]
+    app = tmpdir.join("app.dot").read()
+    assert 'subgraph "cluster_app" {' in app
+    assert '"app.Ent" -> "base.Serv" [style = dashed]' in app
+    assert '"base.Serv"[label = "base.Serv", style = dashed,'\
+        ' URL = "base.dot"]' in app
+    assert '"base.Serv"[style = diagonals' in tmpdir.join("base.dot").read()
+
+    index = tmpdir.join("index.dot").read()
+    assert '"app"[label = "app (1)", URL = "app.dot"]' in index
+    assert '"app" -> "base" [label = "1"]' in index
+
+    # Partitions written by worker processes are the same
+    parallel = tmpdir.mkdir("parallel")
+    DommExport().export_partitions(model, str(parallel), workers = 2)
+    for name in ["app.dot", "base.dot", "base.inner.dot", "index.dot"]:
+        assert parallel.join(name).read() == tmpdir.join(name).read()
+
+def test_export_custom_partitions(tmpdir):
+    model = DommParser().parse_model(PACKAGES)
+    exporter = DommExport()
+    partitions = {"services": ["base"], "data": ["base.inner.Vo", "int"]}
+    assert exporter.partition(model, partitions) == {
+        "services": ["base.Serv"], "data": ["base.inner.Vo", "int"],
+        "app": ["app.Ent"]}
+    files = exporter.export_partitions(model, str(tmpdir), partitions,\
+        workers = 1)
+    assert sorted(files) == ["app", "data", "services"]
+    data = tmpdir.join("data.dot").read()
+    assert 'subgraph "cluster_base.inner" {' in data
+
+def test_export_focus_unknown():
+    model = DommParser().parse_model(SOURCE)
+    with pytest.raises(UnknownElementError) as error:
+        DommExport().write_model(model, StringIO(), focus = "test.Missing")
+    assert "test.Missing" in error.value.message
+
+def test_export_focus_cache():
+    exporter = DommExport()
+    for name in ["count", "amount", "size"]:
+        model = DommParser().parse_model(SOURCE.replace("prop int count",\
+            "prop int %s" % name))
+        exporter.write_model(model, StringIO(), focus = "test.Ent")
+        # Fragments of previous revisions of Ent aren't kept
+        assert len(exporter._fragments) == 2
+
+def test_export_focus():
+    model = DommParser().parse_model(PACKAGES.replace("package app {",\
+        "package app {\n        entity Order depends base.Serv {"\
+        " key { prop int id } }"))
+    exporter = DommExport()
+    assert sorted(exporter.neighbourhood(model, "base.inner.Vo")\
+        .itervalues()) == ["app.Ent", "base.inner.Vo"]
+    assert sorted(exporter.neighbourhood(model, "base.inner.Vo", depth = 2)\
+        .itervalues()) == ["app.Ent", "base.Serv", "base.inner.Vo"]
+    assert sorted(exporter.neighbourhood(model, "base.inner.Vo", depth = 3)\
+        .itervalues()) == ["app.Ent", "app.Order", "base.Serv",\
+        "base.inner.Vo"]
+    assert sorted(exporter.neighbourhood(model, "app.Ent", depth = 3,\
+        rel_types = [RelType.Depends]).itervalues()) == ["app.Ent",\
+        "app.Order", "base.Serv"]
+
+    out = StringIO()
+    exporter.write_model(model, out, focus = "app.Ent", depth = 1,\
+        rel_types = [RelType.Depends])
+    result = out.getvalue()
+    assert '"app.Ent" -> "base.Serv" [style = dashed]' in result
+    assert '"base.Serv"[style = diagonals' in result
+    assert '"base.inner.Vo"[' not in result and "Order" not in result
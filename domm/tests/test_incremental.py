@@ -0,0 +1,118 @@
+##############################################################################
+# Name: test_incremental.py
+# Purpose: Test for incremental reparsing of DOMMLite sources
+# Author: Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# Copyright: (c) 2014 Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# License: MIT License
+##############################################################################
+import pytest
+from  domm.parser import DommParser
+from  domm.incremental import Edit
+from  domm.metamodel import *
+from  arpeggio import NoMatch
+
+SOURCE = """model x
+    dataType int
+    buildinTagType all_tag appliesTo _entity _prop
+    package test {
+        entity Other {
+            key { prop int oid }
+        }
+        entity Ent {
+            key { prop int id }
+            prop Other other [all_tag]
+        }
+        package inner {
+            valueObject Vo { prop int val }
+        }
+    }"""
+
+def replace(result, old, new, nth = 0):
+    start = -1
+    for i in range(nth + 1):
+        start = result.content.index(old, start + 1)
+    return Edit(start, start + len(old), new)
+
+def check_full(result):
+    full = DommParser().parse_incremental(result.content)
+    assert result.model == full.model
+    assert sorted(result.model.unique.items()) ==\
+        sorted(full.model.unique.items())
+    assert [(x.name, x.start, x.end) for x in result.walk()] ==\
+        [(x.name, x.start, x.end) for x in full.walk()]
+    assert len(result.model._rels) == len(full.model._rels)
+
+@pytest.fixture
+def parser():
+    return DommParser()
+
+def test_blocks(parser):
+    result = parser.parse_incremental(SOURCE)
+    assert [(x.kind, x.name) for x in result.walk()] == [("type", "int"),\
+        ("type", "all_tag"), ("package", "test"), ("classifier", "Other"),\
+        ("classifier", "Ent"), ("package", "inner"), ("classifier", "Vo")]
+    for block in result.walk():
+        assert SOURCE[block.start:block.end].split()[1] == block.name
+
+def test_edit_classifier(parser):
+    result = parser.parse_incremental(SOURCE)
+    old_other = result.model["test.Other"]
+    result = parser.reparse(result, [replace(result, "prop int id",\
+        "prop int id prop int count")])
+    check_full(result)
+    ent = result.model["test.Ent"]
+    assert ent["count"].type_def._bound is result.model["int"]
+    # Blocks that weren't edited keep their elements
+    assert result.model["test.Other"] is old_other
+
+def test_rename_referenced(parser):
+    result = parser.parse_incremental(SOURCE)
+    # Edits can be given as tuples and in any order
+    ref = replace(result, "Other", "Another", 1)
+    result = parser.reparse(result, [(ref.start, ref.end, ref.text),\
+        replace(result, "Other", "Another")])
+    check_full(result)
+    other = result.model["test.Another"]
+    assert result.model["test.Ent"]["other"].type_def._bound is other
+    assert [x.elem_b for x in result.model._rels] == [other]
+
+def test_nested_package(parser):
+    result = parser.parse_incremental(SOURCE)
+    result = parser.reparse(result, [replace(result, "valueObject Vo",\
+        "valueObject Vo2")])
+    check_full(result)
+    assert result.model["test.inner.Vo2"] is not None
+
+def test_add_classifier(parser):
+    result = parser.parse_incremental(SOURCE)
+    # Inserting text next to a classifier reparses the enclosing package
+    result = parser.reparse(result, [replace(result, "entity Ent",\
+        "exception Err { prop int code }\n        entity Ent")])
+    check_full(result)
+    assert type(result.model["test.Err"]) is ExceptionType
+
+def test_edit_header(parser):
+    result = parser.parse_incremental(SOURCE)
+    result = parser.reparse(result, [replace(result, "model x", "model y")])
+    assert result.model.name == "y"
+    check_full(result)
+
+def test_errors(parser):
+    result = parser.parse_incremental(SOURCE)
+    with pytest.raises(TypeNotFoundError):
+        parser.reparse(result, [replace(result, "entity Other",\
+            "entity Another")])
+
+    result = parser.parse_incremental(SOURCE)
+    with pytest.raises(NoMatch):
+        parser.reparse(result, [replace(result, "prop int id", "prop int")])
+
+def test_rel_graph(parser):
+    result = parser.parse_incremental(SOURCE)
+    other = result.model["test.Other"]
+    assert len(result.model.rels_to(other)) == 1
+    result = parser.reparse(result, [replace(result, "prop Other other",\
+        "prop int other")])
+    check_full(result)
+    assert result.model.rels_to(other) == []
+    assert result.model.rels_of_type(RelType.Reference) == []
@@ -0,0 +1,166 @@
+##############################################################################
+# Name: test_lsp.py
+# Purpose: Test for the DOMMLite language server
+# Author: Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# Copyright: (c) 2014 Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# License: MIT License
+##############################################################################
+import json
+from StringIO import StringIO
+from  domm.lsp import LanguageServer, Document
+from  domm.client import PARSE_ERROR, INVALID_PARAMS, INTERNAL_ERROR
+
+URI = "file:///x.domm"
+
+SOURCE = """model x
+    dataType int
+    package test {
+        service Serv {}
+        entity Ent depends Serv {
+            key { prop int id }
+            prop Missing other
+        }
+        entity User {
+            key { prop int id }
+            prop Ent ent
+            prop Unknown bad
+        }
+    }"""
+
+def sent(server):
+    """
+    Returns messages written by server since the last call.
+    """
+    data = server.writer.getvalue()
+    server.writer.truncate(0)
+    messages = []
+    while data:
+        header, _, data = data.partition("\r\n\r\n")
+        length = int(header.split(":")[1])
+        messages.append(json.loads(data[:length]))
+        data = data[length:]
+    return messages
+
+def diagnostics(server):
+    return [x for x in sent(server)\
+        if x["method"] == "textDocument/publishDiagnostics"][-1]["params"]
+
+def position(text, line_text, column = 0):
+    lines = text.split("\n")
+    for line, content in enumerate(lines):
+        if line_text in content:
+            return {"line": line,\
+                "character": content.index(line_text) + column}
+
+def open_document(content = SOURCE):
+    server = LanguageServer(writer = StringIO())
+    server.handle({"jsonrpc": "2.0", "method": "textDocument/didOpen",\
+        "params": {"textDocument": {"uri": URI, "version": 1,\
+        "text": content}}})
+    return server
+
+def change(server, start, end, text, version = 2):
+    server.handle({"jsonrpc": "2.0", "method": "textDocument/didChange",\
+        "params": {"textDocument": {"uri": URI, "version": version},\
+        "contentChanges": [{"range": {"start": start, "end": end},\
+        "text": text}]}})
+
+def test_lsp_diagnostics():
+    server = open_document()
+    result = diagnostics(server)
+    assert result["uri"] == URI
+    errors = result["diagnostics"]
+    # Both wrong properties are reported, at their names
+    assert len(errors) == 2
+    assert all("TypeNotFoundError" in x["message"] for x in errors)
+    assert errors[0]["range"]["start"] == position(SOURCE, "other")
+    assert errors[1]["range"]["start"] == position(SOURCE, "bad")
+
+    # Only the edited entity is parsed again
+    start = position(SOURCE, "Unknown")
+    end = dict(start, character = start["character"] + len("Unknown"))
+    change(server, start, end, "Serv")
+    errors = diagnostics(server)["diagnostics"]
+    assert len(errors) == 1
+    assert errors[0]["range"]["start"] == position(SOURCE, "other")
+
+    doc = server.documents[URI]
+    assert doc.result.changed is not None
+    assert doc.result.model["test.User"].elems["bad"].type_def._bound\
+        is doc.result.model["test.Serv"]
+
+def test_lsp_syntax_error():
+    server = open_document()
+    start = position(SOURCE, "prop Ent ent")
+    change(server, start, start, "prop ")
+    errors = diagnostics(server)["diagnostics"]
+    assert len(errors) == 1 and "Expected" in errors[0]["message"]
+    assert errors[0]["range"]["start"]["line"] == start["line"]
+
+    change(server, start, dict(start, character = start["character"] + 5),\
+        "", 3)
+    assert len(diagnostics(server)["diagnostics"]) == 2
+
+def test_lsp_navigation():
+    server = open_document()
+    sent(server)
+    response = server.handle({"jsonrpc": "2.0", "id": 1,\
+        "method": "textDocument/definition", "params": {"textDocument":\
+        {"uri": URI}, "position": position(SOURCE, "Ent ent", 1)}})
+    assert response["result"]["range"]["start"] ==\
+        position(SOURCE, "entity Ent")
+
+    response = server.handle({"jsonrpc": "2.0", "id": 2,\
+        "method": "textDocument/references", "params": {"textDocument":\
+        {"uri": URI}, "position": position(SOURCE, "service Serv", 8),\
+        "context": {"includeDeclaration": True}}})
+    assert [x["range"]["start"] for x in response["result"]] ==\
+        [position(SOURCE, "service Serv"),\
+            position(SOURCE, "depends Serv", 8)]
+
+def test_lsp_errors():
+    server = open_document()
+    sent(server)
+    other = {"uri": "file:///other.domm"}
+    response = server.handle({"jsonrpc": "2.0", "id": 1,\
+        "method": "textDocument/definition", "params": {"textDocument":\
+        other, "position": {"line": 0, "character": 0}}})
+    assert response["result"] is None
+    response = server.handle({"jsonrpc": "2.0", "id": 2,\
+        "method": "textDocument/references", "params": {"textDocument":\
+        other, "position": {"line": 0, "character": 0}}})
+    assert response["result"] == []
+
+    assert server.handle({"jsonrpc": "2.0", "method":\
+        "textDocument/didChange", "params": {"textDocument": other,\
+        "contentChanges": [{"text": ""}]}}) is None
+    response = server.handle({"jsonrpc": "2.0", "id": 3,\
+        "method": "textDocument/definition", "params": [1]})
+    assert response["error"]["code"] == INVALID_PARAMS
+    response = server.handle({"jsonrpc": "2.0", "id": 4,\
+        "method": "textDocument/definition", "params": {"textDocument":\
+        {"uri": URI}, "position": {}}})
+    assert response["error"]["code"] == INTERNAL_ERROR
+
+def test_lsp_serve():
+    messages = ["{", json.dumps({"jsonrpc": "2.0", "id": 1,\
+        "method": "shutdown"}), json.dumps({"jsonrpc": "2.0",\
+        "method": "exit"})]
+    reader = StringIO("".join("Content-Length: %s\r\n\r\n%s" %\
+        (len(x), x) for x in messages))
+    server = LanguageServer(reader = reader, writer = StringIO())
+    server.serve()
+    responses = sent(server)
+    assert responses[0]["error"]["code"] == PARSE_ERROR
+    assert responses[1] == {"jsonrpc": "2.0", "id": 1, "result": None}
+
+def test_lsp_utf16():
+    # Characters outside of BMP are two UTF-16 code units in LSP positions
+    content = u'model x "\U0001F600" dataType int'.encode("utf-8")
+    doc = Document(URI, content)
+    offset = content.index("dataType")
+    assert doc.position(offset) == {"line": 0, "character": 13}
+    assert doc.offset({"line": 0, "character": 13}) == offset
+    assert doc.offset({"line": 0, "character": 11}) == content.index('" ')
+    # Position inside a surrogate pair is the start of the character
+    assert doc.offset({"line": 0, "character": 10}) == content.index('"') + 1
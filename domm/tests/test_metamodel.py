@@ -5,8 +5,13 @@
 # Copyright: (c) 2014 Daniel Fath <daniel DOT fath7 AT gmail DOT com>
 # License: MIT License
 ##############################################################################
+import pytest
+import cPickle as pickle
 from  domm.metamodel import Qid, Package, Property, ValueObject, Operation,\
-    ExceptionType, Key, Entity, TypeDef, Service, Model, DataType
+    ExceptionType, Key, Entity, TypeDef, Service, Model, DataType, Compartment,\
+    ApplyDef, CommonTag, ConstrDef, Constraint, ConstraintType, ConstraintSpec
+from  domm.error import ConstraintDoesntApplyError, WrongConstraintError,\
+    WrongConstraintAtPosError
 
 def test_qid():
     qid_from_str = Qid("test.x.a")
@@ -17,6 +22,14 @@ def test_qid():
     qid_outer = Qid(qid.path).add_outer_level("out")
     assert qid_outer == Qid(["out", "test", "x", "a"])
     assert qid_outer.depth() == 4
+    assert qid.depth() == 3
+
+    # Qids are interned and immutable
+    assert Qid("test.x.a") is qid
+    assert qid._canon == "test.x.a"
+    with pytest.raises(AttributeError):
+        qid.path = ("y",)
+    assert pickle.loads(pickle.dumps(qid, pickle.HIGHEST_PROTOCOL)) is qid
 
 def test_namespace_package():
     pack1 = Package(name = "test")
@@ -81,3 +94,142 @@ def test_model_unique():
     model.add_package(pack1)
     print('model.unique["id"] ',model.unique["id"])
     assert model.unique["id"] == False
+
+def test_namespace_nested():
+    prop = Property(type_def = TypeDef(name = "id", type_of = "int"))
+    vobj = ValueObject(name = "vo").add_prop(prop)
+    packs = [Package(name = "p%s" % x) for x in range(20)]
+    packs[-1].add_elem(vobj)
+    for outer, inner in zip(packs, packs[1:]):
+        outer.add_elem(inner)
+
+    path = [x.name for x in packs]
+    imported = packs[0]._imported
+    assert imported[Qid(path + ["vo", "id"])] is prop
+    assert imported[Qid(path + ["vo"])] is vobj
+    assert Qid(path[:2]) not in imported
+    assert len(imported) == 20
+
+    # Namespaces are views of the package tree, not copies
+    other = ValueObject(name = "other")
+    packs[10].add_elem(other)
+    assert imported[Qid(path[:11] + ["other"])] is other
+
+    model = Model(name = "deep").add_package(packs[0])
+    assert model.qual_elems[".".join(path + ["vo", "id"])] is prop
+    assert model.unique["id"] == ".".join(path + ["vo", "id"])
+    assert ".".join(path[:2]) not in model.qual_elems
+
+def test_lookup():
+    prop = Property(type_def = TypeDef(name = "id", type_of = "int"))
+    extra = Property(type_def = TypeDef(name = "extra", type_of = "int"))
+    comp = Compartment(name = "details", is_op = False).add_elem(extra)
+    ent = Entity(name = "Ent").set_key(Key().add_prop(prop))
+    ent.add_comparment(comp)
+    oper = Operation(type_def = TypeDef(name = "run", type_of = "int"))
+    serv = Service(name = "Serv").add_operation(oper)
+    inner = Package(name = "sub").add_elem(ent)
+    outer = Package(name = "pkg").add_elem(inner).add_elem(serv)
+    model = Model(name = "m").add_type(DataType(name = "int"))\
+        .add_package(outer)
+
+    assert model.lookup("pkg") is outer
+    assert model.lookup("pkg.sub") is inner
+    assert model.lookup("pkg.sub.Ent.id") is prop
+    assert model.lookup(Qid("pkg.sub.Ent.details.extra")) is extra
+    assert model.lookup(["pkg", "Serv", "run"]) is oper
+    assert model.lookup("int") == DataType(name = "int")
+    assert model.lookup("pkg.sub.Missing.id") is None
+    assert model.lookup("int.x") is None
+
+    # Item access keeps working
+    assert outer["sub"] is inner
+    assert outer["pkg.Serv"] is serv
+    assert outer["Missing"] is None
+    assert model["pkg"]["sub"]["Ent"]["details"]["extra"] is extra
+
+def test_constraint_checker():
+    applies = ApplyDef(to_prop = True, to_op = True)
+    assert applies.mask == 2 | 16
+    tag = CommonTag(name = "between", applies = applies,\
+        constr_def = ConstrDef(["_int", "_int"]))
+    constr = Constraint(tag = tag, constr_type = ConstraintType.Validator)
+    checker = constr.checker
+    assert checker is constr.checker
+    assert checker.types == (int, int) and checker.variadic is None
+    assert checker.check_params(ConstraintSpec(parameters = [1, 2]))
+    with pytest.raises(WrongConstraintAtPosError):
+        checker.check_params(ConstraintSpec(parameters = [1, u"2"]))
+    with pytest.raises(ConstraintDoesntApplyError):
+        constr.check_applies(Entity(name = "Ent"), "Ent")
+
+    tag = CommonTag(name = "oneOf", applies = applies,\
+        constr_def = ConstrDef(["_string", "..."]))
+    checker = Constraint(tag = tag).checker
+    assert checker.types == () and checker.variadic is unicode
+    assert checker.check_params(ConstraintSpec(parameters = []))
+    with pytest.raises(WrongConstraintError):
+        checker.check_params(ConstraintSpec(parameters = [u"a", 1]))
+
+def test_fingerprint():
+    def build(names):
+        pack = Package(name = "pkg")
+        for name in names:
+            prop = Property(type_def = TypeDef(name = "id", type_of = "int"))
+            pack.add_elem(Entity(name = name).set_key(Key().add_prop(prop)))
+        return pack
+
+    names = ["E%s" % x for x in range(50)]
+    pack1 = build(names)
+    pack2 = build(reversed(names))
+    # Equal elements have equal fingerprints regardless of insertion order
+    assert hash(pack1) == hash(pack2)
+    assert pack1 == pack2
+    assert pack1._fingerprint[-1] == hash(pack1)
+
+    # Changing an element invalidates fingerprints of enclosing ones
+    ent = pack2["E7"]
+    ent.add_feature(Property(type_def = TypeDef(name = "extra",\
+        type_of = "int")))
+    assert hash(pack1) != hash(pack2)
+    assert pack1 != pack2
+
+    copied = pickle.loads(pickle.dumps(pack1, pickle.HIGHEST_PROTOCOL))
+    assert hash(copied) == hash(pack1)
+    assert copied == pack1
+
+def test_fingerprint_scope():
+    def build(name):
+        model = Model(name = name)
+        base = Entity(name = "Base")
+        base.set_key(Key().add_prop(Property(type_def = TypeDef(name = "id",\
+            type_of = "int"))))
+        pack = Package(name = "pkg")
+        pack.add_elem(base)
+        model.add_package(pack)
+        return model
+
+    first = build("first")
+    second = build("second")
+    hash(first)
+    cached = first._fingerprint
+    effective = first["pkg.Base"].effective_features()
+
+    # Changes of another model or of elements outside of models keep values
+    # cached in the model
+    second["pkg.Base"].add_feature(Property(type_def = TypeDef(name = "n",\
+        type_of = "int")))
+    Entity(name = "Detached").add_feature(Property(type_def =\
+        TypeDef(name = "n", type_of = "int")))
+    assert first._fingerprint is cached and hash(first) == cached[-1]
+    assert first["pkg.Base"].effective_features() is effective
+
+    # Elements added to a model are part of it, so their changes invalidate
+    # values cached in the model
+    prop = Property(type_def = TypeDef(name = "n", type_of = "int"))
+    first["pkg.Base"].add_feature(prop)
+    assert hash(first) != cached[-1]
+    assert "n" in first["pkg.Base"].effective_features()
+    cached = hash(first)
+    prop.add_type_def(TypeDef(name = "n", type_of = "long"))
+    assert hash(first) != cached
@@ -0,0 +1,75 @@
+##############################################################################
+# Name: test_parse_folder.py
+# Purpose: Test for parsing folders of DOMMLite files
+# Author: Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# Copyright: (c) 2014 Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# License: MIT License
+##############################################################################
+import pytest
+from  domm.parser import parse_folder, parse_many, find_domm_files
+from  domm.metamodel import *
+
+GOOD = """model %s
+    dataType int
+    package test {
+        entity Ent {
+            key { prop int id }
+            compartment extra { prop int other }
+        }
+    }"""
+
+BAD = """model bad
+    package test {
+        entity Ent {
+            key { prop int id }
+        }
+    }"""
+
+@pytest.fixture
+def folder(tmpdir):
+    tmpdir.join("a.domm").write(GOOD % "a")
+    tmpdir.mkdir("sub").join("b.domm").write(GOOD % "b")
+    tmpdir.join("c.domm").write(BAD)
+    tmpdir.join("notes.txt").write("not a model")
+    return tmpdir
+
+def test_find_domm_files(folder):
+    found = find_domm_files(str(folder))
+    assert found == [str(folder.join("a.domm")), str(folder.join("c.domm")),\
+        str(folder.join("sub", "b.domm"))]
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_parse_folder(folder, workers):
+    result = parse_folder(str(folder), workers = workers)
+    assert len(result.results) == 3
+    assert not result.ok
+
+    models = result.models
+    assert len(models) == 2
+    model_a = models[str(folder.join("a.domm"))]
+    assert model_a.name == "a"
+    assert model_a["test"]["Ent"]["extra"]["other"] is\
+        model_a["test"]["Ent"]["other"]
+
+    errors = result.errors
+    assert list(errors) == [str(folder.join("c.domm"))]
+    assert "TypeNotFoundError" in errors[str(folder.join("c.domm"))]
+
+    for file_result in result.results:
+        assert file_result.wall_time >= 0
+        assert file_result.cpu_time >= 0
+
+@pytest.mark.parametrize("concurrency", [1, 2])
+def test_parse_many(folder, concurrency):
+    names = (str(folder.join(x)) for x in ["a.domm", "c.domm", "missing.domm",\
+        "sub/b.domm"])
+    results = dict((x.file_name, x) for x in parse_many(names,\
+        concurrency = concurrency, keep_models = False))
+    assert len(results) == 4
+    assert results[str(folder.join("a.domm"))].ok
+    assert results[str(folder.join("a.domm"))].model is None
+    assert "TypeNotFoundError" in results[str(folder.join("c.domm"))].error
+    assert "IOError" in results[str(folder.join("missing.domm"))].error
+
+    results = parse_many([str(folder.join("sub", "b.domm"))], concurrency)
+    assert next(results).model.name == "b"
@@ -0,0 +1,108 @@
+##############################################################################
+# Name: test_server.py
+# Purpose: Test for the DOMMLite validation daemon
+# Author: Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# Copyright: (c) 2014 Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# License: MIT License
+##############################################################################
+import json
+import socket
+import threading
+import pytest
+from  domm.server import DommServer, Validator
+from  domm.client import Client, RpcError, METHOD_NOT_FOUND, MODEL_ERROR,\
+    PARSE_ERROR, INVALID_PARAMS, INTERNAL_ERROR
+
+GOOD = """model x
+    dataType int
+    package test {
+        service Serv {}
+        entity Ent depends Serv {
+            key { prop int id }
+        }
+    }"""
+
+BAD = GOOD.replace("dataType int", "")
+
+@pytest.fixture
+def server(tmpdir):
+    validator = Validator(workers = 2)
+    validator.warm_up()
+    server = DommServer(str(tmpdir.join("domm.sock")), validator)
+    thread = threading.Thread(target = server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_server(server, tmpdir):
+    with Client(server.server_address) as client:
+        result = client.call("parse", content = GOOD)
+        assert result["model"] == "x"
+        assert result["elements"]["test.Ent"] == "Entity"
+        assert client.call("check", content = GOOD)["ok"]
+        result = client.call("check", content = BAD)
+        assert not result["ok"] and "TypeNotFoundError" in result["error"]
+
+        dot = client.call("export", content = GOOD, focus = "test.Serv")["dot"]
+        assert '"test.Ent" -> "test.Serv" [style = dashed]' in dot
+        output = str(tmpdir.join("x.dot"))
+        client.call("export", content = GOOD, output = output)
+        assert tmpdir.join("x.dot").read().startswith("\ndigraph x")
+
+        with pytest.raises(RpcError) as error:
+            client.call("parse", content = BAD)
+        assert error.value.code == MODEL_ERROR
+        with pytest.raises(RpcError) as error:
+            client.call("validate", content = GOOD)
+        assert error.value.code == METHOD_NOT_FOUND
+
+        stats = client.call("stats")
+        assert stats["requests"] == {"parse": 2, "check": 2, "export": 2}
+        assert stats["errors"] == {"parse": 1}
+        assert stats["latency_ms"]["parse"]["count"] == 2
+        # std.domm and the valid content are kept parsed
+        assert stats["models"] == 2
+
+def test_server_concurrent(server):
+    results = []
+    def work(index):
+        with Client(server.server_address) as client:
+            for _ in range(3):
+                results.append(client.call("check",\
+                    content = GOOD if index % 2 else BAD)["ok"])
+    threads = [threading.Thread(target = work, args = (x,)) for x in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == [False] * 6 + [True] * 6
+
+def test_server_invalid_json(server):
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.connect(server.server_address)
+    conn.sendall('{"method": \n')
+    response = json.loads(conn.makefile().readline())
+    assert response["error"]["code"] == PARSE_ERROR
+    conn.close()
+
+def test_server_invalid_params(server):
+    def fail():
+        raise TypeError("broken handler")
+    server.validator.methods["fail"] = fail
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.connect(server.server_address)
+    responses = conn.makefile()
+    for line, code in [\
+        ('{"id": 1, "method": "parse", "params": "x"}', INVALID_PARAMS),\
+        ('{"id": 2, "method": "parse", "params": {"source": "x"}}',\
+            INVALID_PARAMS),\
+        ('{"id": 3, "method": "stats", "params": [1]}', INVALID_PARAMS),\
+        ('{"id": 4, "method": "fail"}', INTERNAL_ERROR)]:
+        conn.sendall(line + "\n")
+        response = json.loads(responses.readline())
+        assert response["error"]["code"] == code
+    conn.sendall('{"id": 5, "method": "stats"}\n')
+    assert "requests" in json.loads(responses.readline())["result"]
+    conn.close()
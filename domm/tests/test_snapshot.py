@@ -0,0 +1,117 @@
+##############################################################################
+# Name: test_snapshot.py
+# Purpose: Test for binary snapshots of DOMMLite models
+# Author: Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# Copyright: (c) 2014 Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# License: MIT License
+##############################################################################
+import pytest
+import domm.snapshot
+from  domm.parser import DommParser
+from  domm.compare import diff
+from  domm.snapshot import save_snapshot, open_snapshot
+from  domm.metamodel import *
+from  domm.error import SnapshotError
+
+SOURCE = """model x
+    dataType int
+    package base {
+        service Serv {
+            op int run(int times)
+        }
+        entity Base {
+            key { prop int id }
+        }
+        valueObject Vo { prop int val }
+    }
+    package app {
+        entity Ent extends base.Base depends base.Serv {
+            key { prop int code }
+            prop +base.Vo vo
+            prop int count
+        }
+        entity Other {
+            key { prop int id }
+            prop Ent ent
+        }
+    }"""
+
+def save(tmpdir):
+    model = DommParser().parse_model(SOURCE)
+    file_name = str(tmpdir.join("x.snap"))
+    save_snapshot(model, file_name)
+    return model, file_name
+
+def test_snapshot_model(tmpdir):
+    model, file_name = save(tmpdir)
+    with open_snapshot(file_name) as snapshot:
+        loaded = snapshot.model()
+        assert loaded == model
+        assert sorted(loaded.qual_elems) == sorted(model.qual_elems)
+        ent = loaded["app.Ent"]
+        assert ent.extends._bound is loaded["base.Base"]
+        assert ent.elems["vo"].type_def._bound is loaded["base.Vo"]
+        assert ent._parent_model is loaded
+        assert loaded.ancestors(ent) == [loaded["base.Base"]]
+        assert not diff(model, loaded)
+
+def test_snapshot_lazy(tmpdir):
+    model, file_name = save(tmpdir)
+    snapshot = open_snapshot(file_name)
+    assert list(snapshot) == ["app", "app.Ent", "app.Other", "base",\
+        "base.Base", "base.Serv", "base.Vo", "int"]
+    assert snapshot.type_of("app.Ent") is Entity
+    assert snapshot.rels_from("app.Ent", RelType.Extends) ==\
+        [(RelType.Extends, "base.Base")]
+    assert snapshot.rels_to("app.Ent") == [(RelType.Reference, "app.Other")]
+    assert snapshot.refs_from("app.Other") == ["app.Ent", "int"]
+    assert snapshot.refs_to("base.Serv") == ["app.Ent"]
+    assert not snapshot._elems
+
+    vo = snapshot["base.Vo"]
+    assert type(vo) is ValueObject and vo == model["base.Vo"]
+    assert snapshot["base.Vo.val"] is vo.props["val"]
+    assert sorted(snapshot._elems) == [snapshot.index("base.Vo"),\
+        snapshot.index("int")]
+    assert snapshot.get("base.Missing") is None
+    with pytest.raises(KeyError):
+        snapshot["base.Vo.missing"]
+    assert snapshot.model()["base.Vo"] is vo
+    snapshot.close()
+
+def test_snapshot_version(tmpdir, monkeypatch):
+    model, file_name = save(tmpdir)
+    monkeypatch.setattr(domm.snapshot, "model_key", lambda: "0" * 40)
+    with pytest.raises(SnapshotError) as error:
+        open_snapshot(file_name)
+    assert "another version" in str(error.value)
+
+def test_snapshot_error(tmpdir):
+    path = tmpdir.join("bad.snap")
+    path.write("not a snapshot at all")
+    with pytest.raises(SnapshotError):
+        open_snapshot(str(path))
+    path.write("")
+    with pytest.raises(SnapshotError):
+        open_snapshot(str(path))
+
+def test_snapshot_container(tmpdir):
+    model = DommParser().parse_model("""model x
+        dataType int
+        package app {
+            entity A {
+                key { prop int id }
+                prop B[] bs <> a
+            }
+            entity B {
+                key { prop int id }
+                prop A a <> bs
+            }
+        }""")
+    file_name = str(tmpdir.join("x.snap"))
+    save_snapshot(model, file_name)
+    with open_snapshot(file_name) as snapshot:
+        loaded = snapshot.model()
+        assert loaded == model
+        rel = loaded.rel_graph.outgoing(loaded["app.A"])[0]
+        assert (rel.min_b, rel.max_b) == (0, -1)
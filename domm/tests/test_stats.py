@@ -0,0 +1,80 @@
+##############################################################################
+# Name: test_stats.py
+# Purpose: Test for timing of DOMMLite parsing phases and actions
+# Author: Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# Copyright: (c) 2014 Daniel Fath <daniel DOT fath7 AT gmail DOT com>
+# License: MIT License
+##############################################################################
+import json
+from StringIO import StringIO
+from  domm.parser import DommParser, parse_folder
+from  domm.export import DommExport
+from  domm.stats import ParseStats
+
+SOURCE = """model x
+    dataType int
+    package test {
+        entity Ent {
+            key { prop int id }
+            prop int count
+            op int total()
+        }
+    }"""
+
+def test_stats_disabled():
+    parser = DommParser()
+    parser.parse_model(SOURCE)
+    assert parser.profiler is None
+    assert parser.stats() == {"phases": {},\
+        "actions": {"first_pass": {}, "second_pass": {}}}
+
+def test_stats():
+    parser = DommParser(profile = True)
+    model = parser.parse_model(SOURCE)
+    DommExport(stats = parser.profiler).write_model(model, StringIO())
+    parser.parse_model(SOURCE, skip_crossref = True)
+
+    stats = parser.stats(reset = True)
+    phases = stats["phases"]
+    assert sorted(phases) == ["export", "first_pass", "grammar",\
+        "second_pass"]
+    assert phases["grammar"]["count"] == 2
+    assert phases["export"]["count"] == 1
+    assert phases["grammar"]["max"] <= phases["grammar"]["total"]
+
+    first_pass = stats["actions"]["first_pass"]
+    second_pass = stats["actions"]["second_pass"]
+    assert first_pass["PropertyAction"]["count"] == 4
+    assert first_pass["OperationAction"]["count"] == 2
+    assert second_pass["PropertyAction"]["count"] == 4
+    assert "IdAction" not in second_pass
+    assert parser.stats()["phases"] == {}
+
+def test_stats_collapsed(tmpdir):
+    parser = DommParser(profile = True)
+    parser.parse_model(SOURCE)
+    stats = ParseStats()
+    stats.merge(parser.profiler)
+    stats.merge(parser.profiler)
+    assert stats.phase("grammar").count == 2
+
+    lines = stats.collapsed()
+    assert lines[0].startswith("parse;grammar ")
+    assert any(x.startswith("parse;first_pass;PropertyAction ")\
+        for x in lines)
+    assert all(int(x.rsplit(" ", 1)[1]) >= 0 for x in lines)
+
+    folded = stats.write(str(tmpdir.join("profile.json")))
+    assert folded == str(tmpdir.join("profile.folded"))
+    data = json.loads(tmpdir.join("profile.json").read())
+    assert data["phases"]["grammar"]["count"] == 2
+    assert tmpdir.join("profile.folded").read().splitlines() == lines
+
+def test_stats_folder(tmpdir):
+    tmpdir.join("a.domm").write(SOURCE)
+    tmpdir.join("b.domm").write(SOURCE)
+    result = parse_folder(str(tmpdir), workers = 1)
+    assert result.stats is None
+    result = parse_folder(str(tmpdir), workers = 1, profile = True)
+    assert result.stats.phase("grammar").count == 2
+    assert all(x.stats.phase("grammar").count == 1 for x in result.results)